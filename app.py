@@ -1,16 +1,19 @@
 import os
 import secrets
 from werkzeug.utils import secure_filename
+from werkzeug.http import is_resource_modified
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask import Flask, render_template, session, redirect, url_for, request, jsonify, g
+from flask import Flask, render_template, session, redirect, url_for, request, jsonify, g, has_request_context, abort
 from flask_caching import Cache
 import sqlite3
 import random, string, json
 from urllib.parse import quote
 from functools import wraps, lru_cache
 from markupsafe import Markup
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import threading
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager
 import time
 import hashlib
@@ -22,7 +25,18 @@ from email.mime.multipart import MIMEMultipart
 import re
 import uuid
 import traceback
+import atexit
 from logging.handlers import RotatingFileHandler
+try:
+    import fcntl  # Cross-process write lock (not available on Windows)
+except ImportError:
+    fcntl = None
+from search import PrefixIndex, SearchResultCache, TrigramIndex
+from catalog import CatalogEngine, StaleSnapshot
+from cache_backends import memoize_swr, memo_stats
+from repository import Repository, OrderRepository, InvalidCursor, parse_subcategories, turkish_fold
+import migrations
+from migrations import SAMPLE_PRODUCTS
 
 app = Flask(__name__)
 # Generate secure secret key or use environment variable
@@ -30,9 +44,15 @@ app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
 UPLOAD_FOLDER = 'static/uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 31536000  # 1 year cache for static files
-app.config['CACHE_TYPE'] = 'SimpleCache'
+# Tüm worker'ların paylaştığı önbellek (cache_backends.py); CACHE_TYPE ile değiştirilebilir
+app.config['CACHE_TYPE'] = os.environ.get('CACHE_TYPE', 'cache_backends.SQLiteCache')
+app.config['CACHE_SQLITE_PATH'] = os.environ.get('CACHE_SQLITE_PATH') or (
+    os.path.join(os.getcwd(), 'cache.db') if os.environ.get('RENDER')
+    else os.path.join(app.root_path, 'instance', 'cache.db'))
 app.config['CACHE_DEFAULT_TIMEOUT'] = 1800  # 30 minutes (improved from 5)
-app.config['CACHE_THRESHOLD'] = 500  # Max cached items
+app.config['CACHE_THRESHOLD'] = int(os.environ.get('CACHE_THRESHOLD', '500'))  # Max cached items
+# A broken cache file (locked, disk full) is a cache miss, not a 500
+app.config['CACHE_IGNORE_ERRORS'] = os.environ.get('CACHE_IGNORE_ERRORS', '1').lower() not in ('0', 'false', 'no')
 app.config['TEMPLATES_AUTO_RELOAD'] = False  # Production mode
 
 # Initialize caching
@@ -64,27 +84,78 @@ app.logger.addHandler(error_handler)
 app.logger.setLevel(logging.INFO)
 app.logger.info('Pethome startup')
 
+# Tag-scoped cache invalidation. Every cached result passes the generations of
+# the tags it depends on into its memoized function, so they are part of the
+# cache key; bumping a tag is one cache.inc that orphans exactly the entries
+# carrying it (they age out with their timeout). Tags:
+#   products          every product listing (full invalidation only)
+#   catalog           cross-category aggregates (counts, overall popular list)
+#   category:<key>    catalog pages and popular list of one category
+#   stock             low-stock list and stock statistics
+#   campaigns         active campaigns
+#   reviews:<id>      review list of one product (HTTP validators only)
+#   ratings           review stats shown on catalog records (any product)
+# Each tag also records when it last moved, for Last-Modified headers.
+# Reads never write: a tag nobody has bumped is generation 0, so client-chosen
+# names (categories, product ids) can't fill the cache with permanent rows.
+def tag_generations(*tags):
+    """Current generation of each tag, to pass as the `generations` argument"""
+    try:
+        return tuple(generation or 0 for generation in cache.get_many(*[f"tag:{tag}" for tag in tags]))
+    except Exception as e:
+        print(f"Cache tag read error: {e}")
+        return (None,) * len(tags)
+
+def bump_tags(*tags):
+    for tag in set(tags):
+        key = f"tag:{tag}"
+        try:
+            # First bump (or after a clear) starts from the clock, so a tag never
+            # goes back to a generation that cached entries may still carry
+            cache.add(key, int(time.time() * 1000), timeout=0)
+            cache.cache.inc(key)
+            cache.set(f"tag-time:{tag}", time.time(), timeout=0)
+        except Exception as e:
+            print(f"Cache tag bump error for {tag}: {e}")
+
+def tags_last_modified(*tags):
+    """Latest time any of the tags moved, or None if unknown"""
+    try:
+        times = [t for t in cache.get_many(*[f"tag-time:{tag}" for tag in tags]) if t is not None]
+        return max(times) if times else None
+    except Exception as e:
+        print(f"Cache tag time read error: {e}")
+        return None
+
+def category_tag(category):
+    return f"category:{turkish_fold(category)}" if category else "catalog"
+
 # Cache invalidation helper functions
-def invalidate_product_cache(category=None):
-    """Invalidate product-related cache entries"""
-    cache.delete_memoized(get_popular_products)
-    cache.delete_memoized(get_product_count_by_category)
-    if category:
-        cache.delete_memoized(get_products_by_category, category)
-    else:
-        # Clear all category caches (more comprehensive but less efficient)
-        cache.clear()
-    print(f"Product cache invalidated for category: {category or 'all'}")
+def invalidate_product_cache(*categories):
+    """Invalidate product listings of the given categories (all listings when none given)"""
+    catalog_engine.invalidate()
+    tags = ["catalog"] + [category_tag(category) for category in categories if category]
+    if not categories:
+        tags.append("products")
+    bump_tags(*tags)
+    bump_catalog_version()
+    print(f"Product cache invalidated for category: {', '.join(filter(None, categories)) or 'all'}")
 
 def invalidate_campaign_cache():
     """Invalidate campaigns cache"""
-    cache.delete_memoized(get_campaigns)
+    bump_tags("campaigns")
     print("Campaign cache invalidated")
 
-def invalidate_brand_cache():
-    """Invalidate brands cache"""
-    cache.delete_memoized(get_brands)
-    print("Brand cache invalidated")
+def invalidate_stock_cache():
+    """Invalidate stock aggregates; listings don't depend on stock quantities"""
+    bump_tags("stock")
+    print("Stock cache invalidated")
+
+def invalidate_review_cache(product_id):
+    """New review: the product's review list and the ratings on catalog records.
+    Workers patch ratings in place on their next sync; no catalog reload."""
+    bump_tags(f"reviews:{product_id}", "ratings")
+    current_catalog_version()
 
 # Rate limiting system
 rate_limit_storage = defaultdict(list)
@@ -162,74 +233,377 @@ def sanitize_filename(filename):
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'svg', 'webp'}
 
 # Enhanced Database connection pool
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection frees up within the checkout timeout"""
+
+
 class DatabasePool:
-    def __init__(self, db_path, max_connections=20):  # Increased pool size
+    def __init__(self, db_path, max_connections=20, timeout=10.0,
+                 thread_affinity=False, health_check_interval=30.0, read_only=False):
         self.db_path = db_path
+        self.read_only = read_only  # query_only connections, writes go through DatabaseWriter
         self.max_connections = max_connections
-        self.connections = []
-        self.in_use = set()  # Track connections in use
+        self.timeout = timeout  # Max seconds a caller waits for a free connection
+        self.thread_affinity = thread_affinity  # Prefer the connection a thread used last
+        self.health_check_interval = health_check_interval
+        self.connections = []  # Idle connections, most recently returned last
+        self.in_use = {}  # id(conn) -> (conn, checkout timestamp)
+        self.last_checked = {}  # id(conn) -> last successful health check
+        self.thread_owner = {}  # thread ident -> id(conn) it used last
         self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
         self.created_count = 0
-        
-    def get_connection(self):
-        with self.lock:
-            if self.connections:
-                conn = self.connections.pop()
-                self.in_use.add(id(conn))
-                return conn
-            elif self.created_count < self.max_connections:
-                conn = sqlite3.connect(
-                    self.db_path, 
-                    check_same_thread=False,
-                    timeout=30.0,  # 30 second timeout
-                    isolation_level=None  # Autocommit mode for better performance
-                )
-                conn.row_factory = sqlite3.Row
-                # Enable WAL mode for better concurrency
-                conn.execute('PRAGMA journal_mode=WAL')
-                conn.execute('PRAGMA synchronous=NORMAL')  # Better performance
-                conn.execute('PRAGMA temp_store=MEMORY')   # Use memory for temp tables
-                conn.execute('PRAGMA mmap_size=268435456')  # 256MB memory map
-                self.created_count += 1
-                self.in_use.add(id(conn))
-                return conn
-            else:
-                # Pool exhausted, create temporary connection
-                conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30.0)
-                conn.row_factory = sqlite3.Row
-                return conn
-    
-    def return_connection(self, conn):
-        with self.lock:
-            conn_id = id(conn)
-            if conn_id in self.in_use:
-                self.in_use.remove(conn_id)
-                if len(self.connections) < self.max_connections:
-                    # Test connection health before returning to pool
+        self.waiting = 0
+        self.metrics = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'checkout_time_total': 0.0,
+            'checkout_time_max': 0.0,
+            'exhausted': 0,
+            'health_check_failures': 0,
+            'affinity_hits': 0,
+        }
+
+    def _create_connection(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            timeout=30.0,  # 30 second timeout
+            isolation_level=None  # Autocommit mode for better performance
+        )
+        conn.row_factory = sqlite3.Row
+        # Enable WAL mode for better concurrency
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')  # Better performance
+        conn.execute('PRAGMA temp_store=MEMORY')   # Use memory for temp tables
+        conn.execute('PRAGMA mmap_size=268435456')  # 256MB memory map
+        if self.read_only:
+            conn.execute('PRAGMA query_only=ON')
+        return conn
+
+    def _take_idle(self):
+        """Pop an idle connection, preferring the one this thread used last (lock held)"""
+        if self.thread_affinity:
+            owned = self.thread_owner.get(threading.get_ident())
+            for index, conn in enumerate(self.connections):
+                if id(conn) == owned:
+                    self.metrics['affinity_hits'] += 1
+                    return self.connections.pop(index)
+        return self.connections.pop()
+
+    def _is_healthy(self, conn):
+        """Run SELECT 1 only if the connection hasn't been checked recently"""
+        now = time.monotonic()
+        if now - self.last_checked.get(id(conn), 0) < self.health_check_interval:
+            return True
+        try:
+            conn.execute('SELECT 1').fetchone()
+            self.last_checked[id(conn)] = now
+            return True
+        except Exception:
+            return False
+
+    def get_connection(self, timeout=None):
+        """Check out a connection, waiting up to `timeout` seconds when the pool is exhausted"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            create = False
+            with self.available:
+                while not self.connections and self.created_count >= self.max_connections:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.metrics['exhausted'] += 1
+                        raise PoolTimeoutError(
+                            f"No database connection available after {timeout:.1f}s "
+                            f"({self.max_connections} in use)"
+                        )
+                    waited = True
+                    self.waiting += 1
                     try:
-                        conn.execute('SELECT 1').fetchone()
-                        self.connections.append(conn)
-                    except:
-                        conn.close()
-                        self.created_count -= 1
+                        self.available.wait(remaining)
+                    finally:
+                        self.waiting -= 1
+
+                if self.connections:
+                    conn = self._take_idle()
                 else:
-                    conn.close()
-            else:
-                # Temporary connection, just close it
+                    # Reserve the slot now, open the connection outside the lock
+                    self.created_count += 1
+                    create = True
+
+            if create:
+                try:
+                    conn = self._create_connection()
+                except Exception:
+                    with self.available:
+                        self.created_count -= 1
+                        self.available.notify()
+                    raise
+                self.last_checked[id(conn)] = time.monotonic()
+            elif not self._is_healthy(conn):
+                self._discard(conn)
+                with self.available:
+                    self.metrics['health_check_failures'] += 1
+                continue
+
+            now = time.monotonic()
+            wait_time = now - started
+            with self.lock:
+                self.in_use[id(conn)] = (conn, now)
+                self.thread_owner[threading.get_ident()] = id(conn)
+                self.metrics['checkouts'] += 1
+                if waited:
+                    self.metrics['waits'] += 1
+                    self.metrics['wait_time_total'] += wait_time
+                    self.metrics['wait_time_max'] = max(self.metrics['wait_time_max'], wait_time)
+            return conn
+
+    def _discard(self, conn):
+        """Close a connection and free its slot in the pool"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.available:
+            self.last_checked.pop(id(conn), None)
+            self.created_count -= 1
+            self.available.notify()
+
+    def return_connection(self, conn):
+        with self.available:
+            entry = self.in_use.pop(id(conn), None)
+            if entry is None:
+                # Not ours (already returned or foreign), just close it
                 conn.close()
-    
+                return
+            held = time.monotonic() - entry[1]
+            self.metrics['checkout_time_total'] += held
+            self.metrics['checkout_time_max'] = max(self.metrics['checkout_time_max'], held)
+
+            if conn.in_transaction:
+                # Don't hand a half-finished transaction to the next caller
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            self.connections.append(conn)
+            self.available.notify()
+
     def get_stats(self):
         """Get pool statistics for monitoring"""
         with self.lock:
+            checkouts = self.metrics['checkouts']
+            waits = self.metrics['waits']
             return {
                 'available': len(self.connections),
                 'in_use': len(self.in_use),
+                'waiting': self.waiting,
                 'total_created': self.created_count,
-                'max_connections': self.max_connections
+                'max_connections': self.max_connections,
+                'checkouts': checkouts,
+                'waits': waits,
+                'avg_wait_ms': round(self.metrics['wait_time_total'] / waits * 1000, 2) if waits else 0,
+                'max_wait_ms': round(self.metrics['wait_time_max'] * 1000, 2),
+                'avg_checkout_ms': round(self.metrics['checkout_time_total'] / checkouts * 1000, 2) if checkouts else 0,
+                'max_checkout_ms': round(self.metrics['checkout_time_max'] * 1000, 2),
+                'exhausted': self.metrics['exhausted'],
+                'health_check_failures': self.metrics['health_check_failures'],
+                'affinity_hits': self.metrics['affinity_hits'],
+            }
+
+# Single writer: every write in this process goes through one connection and thread
+class DatabaseWriter:
+    """Run queued write jobs on a dedicated thread, batching them into transactions.
+
+    Each job is a callable taking a Repository bound to the writer connection.
+    Jobs queued close together share one BEGIN IMMEDIATE ... COMMIT, each inside
+    its own savepoint so a failing job doesn't take the others down. A file lock
+    serializes the transaction across gunicorn workers; SQLITE_BUSY from anything
+    else (CLI, cron scripts) is retried with exponential backoff.
+    """
+
+    def __init__(self, db_path, batch_size=32, batch_window=0.002, max_retries=8, lock_path=None):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.batch_window = batch_window  # Seconds to wait for more jobs to join a batch
+        self.max_retries = max_retries
+        self.lock_path = lock_path
+        self.queue = queue.Queue()
+        self.thread = None
+        self.pid = None
+        self.start_lock = threading.Lock()
+        self.metrics_lock = threading.Lock()
+        self.metrics = {
+            'jobs': 0,
+            'failed_jobs': 0,
+            'batches': 0,
+            'max_batch': 0,
+            'busy_retries': 0,
+            'transaction_time_total': 0.0,
+            'transaction_time_max': 0.0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            timeout=0.1,  # Short busy timeout, backoff below handles longer contention
+            isolation_level=None
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def _ensure_started(self):
+        with self.start_lock:
+            if self.pid != os.getpid():
+                # Forked (gunicorn preload): the parent's thread and queue don't exist here
+                self.queue = queue.Queue()
+                self.thread = None
+                self.pid = os.getpid()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self.thread.start()
+
+    def submit(self, fn):
+        """Queue fn(repo) for the writer thread and return a Future with its result"""
+        self._ensure_started()
+        future = Future()
+        self.queue.put((fn, future))
+        return future
+
+    def execute(self, fn, timeout=30.0):
+        """Run fn(repo) in a write transaction and wait for the committed result"""
+        if threading.current_thread() is self.thread:
+            raise RuntimeError("execute() called from the writer thread would deadlock")
+        return self.submit(fn).result(timeout)
+
+    @contextmanager
+    def _process_lock(self):
+        if not self.lock_path or fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._run_batch(conn, batch)
+            except Exception as e:
+                # Connection is in an unknown state, start over with a fresh one
+                app.logger.error(f'DB writer batch failed: {e}')
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = self._connect()
+
+    def _run_batch(self, conn, batch):
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                with self._process_lock():
+                    results = self._run_transaction(conn, batch)
+                break
+            except sqlite3.OperationalError as e:
+                busy = 'locked' in str(e) or 'busy' in str(e)
+                if not busy or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                with self.metrics_lock:
+                    self.metrics['busy_retries'] += 1
+                time.sleep(min(0.5, 0.01 * (2 ** attempt)) * random.uniform(0.5, 1.0))
+
+        elapsed = time.monotonic() - started
+        with self.metrics_lock:
+            self.metrics['batches'] += 1
+            self.metrics['jobs'] += len(batch)
+            self.metrics['max_batch'] = max(self.metrics['max_batch'], len(batch))
+            self.metrics['transaction_time_total'] += elapsed
+            self.metrics['transaction_time_max'] = max(self.metrics['transaction_time_max'], elapsed)
+
+        # Only report back once the whole batch is committed
+        for future, result, error in results:
+            if error is not None:
+                with self.metrics_lock:
+                    self.metrics['failed_jobs'] += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _run_transaction(self, conn, batch):
+        repo = Repository(conn)
+        results = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for fn, future in batch:
+                conn.execute('SAVEPOINT job')
+                try:
+                    result = fn(repo)
+                except sqlite3.OperationalError as e:
+                    if 'locked' in str(e) or 'busy' in str(e):
+                        raise
+                    conn.execute('ROLLBACK TO job')
+                    conn.execute('RELEASE job')
+                    results.append((future, None, e))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO job')
+                    conn.execute('RELEASE job')
+                    results.append((future, None, e))
+                else:
+                    conn.execute('RELEASE job')
+                    results.append((future, result, None))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return results
+
+    def get_stats(self):
+        with self.metrics_lock:
+            batches = self.metrics['batches']
+            return {
+                'queued': self.queue.qsize(),
+                'jobs': self.metrics['jobs'],
+                'failed_jobs': self.metrics['failed_jobs'],
+                'batches': batches,
+                'avg_batch': round(self.metrics['jobs'] / batches, 2) if batches else 0,
+                'max_batch': self.metrics['max_batch'],
+                'busy_retries': self.metrics['busy_retries'],
+                'avg_transaction_ms': round(self.metrics['transaction_time_total'] / batches * 1000, 2) if batches else 0,
+                'max_transaction_ms': round(self.metrics['transaction_time_max'] * 1000, 2),
             }
 
 # Global database pool
 db_pool = None
+db_writer = None
 
 # Veritabanı yolu - production ortamında farklı konumda olabilir
 if os.environ.get('RENDER'):
@@ -239,13 +613,269 @@ else:
     # Yerel geliştirme ortamında
     db_path = os.path.join(app.root_path, "instance", "petshop.db")
 
+def create_db_pool():
+    """Build the pool from DB_POOL_* environment settings"""
+    return DatabasePool(
+        db_path,
+        max_connections=int(os.environ.get('DB_POOL_SIZE', '20')),
+        timeout=float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+        thread_affinity=os.environ.get('DB_POOL_THREAD_AFFINITY', '').lower() in ('1', 'true', 'yes'),
+        health_check_interval=float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', '30')),
+        read_only=True,
+    )
+
+def get_db_writer():
+    global db_writer
+    if not db_writer:
+        db_writer = DatabaseWriter(
+            db_path,
+            batch_size=int(os.environ.get('DB_WRITE_BATCH_SIZE', '32')),
+            batch_window=float(os.environ.get('DB_WRITE_BATCH_WINDOW_MS', '2')) / 1000,
+            lock_path=db_path + '.write-lock',
+        )
+    return db_writer
+
+def db_write(fn, timeout=30.0):
+    """Run fn(repo) in a write transaction on the writer thread and return its result"""
+    return get_db_writer().execute(fn, timeout)
+
+def db_write_async(fn):
+    """Queue a write whose result nobody waits for (e.g. last_login updates)"""
+    return get_db_writer().submit(fn)
+
+class PopularityTracker:
+    """Buffers product page views in memory and flushes them as one batched write"""
+
+    def __init__(self, flush_interval=30.0, max_pending=500):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = defaultdict(int)
+        self._pending_total = 0
+        self._last_flush = time.time()
+        self._stats = {'views_recorded': 0, 'flushes': 0, 'flush_errors': 0}
+
+    def record_view(self, product_id):
+        with self._lock:
+            self._pending[product_id] += 1
+            self._pending_total += 1
+            self._stats['views_recorded'] += 1
+            due = (self._pending_total >= self.max_pending or
+                   time.time() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return None
+            events = [(product_id, 'view', count) for product_id, count in self._pending.items()]
+            self._pending = defaultdict(int)
+            self._pending_total = 0
+            self._last_flush = time.time()
+            self._stats['flushes'] += 1
+        future = db_write_async(lambda repo: repo.popularity.record_many(events))
+        future.add_done_callback(self._on_flushed)
+        return future
+
+    def _on_flushed(self, future):
+        if future.exception() is not None:
+            with self._lock:
+                self._stats['flush_errors'] += 1
+            print(f"Popularity flush error: {future.exception()}")
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats, pending_views=self._pending_total)
+
+popularity_tracker = PopularityTracker(
+    flush_interval=float(os.environ.get('POPULARITY_FLUSH_INTERVAL', '30')),
+    max_pending=int(os.environ.get('POPULARITY_FLUSH_MAX_VIEWS', '500')),
+)
+
+@atexit.register
+def flush_popularity_on_exit():
+    future = popularity_tracker.flush()
+    if future is not None:
+        try:
+            future.result(timeout=5)
+        except Exception as e:
+            print(f"Popularity flush on exit failed: {e}")
+
+def load_suggest_terms():
+    with get_db_connection() as conn:
+        return [tuple(row) for row in Repository(conn).products.suggest_terms()]
+
+# Autocomplete and typo fallback: names and brands in memory, patched by the
+# admin product routes
+SEARCH_INDEX_MAX_AGE = float(os.environ.get('SUGGEST_INDEX_MAX_AGE', '300'))
+suggest_index = PrefixIndex(load_suggest_terms, max_age=SEARCH_INDEX_MAX_AGE)
+fuzzy_index = TrigramIndex(load_suggest_terms, max_age=SEARCH_INDEX_MAX_AGE)
+SEARCH_INDEXES = (suggest_index, fuzzy_index)
+
+def load_catalog_rows():
+    with get_db_connection() as conn:
+        products = []
+        for row in Repository(conn).products.catalog_rows():
+            product = dict(row)
+            product['subcategory'] = parse_subcategories(product['subcategory'])
+            product['subcategory_values'] = json.loads(product['subcategory_values'])
+            products.append(product)
+        return products
+
+# Category pages and facet counts from an in-memory snapshot; rebuilt after
+# invalidate_product_cache()
+catalog_engine = CatalogEngine(load_catalog_rows, max_age=SEARCH_INDEX_MAX_AGE,
+                               version=lambda: catalog_version['seen'])
+
+# /api/search responses; an entry dies with the catalog version it was computed under
+search_cache = SearchResultCache(
+    lambda: catalog_engine.generation,
+    max_size=int(os.environ.get('SEARCH_CACHE_SIZE', '1000')),
+    ttl=float(os.environ.get('SEARCH_CACHE_TTL', '300')),
+)
+
+# Catalog version shared by all workers through the cache backend. Bumped by
+# invalidate_product_cache(); every worker polls it and drops its in-memory
+# catalog snapshot and search indexes when another worker changed products.
+CATALOG_VERSION_KEY = 'catalog_version'
+CATALOG_VERSION_CHECK_INTERVAL = float(os.environ.get('CATALOG_VERSION_CHECK_INTERVAL', '1'))
+catalog_version = {'seen': None, 'ratings': None, 'checked_at': 0.0}
+
+def drop_local_catalog_state():
+    catalog_engine.invalidate()
+    for index in SEARCH_INDEXES:
+        index.expire()
+
+def refresh_catalog_ratings():
+    """Review stats changed somewhere: patch ratings into the snapshot (one small query)"""
+    try:
+        with get_db_connection() as conn:
+            ratings = {row[0]: (row[1], row[2]) for row in Repository(conn).reviews.catalog_ratings()}
+        changed = catalog_engine.update_ratings(ratings)
+        print(f"Catalog ratings refreshed: {changed} product(s) changed")
+    except Exception as e:
+        print(f"Catalog ratings refresh error: {e}")
+        catalog_engine.invalidate()
+
+def bump_catalog_version():
+    try:
+        # Seed a missing (cleared/evicted) counter from the clock so it never
+        # repeats a value some worker has already seen
+        cache.cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), timeout=0)
+        version = cache.cache.inc(CATALOG_VERSION_KEY)
+    except Exception as e:
+        print(f"Catalog version bump error: {e}")
+        return
+    # A gap means another worker changed the catalog since our last check
+    if catalog_version['seen'] is not None and version != catalog_version['seen'] + 1:
+        drop_local_catalog_state()
+    catalog_version['seen'] = version
+
+def current_catalog_version():
+    """Sync with the shared catalog version now and return it. The catalog snapshot
+    is stale until rebuilt under this version, so call this before computing
+    anything that gets cached across workers."""
+    catalog_version['checked_at'] = time.time()
+    try:
+        version, ratings = cache.get_many(CATALOG_VERSION_KEY, 'tag:ratings')
+    except Exception as e:
+        print(f"Catalog version check error: {e}")
+        version = ratings = None
+    ratings = ratings or 0  # like tag_generations: never bumped is generation 0
+    if ratings != catalog_version['ratings']:
+        # A reload below (or a pending one) reads fresh ratings anyway
+        if catalog_version['ratings'] is not None and version == catalog_version['seen'] \
+                and not catalog_engine.stale:
+            refresh_catalog_ratings()
+        catalog_version['ratings'] = ratings
+    if version is None:
+        # Never bumped, cleared or unreadable: no news about product changes
+        return catalog_version['seen']
+    if catalog_version['seen'] is not None and version != catalog_version['seen']:
+        print(f"Catalog version {catalog_version['seen']} -> {version}, reloading in-memory catalog")
+        drop_local_catalog_state()
+    catalog_version['seen'] = version
+    return version
+
+@app.before_request
+def sync_catalog_version():
+    # Search indexes and other in-memory state; cached catalog pages sync on their own
+    if time.time() - catalog_version['checked_at'] >= CATALOG_VERSION_CHECK_INTERVAL:
+        current_catalog_version()
+
+def refresh_search_indexes(product_id):
+    """Re-read one product into the in-memory indexes (drops it if deleted or out of stock)"""
+    try:
+        rows = get_repo().products.suggest_terms(product_id)
+        for index in SEARCH_INDEXES:
+            if rows:
+                index.upsert_product(*tuple(rows[0]))
+            else:
+                index.remove_product(product_id)
+    except Exception as e:
+        print(f"Search index refresh error: {e}")
+
+# Request-scoped connection: one pool checkout per request, returned on teardown
+DB_QUERY_WARN_THRESHOLD = int(os.environ.get('DB_QUERY_WARN_THRESHOLD', '25'))
+
+def get_db():
+    """Return the connection bound to the current request, checking one out on first use"""
+    global db_pool
+    if 'db_conn' not in g:
+        if not db_pool:
+            db_pool = create_db_pool()
+        conn = db_pool.get_connection()
+        g.db_query_count = 0
+
+        def count_query(statement):
+            # Skip trigger sub-statements and FTS5's own shadow-table queries
+            if statement.startswith('--') or "'main'." in statement:
+                return
+            g.db_query_count += 1
+
+        conn.set_trace_callback(count_query)
+        g.db_conn = conn
+    return g.db_conn
+
+def get_repo():
+    """Repositories bound to the request connection"""
+    if 'repo' not in g:
+        g.repo = Repository(get_db())
+    return g.repo
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db_conn', None)
+    g.pop('repo', None)
+    if conn is not None:
+        conn.set_trace_callback(None)
+        db_pool.return_connection(conn)
+
+@app.after_request
+def report_query_count(response):
+    query_count = g.get('db_query_count')
+    if query_count is not None:
+        response.headers['X-DB-Queries'] = str(query_count)
+        if query_count > DB_QUERY_WARN_THRESHOLD:
+            app.logger.warning(f'{request.endpoint} ran {query_count} queries')
+    return response
+
 # Database connection context manager
 @contextmanager
 def get_db_connection():
-    """Context manager for database connections with connection pooling"""
+    """Context manager for database connections with connection pooling.
+
+    Inside a request this reuses the request-scoped connection from get_db();
+    outside one (startup, background threads) it checks out its own.
+    """
     global db_pool
+    if has_request_context():
+        yield get_db()
+        return
+
     if not db_pool:
-        db_pool = DatabasePool(db_path)
+        db_pool = create_db_pool()
     
     conn = db_pool.get_connection()
     try:
@@ -256,6 +886,7 @@ def get_db_connection():
 
 # Veritabanı başlatma fonksiyonu
 def init_database():
+    """Create local folders and bring the schema up to date (no-op when current)"""
     # Yerel geliştirme için instance klasörü
     if not os.environ.get('RENDER'):
         instance_dir = os.path.join(app.root_path, "instance")
@@ -266,277 +897,87 @@ def init_database():
     if not os.path.exists(UPLOAD_FOLDER):
         os.makedirs(UPLOAD_FOLDER)
 
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    # Products tablosunu oluştur
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS products (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        price REAL NOT NULL,
-        image TEXT,
-        category TEXT,
-        subcategory TEXT,
-        description TEXT,
-        in_stock INTEGER DEFAULT 1,
-        brand TEXT
-    )
-    """)
-
-    # Orders tablosunu oluştur
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS orders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        order_code TEXT NOT NULL,
-        items TEXT NOT NULL,
-        total_price REAL NOT NULL,
-        customer_name TEXT,
-        address TEXT,
-        note TEXT,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-        status TEXT DEFAULT 'Hazırlanıyor'
-    )
-    """)
-
-    # Messages tablosunu oluştur
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        email TEXT NOT NULL,
-        phone TEXT,
-        message TEXT NOT NULL,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-
-    # Users tablosunu oluştur
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        email TEXT UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL,
-        first_name TEXT NOT NULL,
-        last_name TEXT NOT NULL,
-        phone TEXT,
-        address TEXT,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-        last_login DATETIME,
-        email_verified INTEGER DEFAULT 0,
-        is_active INTEGER DEFAULT 1
-    )
-    """)
-
-    # Wishlist tablosunu oluştur
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS wishlist (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        product_id INTEGER NOT NULL,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id),
-        FOREIGN KEY (product_id) REFERENCES products (id),
-        UNIQUE(user_id, product_id)
-    )
-    """)
-
-    # Reviews tablosunu oluştur
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS reviews (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        product_id INTEGER NOT NULL,
-        rating INTEGER NOT NULL CHECK (rating >= 1 AND rating <= 5),
-        title TEXT,
-        comment TEXT,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-        is_verified INTEGER DEFAULT 0,
-        FOREIGN KEY (user_id) REFERENCES users (id),
-        FOREIGN KEY (product_id) REFERENCES products (id)
-    )
-    """)
-
-    # Newsletter subscriptions tablosunu oluştur
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS newsletter_subscriptions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        email TEXT UNIQUE NOT NULL,
-        is_active INTEGER DEFAULT 1,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-        unsubscribed_at DATETIME
-    )
-    """)
-
-    # Campaigns tablosunu oluştur
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS campaigns (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT,
-        description TEXT,
-        image TEXT,
-        link TEXT,
-        active INTEGER DEFAULT 1,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
+    return migrations.migrate(db_path)
 
-    # Create performance-enhancing indexes
-    try:
-        # Products table indexes
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products(category)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_brand ON products(brand)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_price ON products(price)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_in_stock ON products(in_stock)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category_brand ON products(category, brand)")
-        
-        # Orders table indexes
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_code ON orders(order_code)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_customer_email ON orders(customer_email)")
-        
-        # Messages table indexes
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_email ON messages(email)")
-        
-        # Campaigns table indexes
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_campaigns_active ON campaigns(active)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_campaigns_created_at ON campaigns(created_at)")
-        
-        print("Database indexes created successfully!")
-    except Exception as e:
-        print(f"Index creation error: {e}")
-
-    # Add sample products if database is empty
-    cursor.execute("SELECT COUNT(*) FROM products")
-    product_count = cursor.fetchone()[0]
-    
-    if product_count == 0:
-        print("🌱 Adding sample products...")
-        sample_products = [
-            ("Royal Canin Kitten Mama", 450.0, "/static/uploads/1.webp", "Kedi", '["Mama"]', "2-12 aylık yavrular için özel formül kedi maması", "Royal Canin"),
-            ("Lavital Kitten Somonlu Yavru Kedi Maması 1.5 KG", 340.0, "/static/uploads/2.webp", "Kedi", '["Mama"]', "6-52 hafta - 12 aylık dönemdeki yavru kediler için özel formüle edilen bir yavru kedi mamasıdır.", "Lavital"),
-            ("Whiskas Yetişkin Kedi Maması", 280.0, "/static/uploads/3.webp", "Kedi", '["Mama"]', "Yetişkin kediler için dengeli beslenme", "Whiskas"),
-            ("Pro Plan Köpek Maması", 520.0, "/static/uploads/4.webp", "Köpek", '["Mama"]', "Yetişkin köpekler için premium mama", "Pro Plan"),
-            ("Pedigree Köpek Maması", 380.0, "/static/uploads/5.webp", "Köpek", '["Mama"]', "Köpeklerin sağlıklı yaşamı için", "Pedigree"),
-            ("Kedi Oyuncağı Top", 45.0, "/static/uploads/6.webp", "Kedi", '["Oyuncak"]', "Renkli kedi oyun topu", "Generic"),
-            ("Köpek Tasması", 120.0, "/static/uploads/7.webp", "Köpek", '["Aksesuar"]', "Ayarlanabilir köpek tasması", "Generic"),
-            ("Kedi Kumu 10L", 85.0, "/static/uploads/8.webp", "Kedi", '["Bakım"]', "Kokusuz kedi kumu", "Generic"),
-            ("Balık Yemi", 25.0, "/static/uploads/9.webp", "Balık", '["Yem"]', "Tropikal balıklar için yem", "Generic"),
-            ("Kuş Yemi", 35.0, "/static/uploads/10.webp", "Kuş", '["Yem"]', "Muhabbet kuşları için karma yem", "Generic"),
-        ]
-        
-        for product in sample_products:
-            cursor.execute("""
-                INSERT INTO products (name, price, image, category, subcategory, description, brand, in_stock)
-                VALUES (?, ?, ?, ?, ?, ?, ?, 1)
-            """, product)
-        
-        print(f"✅ {len(sample_products)} sample products added!")
-    else:
-        print(f"📦 Database already has {product_count} products")
 
-    # Add user balance column if not exists
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN balance REAL DEFAULT 0.0")
-        print("✅ Balance column added to users table!")
-    except Exception as e:
-        print(f"Balance column already exists or error: {e}")
+@app.cli.command("migrate")
+def migrate_command():
+    """Apply pending schema migrations"""
+    applied = init_database()
+    print(f"Schema at version {migrations.latest_version()} ({len(applied)} migration(s) applied)")
+
+
+@app.cli.command("check-indexes")
+def check_indexes_command():
+    """Fail if the SQL listings the app still runs fall back to a full table scan.
 
-    conn.commit()
+    Category pages and brand lists come from the in-memory catalog engine; what
+    is left in SQLite is search, the admin stock/order/message pages and the
+    popularity lists. Runs those repository queries (first and second page) on a
+    traced connection and checks the EXPLAIN QUERY PLAN of every statement.
+    """
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    statements = []
+    conn.set_trace_callback(statements.append)
+    repo = Repository(conn)
+    pagers = [
+        lambda cursor: repo.products.search_page("mama", cursor=cursor, limit=SEARCH_PAGE_SIZE),
+        lambda cursor: repo.products.search_page("mama", "KEDİ", cursor, SEARCH_PAGE_SIZE),
+        lambda cursor: repo.products.stock_page(cursor, ADMIN_PAGE_SIZE),
+        lambda cursor: repo.orders.page(cursor, ADMIN_PAGE_SIZE),
+        lambda cursor: repo.messages.page(cursor, ADMIN_PAGE_SIZE),
+    ]
+    for pager in pagers:
+        _, next_cursor = pager(None)
+        if next_cursor:
+            pager(next_cursor)
+    repo.products.search_count("mama", "KEDİ")
+    repo.popularity.top(limit=10)
+    for category in ("Köpek", "KEDİ", "kuş"):
+        repo.popularity.top(category, 4)
+    conn.set_trace_callback(None)
+
+    # FTS5 reads its own shadow tables through the same connection; only plans
+    # touching the app's tables matter
+    statements = [statement for statement in statements if statement.lstrip().upper().startswith("SELECT")]
+    failures = 0
+    for statement in statements:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + statement)]
+        scans = [step for step in plan
+                 if re.match(r"SCAN (products|p|orders|messages|product_popularity|pp)$", step)]
+        if scans:
+            failures += 1
+            print(f"❌ {' '.join(statement.split())}\n   " + "\n   ".join(plan))
     conn.close()
-    print("Database initialized successfully!")
+    print(f"{len(statements) - failures}/{len(statements)} queries use an index")
+    if failures:
+        raise SystemExit(1)
 
 
-# Uygulama başlatıldığında veritabanını oluştur
+# Uygulama başlatıldığında şemayı kontrol et. AUTO_MIGRATE=0 ile kapatılırsa
+# migration deploy öncesi "flask --app app migrate" ile çalıştırılmalıdır.
 print(f"🚀 Pethome startup")
 print(f"🗄️ Database path: {db_path}")
-print(f"📁 Database exists before init: {os.path.exists(db_path)}")
 
 try:
-    init_database()
-    print(f"✅ Database initialized successfully!")
-    print(f"📁 Database exists after init: {os.path.exists(db_path)}")
+    if os.environ.get('AUTO_MIGRATE', '1').lower() not in ('0', 'false', 'no'):
+        init_database()
     
     # Initialize database pool after database is ready
-    db_pool = DatabasePool(db_path)
+    db_pool = create_db_pool()
     print(f"🏊 Database pool initialized")
+
+    current_catalog_version()  # build the snapshot under the current shared version
+    for index in SEARCH_INDEXES + (catalog_engine,):
+        index.rebuild()
+    print(f"🔤 Search indexes built: {suggest_index.get_stats()['keys']} prefix keys, "
+          f"{fuzzy_index.get_stats()['words']} words")
 except Exception as e:
     print(f"💥 Database initialization error: {e}")
-    import traceback
     print(f"📋 Full init traceback: {traceback.format_exc()}")
 
 
-# --- Migration: Eksik kolonları ekle ---
-def migrate_orders_table():
-    import sqlite3
-    try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        try:
-            cursor.execute("ALTER TABLE orders ADD COLUMN status TEXT DEFAULT 'Hazırlanıyor'")
-        except Exception as e:
-            print("status kolonu zaten var veya eklenemedi:", e)
-        try:
-            cursor.execute("ALTER TABLE orders ADD COLUMN shipping_company TEXT")
-        except Exception as e:
-            print("shipping_company kolonu zaten var veya eklenemedi:", e)
-        try:
-            cursor.execute("ALTER TABLE orders ADD COLUMN tracking_number TEXT")
-        except Exception as e:
-            print("tracking_number kolonu zaten var veya eklenemedi:", e)
-        
-        # Products tablosuna brand sütunu ekle
-        try:
-            cursor.execute("ALTER TABLE products ADD COLUMN brand TEXT")
-        except Exception as e:
-            print("brand kolonu zaten var veya eklenemedi:", e)
-        
-        # Add stock quantity column for enhanced inventory management
-        try:
-            cursor.execute("ALTER TABLE products ADD COLUMN stock_quantity INTEGER DEFAULT 10")
-        except Exception as e:
-            print("stock_quantity kolonu zaten var veya eklenemedi:", e)
-        
-        # Add low_stock_threshold column
-        try:
-            cursor.execute("ALTER TABLE products ADD COLUMN low_stock_threshold INTEGER DEFAULT 5")
-        except Exception as e:
-            print("low_stock_threshold kolonu zaten var veya eklenemedi:", e)
-        
-        # Add stock tracking columns
-        try:
-            cursor.execute("ALTER TABLE products ADD COLUMN last_restocked DATETIME")
-        except Exception as e:
-            print("last_restocked kolonu zaten var veya eklenemedi:", e)
-        
-        # Orders tablosuna eksik sütunları ekle
-        try:
-            cursor.execute("ALTER TABLE orders ADD COLUMN customer_phone TEXT")
-        except Exception as e:
-            print("customer_phone kolonu zaten var veya eklenemedi:", e)
-        
-        try:
-            cursor.execute("ALTER TABLE orders ADD COLUMN customer_email TEXT")
-        except Exception as e:
-            print("customer_email kolonu zaten var veya eklenemedi:", e)
-        
-        try:
-            cursor.execute("ALTER TABLE orders ADD COLUMN customer_address TEXT")
-        except Exception as e:
-            print("customer_address kolonu zaten var veya eklenemedi:", e)
-        
-        conn.commit()
-        conn.close()
-        print("orders tablosu migration tamamlandı.")
-    except Exception as e:
-        print("Migration genel hata:", e)
-
-# Sunucu başlarken bir kere çalıştır
-migrate_orders_table()
-
-
 # Decorator for admin login
 def login_required(f):
     @wraps(f)
@@ -551,41 +992,6 @@ def login_required(f):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Helper function for subcategory filtering (optimized)
-def filter_products_by_subcategory(products, main_category, subcategory):
-    """Optimized subcategory filtering function"""
-    filtered_products = []
-    for p in products:
-        try:
-            if isinstance(p, dict):
-                subs = json.loads(p.get('subcategory', '[]')) if p.get('subcategory') else []
-            else:
-                # SQLite Row object
-                subs = json.loads(p[5]) if p[5] else []
-        except (json.JSONDecodeError, IndexError):
-            subs = [p.get('subcategory', '') if isinstance(p, dict) else p[5]] if (p.get('subcategory') if isinstance(p, dict) else p[5]) else []
-        
-        # Ana kategori filtresi
-        if main_category:
-            found_main_category = any(main_category.lower() in sub.lower() for sub in subs)
-            if not found_main_category:
-                continue
-        
-        # Alt kategori filtresi
-        if subcategory and subcategory != "Hepsi":
-            if subcategory not in subs:
-                continue
-        
-        # Convert to dict if needed and add subcategory info
-        if isinstance(p, dict):
-            product_dict = p.copy()
-        else:
-            product_dict = dict(p)
-        product_dict['subcategory'] = subs
-        filtered_products.append(product_dict)
-        
-    return filtered_products
-
 # Performance monitoring decorator
 def monitor_performance(func):
     @wraps(func)
@@ -600,57 +1006,211 @@ def monitor_performance(func):
     return wrapper
 
 # Cached database queries
-@cache.memoize(timeout=3600)  # 1 hour - products don't change often
 def get_popular_products(category=None, limit=10):
-    """Get popular products based on view/purchase patterns"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        query = "SELECT * FROM products WHERE in_stock = 1"
-        params = []
-        
-        if category:
-            query += " AND LOWER(category) = LOWER(?)"
-            params.append(category)
-            
-        # For now, order by ID desc (newest first) as popularity metric
-        query += " ORDER BY id DESC LIMIT ?"
-        params.append(limit)
-        
-        cursor.execute(query, params)
-        return [dict(row) for row in cursor.fetchall()]
+    """Top products by decayed popularity score, topped up with the newest ones"""
+    return cached_popular_products(category, limit, tag_generations("products", category_tag(category)))
 
-@cache.memoize(timeout=1800)  # 30 minutes - balanced for product updates
-def get_products_by_category(category, brand=None, min_price=None, max_price=None):
-    """Cached product retrieval by category"""
+@memoize_swr(cache, 600)  # 10 minutes - scores move with orders and views
+def cached_popular_products(category, limit, generations):
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        query = "SELECT * FROM products WHERE in_stock = 1 AND LOWER(category) = LOWER(?)"
-        params = [category]
-        
-        if brand:
-            query += " AND LOWER(brand) = LOWER(?)"
-            params.append(brand)
-        if min_price:
-            query += " AND price >= ?"
-            params.append(float(min_price))
-        if max_price:
-            query += " AND price <= ?"
-            params.append(float(max_price))
-            
-        cursor.execute(query, params)
-        return [dict(row) for row in cursor.fetchall()]
+        products = [dict(row) for row in Repository(conn).popularity.top(category, limit)]
+        if len(products) < limit:
+            # Cold start: not enough scored products yet
+            query = "SELECT * FROM products WHERE in_stock = 1"
+            params = []
+            if category:
+                query += " AND category_key = ?"
+                params.append(turkish_fold(category))
+            if products:
+                query += f" AND id NOT IN ({','.join('?' * len(products))})"
+                params.extend(p['id'] for p in products)
+            query += " ORDER BY id DESC LIMIT ?"
+            params.append(limit - len(products))
+            products.extend(dict(row) for row in conn.execute(query, params))
+        for product in products:
+            product['subcategory'] = parse_subcategories(product['subcategory'])
+        return products
+
+# Keyset pagination page sizes
+CATALOG_PAGE_SIZE = 48
+SEARCH_PAGE_SIZE = 20
+ADMIN_PAGE_SIZE = 50
+MAX_API_PAGE_SIZE = 100
+# Below this many FTS hits the first search page is topped up with trigram near matches
+SEARCH_FUZZY_MIN_RESULTS = 3
+
+def api_page_size(default):
+    """?limit= for JSON APIs, clamped to 1..MAX_API_PAGE_SIZE"""
+    try:
+        return max(1, min(int(request.args.get("limit", default)), MAX_API_PAGE_SIZE))
+    except ValueError:
+        return default
+
+@app.template_global()
+def page_url(cursor=None):
+    """Current URL with the pagination cursor replaced (None = first page)"""
+    args = request.args.to_dict()
+    args.pop("cursor", None)
+    if cursor:
+        args["cursor"] = cursor
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+# Rendered product cards, one per ProductRecord. Records are immutable and replaced
+# on every snapshot rebuild, so a card is reused only while its record is current.
+product_card_fragments = {}
+product_card_stats = {'hits': 0, 'renders': 0}
+
+@app.template_global()
+def product_card(product):
+    """Card markup of one catalog product (templates/_product_card.html)"""
+    entry = product_card_fragments.get(product['id'])
+    if entry is not None and entry[0] is product:
+        product_card_stats['hits'] += 1
+        return entry[1]
+    html = Markup(app.jinja_env.get_template('_product_card.html').render(product=product))
+    if not isinstance(product, dict):  # only snapshot records; dicts may be rebuilt per call
+        product_card_fragments[product['id']] = (product, html)
+    product_card_stats['renders'] += 1
+    return html
+
+# Full-page cache for anonymous storefront pages (shared across workers)
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', '120'))
+page_cache_stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'bypassed': 0}
+# Session keys that make a page personal (cart badge, user menu, flash message)
+PERSONAL_SESSION_KEYS = ('user_logged_in', 'admin_logged_in', 'cart', 'cart_message')
+
+def response_catalog_version():
+    """Synced catalog version for a response cache key or ETag. A response whose
+    catalog page came from another snapshot gets g.uncacheable instead."""
+    g.cache_catalog_version = current_catalog_version()
+    return g.cache_catalog_version, catalog_version['ratings']
+
+def storefront_page_key():
+    """Cache key for the current storefront page, or None when it must not be shared"""
+    category = session.get('selected_category')
+    if request.method != 'GET' or not category or any(session.get(k) for k in PERSONAL_SESSION_KEYS):
+        return None
+    parts = (request.path, request.host_url, turkish_fold(category), sorted(request.args.items(multi=True)),
+             session.get('theme', 'light'), response_catalog_version(),
+             tag_generations('products', category_tag(category), 'campaigns'))
+    return 'page:' + hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def cache_storefront_page(view):
+    """Serve anonymous pages from the shared cache with a strong ETag; 304 on If-None-Match.
+    The view sets g.uncacheable to keep an error fallback out of the cache."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = storefront_page_key()
+        if key is None:
+            page_cache_stats['bypassed'] += 1
+            return view(*args, **kwargs)
+        entry = cache.get(key)
+        if entry is None:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.mimetype != 'text/html' or g.get('uncacheable'):
+                return response
+            body = response.get_data()
+            entry = (body, hashlib.sha1(body).hexdigest())
+            cache.set(key, entry, timeout=PAGE_CACHE_TTL)
+            page_cache_stats['misses'] += 1
+            status = 'MISS'
+        else:
+            page_cache_stats['hits'] += 1
+            status = 'HIT'
+        response = app.response_class(entry[0], mimetype='text/html')
+        response.set_etag(entry[1])
+        # Browsers may keep the page but must revalidate; proxies must not share it
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.headers['X-Page-Cache'] = status
+        response.make_conditional(request)
+        if response.status_code == 304:
+            page_cache_stats['not_modified'] += 1
+        return response
+    return wrapper
+
+# HTTP conditional requests for JSON/XML endpoints
+conditional_stats = defaultdict(lambda: {'not_modified': 0, 'full': 0})
+
+def conditional(validators, cache_control):
+    """ETag/Last-Modified from version counters, checked before the view runs.
+
+    validators(*view_args) returns (parts, last_modified) using only the shared
+    cache - never the database - so a matching If-None-Match/If-Modified-Since is
+    answered 304 without touching SQLite. parts=None skips conditional handling.
+    The view sets g.uncacheable on error fallbacks so they get no validators.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            parts, last_modified = validators(*args, **kwargs)
+            if parts is None:
+                return view(*args, **kwargs)
+            etag = hashlib.sha1(repr((request.endpoint, parts)).encode()).hexdigest()
+            last_modified = datetime.fromtimestamp(int(last_modified), timezone.utc) if last_modified else None
+            stats = conditional_stats[request.endpoint]
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                stats['not_modified'] += 1
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or g.get('uncacheable'):
+                    return response
+                stats['full'] += 1
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            response.headers['Cache-Control'] = cache_control
+            return response
+        return wrapper
+    return decorator
+
+@memoize_swr(cache, 1800)  # 30 minutes - balanced for product updates
+def get_catalog_page_ids(category, brand, min_price, max_price, main_category,
+                         subcategory, sort, cursor, limit, generations, version):
+    """Cached catalog page as (product ids, next_cursor): a few ints per cached filter
+    combination. Computed only from a snapshot built under `version` (StaleSnapshot
+    otherwise, which is never cached). Raises InvalidCursor for bad tokens."""
+    return catalog_engine.page_ids(category, brand, min_price, max_price, main_category,
+                                   subcategory, sort, cursor, limit,
+                                   snapshot=catalog_engine.snapshot_at(version))
+
+def get_products_by_category(category, brand=None, min_price=None, max_price=None,
+                             main_category=None, subcategory=None, sort="name",
+                             cursor=None, limit=CATALOG_PAGE_SIZE):
+    """Catalog page: (products, next_cursor). Products are the engine's shared,
+    read-only ProductRecords."""
+    version = current_catalog_version()
+    try:
+        ids, next_cursor = get_catalog_page_ids(category, brand, min_price, max_price, main_category,
+                                                subcategory, sort, cursor, limit,
+                                                tag_generations("products", category_tag(category)), version)
+    except StaleSnapshot:
+        # The catalog moved while we were computing: serve this page uncached
+        version = None
+        ids, next_cursor = catalog_engine.page_ids(category, brand, min_price, max_price,
+                                                   main_category, subcategory, sort, cursor, limit)
+    if has_request_context() and version != g.get('cache_catalog_version', version):
+        # Not the version the page cache/ETag is keyed on (see response_catalog_version)
+        g.uncacheable = True
+    return catalog_engine.records(ids), next_cursor
 
-@cache.memoize(timeout=600)  # 10 minutes - campaigns change more frequently
 def get_campaigns():
     """Cached campaigns retrieval"""
+    return cached_campaigns(tag_generations("campaigns"))
+
+@memoize_swr(cache, 600)  # 10 minutes - campaigns change more frequently
+def cached_campaigns(generations):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM campaigns WHERE active = 1")
         return [dict(row) for row in cursor.fetchall()]
 
-@cache.memoize(timeout=1800)  # 30 minutes - stats don't change often
 def get_product_count_by_category():
     """Cached product count statistics"""
+    return cached_product_count_by_category(tag_generations("products", "catalog"))
+
+@memoize_swr(cache, 1800)  # 30 minutes - stats don't change often
+def cached_product_count_by_category(generations):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
@@ -661,9 +1221,12 @@ def get_product_count_by_category():
         """)
         return dict(cursor.fetchall())
 
-@cache.memoize(timeout=300)  # 5 minutes - stock changes frequently
 def get_low_stock_products(threshold=5):
     """Get products with low stock"""
+    return cached_low_stock_products(threshold, tag_generations("stock"))
+
+@memoize_swr(cache, 300)  # 5 minutes - stock changes frequently
+def cached_low_stock_products(threshold, generations):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
@@ -675,9 +1238,12 @@ def get_low_stock_products(threshold=5):
         """, (threshold,))
         return [dict(row) for row in cursor.fetchall()]
 
-@cache.memoize(timeout=600)  # 10 minutes
 def get_stock_statistics():
     """Get overall stock statistics"""
+    return cached_stock_statistics(tag_generations("stock"))
+
+@memoize_swr(cache, 600)  # 10 minutes
+def cached_stock_statistics(generations):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         
@@ -694,38 +1260,88 @@ def get_stock_statistics():
         
         return dict(cursor.fetchone())
 
+# Cache warming: fill the memoized helpers before the first customers arrive.
+# Workers warm in parallel safely; memoize_swr's lock makes the others wait and hit.
+CACHE_WARM_WORKERS = int(os.environ.get('CACHE_WARM_WORKERS', '4'))
+
+def warm_caches():
+    """Preload campaigns, stock aggregates and, for every category with stock, the
+    first catalog page, popular products and brand list. Returns a small report."""
+    start = time.time()
+    catalog_engine.snapshot()  # brand lists and facets come from here
+    jobs = {
+        'campaigns': get_campaigns,
+        'category_counts': get_product_count_by_category,
+        'stock_statistics': get_stock_statistics,
+        'low_stock': get_low_stock_products,
+    }
+    for category in get_product_count_by_category():
+        jobs[f'products:{category}'] = lambda c=category: get_products_by_category(c)
+        jobs[f'popular:{category}'] = lambda c=category: get_popular_products(c, 4)
+        jobs[f'brands:{category}'] = lambda c=category: catalog_engine.brands(c)
+
+    errors = {}
+    with ThreadPoolExecutor(max_workers=CACHE_WARM_WORKERS, thread_name_prefix='cache-warm') as executor:
+        futures = {name: executor.submit(job) for name, job in jobs.items()}
+        for name, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                errors[name] = str(e)
+    report = {'entries': len(jobs) - len(errors), 'errors': errors,
+              'seconds': round(time.time() - start, 3)}
+    print(f"🔥 Cache warmed: {report['entries']} entries in {report['seconds']}s"
+          + (f" ({len(errors)} failed: {', '.join(errors)})" if errors else ""))
+    return report
+
+@app.cli.command("warm-cache")
+def warm_cache_command():
+    """Fill the shared cache (e.g. right after a deploy)"""
+    report = warm_caches()
+    if report['errors']:
+        raise SystemExit(1)
+
+# Worker başına bir kez arka planda ısıt (CACHE_WARM_ON_START=0 ile kapatılır).
+# Import sırasında değil: CLI komutları (migrate, check-indexes, warm-cache) da
+# app'i import eder. gunicorn kullanılıyorsa post_worker_init hook'undan da
+# çağrılabilir: post_worker_init = lambda worker: app.start_cache_warming()
+CACHE_WARM_ON_START = os.environ.get('CACHE_WARM_ON_START', '1').lower() not in ('0', 'false', 'no')
+cache_warm_state = {'started': False}
+_cache_warm_lock = threading.Lock()
+
+def start_cache_warming():
+    with _cache_warm_lock:
+        if cache_warm_state['started']:
+            return
+        cache_warm_state['started'] = True
+    if CACHE_WARM_ON_START and db_pool is not None:
+        threading.Thread(target=warm_caches, name='cache-warm-start', daemon=True).start()
+
+@app.before_request
+def warm_caches_on_first_request():
+    if not cache_warm_state['started']:
+        start_cache_warming()
+
 def update_product_stock(product_id, quantity_change, reason="manual"):
     """Update product stock with logging"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Get current stock
-        cursor.execute("SELECT stock_quantity, name FROM products WHERE id = ?", (product_id,))
-        result = cursor.fetchone()
-        
+    def apply(repo):
+        result = repo.products.get_stock(product_id)
         if not result:
-            return False
-        
-        current_stock = result['stock_quantity'] or 0
-        new_stock = max(0, current_stock + quantity_change)
-        
-        # Update stock
-        cursor.execute("""
-            UPDATE products 
-            SET stock_quantity = ?, 
-                last_restocked = CASE WHEN ? > 0 THEN CURRENT_TIMESTAMP ELSE last_restocked END
-            WHERE id = ?
-        """, (new_stock, quantity_change, product_id))
-        
-        conn.commit()
-        
-        # Invalidate stock-related caches
-        invalidate_product_cache()
-        cache.delete_memoized(get_low_stock_products)
-        cache.delete_memoized(get_stock_statistics)
-        
-        print(f"Stock updated for {result['name']}: {current_stock} -> {new_stock} ({reason})")
-        return True
+            return None
+        repo.products.adjust_stock(product_id, quantity_change)
+        return result['name'], result['stock_quantity'] or 0
+
+    changed = db_write(apply)
+    if not changed:
+        return False
+    name, current_stock = changed
+    new_stock = max(0, current_stock + quantity_change)
+    
+    # Invalidate stock-related caches
+    invalidate_stock_cache()
+    
+    print(f"Stock updated for {name}: {current_stock} -> {new_stock} ({reason})")
+    return True
 
 # Customer Communication System
 class NotificationService:
@@ -900,25 +1516,19 @@ class UserManager:
             if not first_name or not last_name:
                 return False, "Ad ve soyad zorunludur"
             
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                
+            password_hash = generate_password_hash(password)
+            
+            def create(repo):
                 # Check if user already exists
-                cursor.execute("SELECT id FROM users WHERE email = ?", (email.lower(),))
-                if cursor.fetchone():
-                    return False, "Bu email adresi zaten kullanılmaktadır"
-                
-                # Create user
-                password_hash = generate_password_hash(password)
-                cursor.execute("""
-                    INSERT INTO users (email, password_hash, first_name, last_name, phone, address)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (email.lower(), password_hash, first_name, last_name, phone, address))
-                
-                user_id = cursor.lastrowid
-                conn.commit()
-                
-                return True, user_id
+                if repo.users.exists(email.lower()):
+                    return None
+                return repo.users.create(email.lower(), password_hash, first_name, last_name, phone, address)
+            
+            user_id = db_write(create)
+            if user_id is None:
+                return False, "Bu email adresi zaten kullanılmaktadır"
+            
+            return True, user_id
                 
         except Exception as e:
             print(f"User creation error: {e}")
@@ -928,36 +1538,25 @@ class UserManager:
     def authenticate_user(email, password):
         """Authenticate user login"""
         try:
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT id, password_hash, first_name, last_name, is_active
-                    FROM users WHERE email = ?
-                """, (email.lower(),))
-                
-                user = cursor.fetchone()
-                if not user:
-                    return False, "Email veya şifre hatalı"
-                
-                if not user['is_active']:
-                    return False, "Hesabınız deaktive edilmiştir"
+            user = get_repo().users.get_credentials(email.lower())
+            if not user:
+                return False, "Email veya şifre hatalı"
+            
+            if not user['is_active']:
+                return False, "Hesabınız deaktive edilmiştir"
+            
+            if check_password_hash(user['password_hash'], password):
+                # Update last login (nobody needs to wait for this one)
+                db_write_async(lambda repo: repo.users.touch_last_login(user['id']))
                 
-                if check_password_hash(user['password_hash'], password):
-                    # Update last login
-                    cursor.execute("""
-                        UPDATE users SET last_login = CURRENT_TIMESTAMP 
-                        WHERE id = ?
-                    """, (user['id'],))
-                    conn.commit()
-                    
-                    return True, {
-                        'id': user['id'],
-                        'first_name': user['first_name'],
-                        'last_name': user['last_name'],
-                        'email': email.lower()
-                    }
-                else:
-                    return False, "Email veya şifre hatalı"
+                return True, {
+                    'id': user['id'],
+                    'first_name': user['first_name'],
+                    'last_name': user['last_name'],
+                    'email': email.lower()
+                }
+            else:
+                return False, "Email veya şifre hatalı"
                     
         except Exception as e:
             print(f"Authentication error: {e}")
@@ -967,15 +1566,8 @@ class UserManager:
     def get_user_by_id(user_id):
         """Get user by ID"""
         try:
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT id, email, first_name, last_name, phone, address, created_at, last_login, balance
-                    FROM users WHERE id = ? AND is_active = 1
-                """, (user_id,))
-                
-                user = cursor.fetchone()
-                return dict(user) if user else None
+            user = get_repo().users.get(user_id)
+            return dict(user) if user else None
                 
         except Exception as e:
             print(f"Get user error: {e}")
@@ -1011,6 +1603,7 @@ def change_category():
 
 @app.route("/")
 @monitor_performance
+@cache_storefront_page
 def index():
     # Eğer kullanıcı kategori seçmemişse, kategori seçme ekranı göster
     selected_category = session.get("selected_category")
@@ -1024,21 +1617,32 @@ def index():
     brand = request.args.get("brand", "")
     min_price = request.args.get("min_price", "")
     max_price = request.args.get("max_price", "")
+    sort_by = request.args.get("sort", "name")
+    cursor = request.args.get("cursor") or None
 
     try:
         # Use cached campaign data
         campaigns = get_campaigns()
         
-        # Use cached product data with filters
-        products = get_products_by_category(category, brand, min_price, max_price)
-
-        # Çoklu subcategory desteği: filtreleme (optimized)
-        filtered_products = filter_products_by_subcategory(products, main_category, subcategory)
-            
-        return render_template("index.html", products=filtered_products, selected_category=category, campaigns=campaigns)
+        # Use cached product data with filters (subcategories filtered in SQL)
+        try:
+            products, next_cursor = get_products_by_category(category, brand, min_price, max_price,
+                                                             main_category, subcategory, sort_by, cursor)
+        except InvalidCursor:
+            return redirect(page_url(None))
+        
+        # Çok satanlar sadece filtresiz ana sayfada
+        filtered = any([main_category, subcategory, brand, min_price, max_price, cursor])
+        popular_products = [] if filtered else get_popular_products(category, 4)
+            
+        return render_template("index.html", products=products, selected_category=category,
+                               campaigns=campaigns, popular_products=popular_products,
+                               next_cursor=next_cursor, cursor=cursor)
     except Exception as e:
         print(f"Database error in index: {e}")
-        return render_template("index.html", products=[], selected_category=category, campaigns=[])
+        g.uncacheable = True
+        return render_template("index.html", products=[], selected_category=category, campaigns=[],
+                               popular_products=[], next_cursor=None, cursor=None)
 
 
 @app.route("/products")
@@ -1047,9 +1651,19 @@ def products():
 
 
 
+def catalog_validators():
+    """Session category + query args + catalog tags (filter_products)"""
+    category = session.get("selected_category")
+    if not category:
+        return None, None
+    tags = ("products", category_tag(category))
+    return ((turkish_fold(category), sorted(request.args.items(multi=True)), response_catalog_version(),
+             tag_generations(*tags)), tags_last_modified(*tags))
+
 @app.route("/api/filter_products")
 @rate_limit(30, 60)  # Max 30 filter requests per minute
 @monitor_performance
+@conditional(catalog_validators, "private, no-cache")
 def filter_products():
     """AJAX için dinamik ürün filtreleme endpoint'i (optimized with brand support)"""
     selected_category = session.get("selected_category")
@@ -1063,27 +1677,21 @@ def filter_products():
     min_price = request.args.get("min_price", "")
     max_price = request.args.get("max_price", "")
     sort_by = request.args.get("sort", "name")  # New sorting parameter
+    cursor = request.args.get("cursor") or None
+    limit = api_page_size(CATALOG_PAGE_SIZE)
 
     try:
-        # Use cached product data with brand filtering
-        products = get_products_by_category(category, brand, min_price, max_price)
-        
-        # Apply subcategory filtering
-        filtered_products = filter_products_by_subcategory(products, main_category, subcategory)
-        
-        # Apply sorting
-        if sort_by == "price-asc":
-            filtered_products.sort(key=lambda x: float(x.get('price', 0)))
-        elif sort_by == "price-desc":
-            filtered_products.sort(key=lambda x: float(x.get('price', 0)), reverse=True)
-        elif sort_by == "newest":
-            filtered_products.sort(key=lambda x: x.get('id', 0), reverse=True)
-        elif sort_by == "name":
-            filtered_products.sort(key=lambda x: x.get('name', '').lower())
+        # Category, brand, price, subcategory filters, sorting and paging all run in SQL
+        try:
+            products, next_cursor = get_products_by_category(category, brand, min_price, max_price,
+                                                             main_category, subcategory, sort_by,
+                                                             cursor, limit)
+        except InvalidCursor as e:
+            return jsonify({"error": str(e)}), 400
         
         # Convert to JSON format with enhanced data
         json_products = []
-        for p in filtered_products:
+        for p in products:
             product_dict = {
                 "id": p["id"],
                 "name": p["name"],
@@ -1093,13 +1701,16 @@ def filter_products():
                 "subcategory": p.get("subcategory", []),
                 "brand": p.get("brand", ""),
                 "description": p.get("description", ""),
-                "in_stock": p.get("in_stock", 1)
+                "in_stock": p.get("in_stock", 1),
+                "avg_rating": p.get("avg_rating", 0),
+                "review_count": p.get("review_count", 0)
             }
             json_products.append(product_dict)
             
-        return jsonify({
+        response = {
             "products": json_products, 
             "count": len(json_products),
+            "next_cursor": next_cursor,
             "filters": {
                 "brand": brand,
                 "main_category": main_category,
@@ -1107,7 +1718,12 @@ def filter_products():
                 "price_range": [min_price, max_price],
                 "sort": sort_by
             }
-        })
+        }
+        # Facet counts only on the first page; later pages keep the same filters
+        if not cursor:
+            response["facets"] = catalog_engine.facet_counts(category, brand, min_price, max_price,
+                                                             main_category, subcategory)
+        return jsonify(response)
     except Exception as e:
         print(f"Database error in filter_products: {e}")
         return jsonify({"error": str(e)}), 500
@@ -1132,12 +1748,7 @@ def contact():
             message = "Mesaj 10-1000 karakter arası olmalıdır."
         else:
             try:
-                conn = sqlite3.connect(db_path)
-                cursor = conn.cursor()
-                cursor.execute("INSERT INTO messages (name, email, phone, message) VALUES (?, ?, ?, ?)", 
-                             (name[:100], email[:254], phone[:20], msg[:1000]))
-                conn.commit()
-                conn.close()
+                db_write(lambda repo: repo.messages.create(name[:100], email[:254], phone[:20], msg[:1000]))
                 message = "Mesajınız başarıyla gönderildi!"
             except Exception as e:
                 print(f"Contact form error: {e}")
@@ -1156,8 +1767,7 @@ def thank_you():
 @app.route("/admin/edit/<int:product_id>", methods=["GET", "POST"])
 @login_required
 def edit_product(product_id):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    repo = get_repo()
 
     if request.method == "POST":
         name = request.form["name"]
@@ -1173,13 +1783,10 @@ def edit_product(product_id):
         if main_category and main_category not in subcategory:
             subcategory.insert(0, main_category)
         
-        subcategory_json = json.dumps(subcategory, ensure_ascii=False)
         description = request.form["description"]
 
         # Mevcut resim bilgisini al
-        cursor.execute("SELECT image FROM products WHERE id = ?", (product_id,))
-        current_product = cursor.fetchone()
-        image = current_product[0] if current_product else "/static/default.jpg"
+        image = repo.products.get_image(product_id) or "/static/default.jpg"
 
         # Yeni resim geldiyse güncelle
         if "image" in request.files:
@@ -1189,24 +1796,23 @@ def edit_product(product_id):
                 file.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
                 image = f"/static/uploads/{filename}"
 
-        cursor.execute("""
-            UPDATE products
-            SET name = ?, price = ?, image = ?, category = ?, subcategory = ?, description = ?, brand = ?
-            WHERE id = ?
-        """, (name, price, image, category, subcategory_json, description, brand, product_id))
+        def update(repo):
+            # Eski kategori: ürün kategori değiştirdiyse iki kategorinin önbelleği de gider
+            old_category = repo.products.get_category(product_id)
+            repo.products.update(product_id, name, price, image, category,
+                                 subcategory, description, brand)
+            return old_category
 
-        conn.commit()
-        conn.close()
+        old_category = db_write(update)
         
+        # Patch the search indexes before the catalog version moves on
+        refresh_search_indexes(product_id)
         # Invalidate relevant caches
-        invalidate_product_cache(category)
-        invalidate_brand_cache()
+        invalidate_product_cache(category, old_category)
         
         return redirect(url_for("admin_panel"))
 
-    cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
-    product = cursor.fetchone()
-    conn.close()
+    product = repo.products.get(product_id)
 
     if not product:
         return "Ürün bulunamadı", 404
@@ -1216,23 +1822,19 @@ def edit_product(product_id):
 
 @app.route("/add_to_cart/<int:product_id>")
 def add_to_cart(product_id):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, price, stock_quantity FROM products WHERE id = ? AND in_stock = 1", (product_id,))
-    product = cursor.fetchone()
-    conn.close()
+    product = get_repo().products.get_available(product_id)
 
     if not product:
         return "Ürün bulunamadı veya stokta yok", 404
 
-    current_stock = product[3] or 0
+    current_stock = product["stock_quantity"] or 0
     
     # Check if product is available in stock
     if current_stock <= 0:
-        session['cart_message'] = f"{product[1]} şu anda stokta bulunmuyor."
+        session['cart_message'] = f"{product['name']} şu anda stokta bulunmuyor."
         return redirect(url_for("index"))
 
-    item = {"id": product[0], "name": product[1], "price": product[2], "quantity": 1}
+    item = {"id": product["id"], "name": product["name"], "price": product["price"], "quantity": 1}
 
     if "cart" not in session:
         session["cart"] = []
@@ -1246,7 +1848,7 @@ def add_to_cart(product_id):
     
     # Check if adding one more would exceed stock
     if current_cart_quantity + 1 > current_stock:
-        session['cart_message'] = f"{product[1]} için yeterli stok bulunmuyor. Stokta: {current_stock}"
+        session['cart_message'] = f"{product['name']} için yeterli stok bulunmuyor. Stokta: {current_stock}"
         return redirect(url_for("index"))
 
     # Add to cart or increase quantity
@@ -1258,7 +1860,7 @@ def add_to_cart(product_id):
         session["cart"].append(item)
 
     session.modified = True
-    session['cart_message'] = f"{product[1]} sepete eklendi!"
+    session['cart_message'] = f"{product['name']} sepete eklendi!"
     return redirect(url_for("index"))
 
 
@@ -1285,22 +1887,19 @@ def cart():
 @app.route("/admin/delete/<int:product_id>")
 @login_required
 def delete_product(product_id):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Get product category before deletion for cache invalidation
-    cursor.execute("SELECT category FROM products WHERE id = ?", (product_id,))
-    product = cursor.fetchone()
-    category = product[0] if product else None
-    
-    cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
-    conn.commit()
-    conn.close()
+    def delete(repo):
+        # Get product category before deletion for cache invalidation
+        category = repo.products.get_category(product_id)
+        repo.products.delete(product_id)
+        return category
+
+    category = db_write(delete)
+    for index in SEARCH_INDEXES:
+        index.remove_product(product_id)
     
     # Invalidate relevant caches
     if category:
         invalidate_product_cache(category)
-        invalidate_brand_cache()
     
     return redirect(url_for("admin_panel"))
 
@@ -1365,62 +1964,61 @@ def order():
                 session['cart_message'] = "Yetersiz bakiye! WhatsApp ile ödeme yapabilirsiniz."
                 return redirect(url_for("cart"))
 
-        # Veritabanına kaydet ve stokları güncelle
+        # Veritabanına kaydet ve stokları güncelle (tek write transaction)
+        order_status = "Ödendi" if balance_paid else "Hazırlanıyor"
+        user_id = session.get("user_id")
+
+        def place_order(repo):
+            # First, check all items are still in stock
+            stock_issues = []
+            for item in cart_items:
+                product = repo.products.get_stock(item['id'])
+                if product:
+                    available_stock = int(product['stock_quantity'] or 0)
+                    required_quantity = int(item.get('quantity', 1))
+                    if available_stock < required_quantity:
+                        stock_issues.append(f"{product['name']}: {required_quantity} istendi, {available_stock} mevcut")
+            if stock_issues:
+                return stock_issues, []
+            
+            # Create order with appropriate status
+            repo.orders.create(order_code, cart_items, total, customer_name,
+                               phone, email, address, note, order_status)
+            
+            repo.popularity.record_many([(item['id'], 'order', item.get('quantity', 1)) for item in cart_items])
+            
+            # Update stock for each item and collect products that are now low
+            low_stock = []
+            for item in cart_items:
+                repo.products.adjust_stock(item['id'], -item.get('quantity', 1))
+                product = repo.products.get_stock_levels(item['id'])
+                if product:
+                    current_stock = int(product['stock_quantity'] or 0)
+                    threshold = int(product['low_stock_threshold'] or 5)
+                    if current_stock <= threshold:
+                        low_stock.append((product['name'], current_stock, threshold))
+            
+            # Deduct balance if paid with balance
+            if balance_paid:
+                repo.users.deduct_balance(user_id, total)
+            return [], low_stock
+
         try:
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                
-                # First, check all items are still in stock
-                all_available = True
-                stock_issues = []
-                
-                for item in cart_items:
-                    cursor.execute("SELECT stock_quantity, name FROM products WHERE id = ?", (item['id'],))
-                    product = cursor.fetchone()
-                    if product:
-                        available_stock = int(product[0] or 0)
-                        required_quantity = int(item.get('quantity', 1))
-                        if available_stock < required_quantity:
-                            all_available = False
-                            stock_issues.append(f"{product[1]}: {required_quantity} istendi, {available_stock} mevcut")
-                
-                if not all_available:
-                    session['cart_message'] = f"Stok yetersiz: {', '.join(stock_issues)}"
-                    return redirect(url_for("cart"))
-                
-                # Create order with appropriate status
-                order_status = "Ödendi" if balance_paid else "Hazırlanıyor"
-                cursor.execute("""
-                    INSERT INTO orders (order_code, items, total_price, customer_name, customer_phone, customer_email, customer_address, address, note, status)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (order_code, json.dumps(cart_items), total, customer_name, phone, email, address, address, note, order_status))
-                
-                # Update stock for each item
-                for item in cart_items:
-                    quantity_sold = item.get('quantity', 1)
-                    cursor.execute("UPDATE products SET stock_quantity = stock_quantity - ? WHERE id = ?", 
-                                 (quantity_sold, item['id']))
-                    
-                    # Check if stock is now low and send notification
-                    cursor.execute("SELECT name, stock_quantity, low_stock_threshold FROM products WHERE id = ?", (item['id'],))
-                    product = cursor.fetchone()
-                    if product:
-                        product_name = product[0]
-                        current_stock = int(product[1] or 0)
-                        threshold = int(product[2] or 5)
-                        if current_stock <= threshold:
-                            try:
-                                notification_service.notify_low_stock(product_name, current_stock, threshold)
-                            except:
-                                pass  # Don't fail order if notification fails
-                
-                # Deduct balance if paid with balance
-                if balance_paid:
-                    cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", 
-                                 (total, session["user_id"]))
-                    print(f"💰 Balance payment: User {session['user_id']} paid {total} TL - Order: {order_code}")
-                
-                conn.commit()
+            stock_issues, low_stock = db_write(place_order)
+            
+            if stock_issues:
+                session['cart_message'] = f"Stok yetersiz: {', '.join(stock_issues)}"
+                return redirect(url_for("cart"))
+            
+            if balance_paid:
+                print(f"💰 Balance payment: User {user_id} paid {total} TL - Order: {order_code}")
+            
+            # Send low stock notifications outside the write transaction
+            for product_name, current_stock, threshold in low_stock:
+                try:
+                    notification_service.notify_low_stock(product_name, current_stock, threshold)
+                except:
+                    pass  # Don't fail order if notification fails
                 
         except Exception as db_error:
             print(f"DATABASE ERROR: {db_error}")
@@ -1505,20 +2103,19 @@ def admin_orders():
     items = []
     all_orders = []
 
-    # Tüm siparişleri her durumda getir
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM orders ORDER BY id DESC")
-    orders = cursor.fetchall()
+    # Siparişleri sayfa sayfa getir (keyset)
+    repo = get_repo()
+    cursor = request.args.get("cursor") or None
+    try:
+        orders, next_cursor = repo.orders.page(cursor, ADMIN_PAGE_SIZE)
+    except InvalidCursor:
+        return redirect(url_for("admin_orders"))
+    items_by_order = repo.orders.items_by_order([order["id"] for order in orders])
     
     # Siparişleri formatla
     for order in orders:
         order_dict = dict(order)
-        try:
-            order_dict["items"] = json.loads(order["items"])
-        except:
-            order_dict["items"] = []
+        order_dict["items"] = items_by_order[order["id"]]
         
         # created_at'i datetime object'e çevir
         try:
@@ -1532,14 +2129,10 @@ def admin_orders():
     # Spesifik sipariş arama
     if request.method == "POST":
         code = request.form["code"].strip().upper()
-        cursor.execute("SELECT * FROM orders WHERE order_code = ?", (code,))
-        result = cursor.fetchone()
+        result = repo.orders.get_by_code(code)
 
         if result:
-            try:
-                items = json.loads(result["items"])
-            except:
-                items = []
+            items = repo.orders.list_items(result["id"])
             
             # created_at'i datetime object'e çevir
             result = dict(result)
@@ -1551,8 +2144,8 @@ def admin_orders():
         else:
             not_found = True
 
-    conn.close()
-    return render_template("admin_orders.html", result=result, items=items, not_found=not_found, all_orders=all_orders)
+    return render_template("admin_orders.html", result=result, items=items, not_found=not_found,
+                           all_orders=all_orders, next_cursor=next_cursor, cursor=cursor)
 
 
 @app.route("/add_product", methods=["GET", "POST"])
@@ -1573,8 +2166,6 @@ def add_product():
         if main_category and main_category not in subcategory:
             subcategory.insert(0, main_category)
         
-        # JSON string olarak kaydet
-        subcategory_json = json.dumps(subcategory, ensure_ascii=False)
         description = request.form["description"]
 
         file = request.files.get("image")
@@ -1585,18 +2176,13 @@ def add_product():
         else:
             image_path = "/static/default.jpg"
 
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO products (name, price, image, category, subcategory, description, brand)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (name, price, image_path, category, subcategory_json, description, brand))
-        conn.commit()
-        conn.close()
+        product_id = db_write(lambda repo: repo.products.create(name, price, image_path, category,
+                                                                subcategory, description, brand))
         
+        # Patch the search indexes before the catalog version moves on
+        refresh_search_indexes(product_id)
         # Invalidate relevant caches
         invalidate_product_cache(category)
-        invalidate_brand_cache()
         
         return redirect(url_for("admin_panel"))
 
@@ -1633,25 +2219,18 @@ def update_order_status_api():
         if new_status not in valid_statuses:
             return jsonify({"success": False, "message": "Geçersiz durum"}), 400
         
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        def update(repo):
+            # Sipariş var mı kontrol et (bildirim için sipariş verisini de al)
+            order_row = repo.orders.get(order_id)
+            if not order_row:
+                return None
+            repo.orders.update_status(order_id, new_status)
+            return dict(order_row)
         
-        # Sipariş var mı kontrol et
-        cursor.execute("SELECT id FROM orders WHERE id = ?", (order_id,))
-        if not cursor.fetchone():
-            conn.close()
+        order_data = db_write(update)
+        if not order_data:
             return jsonify({"success": False, "message": "Sipariş bulunamadı"}), 404
         
-        # Get order data for notification before update
-        cursor.execute("SELECT * FROM orders WHERE id = ?", (order_id,))
-        order_row = cursor.fetchone()
-        order_data = dict(order_row) if order_row else None
-        
-        # Durumu güncelle
-        cursor.execute("UPDATE orders SET status = ? WHERE id = ?", (new_status, order_id))
-        conn.commit()
-        conn.close()
-        
         # Send notification to customer
         if order_data:
             notification_service.notify_order_status_change(order_data, new_status)
@@ -1675,24 +2254,20 @@ def update_shipping_info():
             return jsonify({"success": False, "message": "Eksik parametreler"}), 400
         
         # Güvenlik kontrolü - sadece belirli alanlar güncellenebilir
-        allowed_fields = ["shipping_company", "tracking_number"]
-        if field not in allowed_fields:
+        if field not in OrderRepository.SHIPPING_FIELDS:
             return jsonify({"success": False, "message": "Geçersiz alan"}), 400
         
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        def update(repo):
+            # Sipariş var mı kontrol et
+            if not repo.orders.get(order_id):
+                return False
+            # Bilgiyi güncelle
+            repo.orders.update_shipping_field(order_id, field, value)
+            return True
         
-        # Sipariş var mı kontrol et
-        cursor.execute("SELECT id FROM orders WHERE id = ?", (order_id,))
-        if not cursor.fetchone():
-            conn.close()
+        if not db_write(update):
             return jsonify({"success": False, "message": "Sipariş bulunamadı"}), 404
         
-        # Bilgiyi güncelle
-        cursor.execute(f"UPDATE orders SET {field} = ? WHERE id = ?", (value, order_id))
-        conn.commit()
-        conn.close()
-        
         return jsonify({"success": True, "message": "Kargo bilgisi güncellendi"})
     
     except Exception as e:
@@ -1807,40 +2382,25 @@ def user_profile():
     
     # Get user's recent orders
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT * FROM orders 
-                WHERE customer_email = ? 
-                ORDER BY created_at DESC 
-                LIMIT 10
-            """, (user["email"],))
-            
-            orders = []
-            for order_row in cursor.fetchall():
-                # Convert sqlite3.Row to proper dictionary
-                order = {key: order_row[key] for key in order_row.keys()}
-                try:
-                    # Ensure items is properly parsed as JSON
-                    if isinstance(order["items"], str):
-                        order["items"] = json.loads(order["items"])
-                    elif order["items"] is None:
-                        order["items"] = []
-                    
-                    # Parse date
-                    if order["created_at"]:
-                        order["created_at"] = datetime.strptime(order["created_at"], "%Y-%m-%d %H:%M:%S")
-                except Exception as e:
-                    print(f"Order processing error: {e}")
-                    order["items"] = []
-                    order["created_at"] = datetime.now()
-                orders.append(order)
+        repo = get_repo()
+        orders = []
+        order_rows = repo.orders.list_for_email(user["email"], limit=10)
+        items_by_order = repo.orders.items_by_order([order["id"] for order in order_rows])
+        for order_row in order_rows:
+            # Convert sqlite3.Row to proper dictionary
+            order = dict(order_row)
+            order["items"] = items_by_order[order["id"]]
+            try:
+                # Parse date
+                if order["created_at"]:
+                    order["created_at"] = datetime.strptime(order["created_at"], "%Y-%m-%d %H:%M:%S")
+            except Exception as e:
+                print(f"Order processing error: {e}")
+                order["created_at"] = datetime.now()
+            orders.append(order)
                 
         # Get wishlist count
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) as count FROM wishlist WHERE user_id = ?", (user["id"],))
-            wishlist_count = cursor.fetchone()["count"]
+        wishlist_count = repo.wishlist.count_for_user(user["id"])
             
     except Exception as e:
         print(f"Profile data error: {e}")
@@ -1870,19 +2430,13 @@ def edit_profile():
             return render_template("edit_profile.html", user=user, error="Ad ve soyad zorunludur")
         
         try:
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    UPDATE users 
-                    SET first_name = ?, last_name = ?, phone = ?, address = ?
-                    WHERE id = ?
-                """, (first_name, last_name, phone or None, address or None, user["id"]))
-                conn.commit()
-                
-                # Update session data
-                session["user_name"] = f"{first_name} {last_name}"
-                
-                return redirect(url_for("user_profile"))
+            db_write(lambda repo: repo.users.update_profile(user["id"], first_name, last_name,
+                                                            phone or None, address or None))
+            
+            # Update session data
+            session["user_name"] = f"{first_name} {last_name}"
+            
+            return redirect(url_for("user_profile"))
                 
         except Exception as e:
             print(f"Profile update error: {e}")
@@ -1896,33 +2450,19 @@ def edit_profile():
 @user_login_required
 def user_wishlist():
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT p.*, w.created_at as added_date
-                FROM wishlist w
-                JOIN products p ON w.product_id = p.id
-                WHERE w.user_id = ? AND p.in_stock = 1
-                ORDER BY w.created_at DESC
-            """, (session["user_id"],))
-            
-            wishlist_items = []
-            for row in cursor.fetchall():
-                item = dict(row)
+        wishlist_items = []
+        for row in get_repo().wishlist.list_for_user(session["user_id"]):
+            item = dict(row)
+            item['subcategory'] = parse_subcategories(item.get('subcategory'))
+            
+            if item['added_date']:
                 try:
-                    if item.get('subcategory'):
-                        item['subcategory'] = json.loads(item['subcategory'])
+                    item['added_date'] = datetime.strptime(item['added_date'], "%Y-%m-%d %H:%M:%S")
                 except:
-                    item['subcategory'] = []
-                
-                if item['added_date']:
-                    try:
-                        item['added_date'] = datetime.strptime(item['added_date'], "%Y-%m-%d %H:%M:%S")
-                    except:
-                        item['added_date'] = datetime.now()
-                        
-                wishlist_items.append(item)
-                
+                    item['added_date'] = datetime.now()
+                    
+            wishlist_items.append(item)
+            
     except Exception as e:
         print(f"Wishlist error: {e}")
         wishlist_items = []
@@ -1936,36 +2476,31 @@ def add_to_wishlist(product_id):
     try:
         user_id = session["user_id"]
         
+        repo = get_repo()
+        
         # Check if product exists and is in stock
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, name FROM products WHERE id = ? AND in_stock = 1", (product_id,))
-            product = cursor.fetchone()
-            
-            if not product:
-                return jsonify({"success": False, "message": "Ürün bulunamadı"}), 404
-            
+        product = repo.products.get_available(product_id)
+        if not product:
+            return jsonify({"success": False, "message": "Ürün bulunamadı"}), 404
+        
+        def add(repo):
             # Check if already in wishlist
-            cursor.execute("SELECT id FROM wishlist WHERE user_id = ? AND product_id = ?", (user_id, product_id))
-            if cursor.fetchone():
-                return jsonify({"success": False, "message": "Ürün zaten favorilerinizde"})
-            
-            # Add to wishlist
-            cursor.execute("""
-                INSERT INTO wishlist (user_id, product_id)
-                VALUES (?, ?)
-            """, (user_id, product_id))
-            conn.commit()
-            
+            if repo.wishlist.contains(user_id, product_id):
+                return None
+            repo.wishlist.add(user_id, product_id)
+            repo.popularity.record(product_id, 'wishlist')
             # Get updated wishlist count
-            cursor.execute("SELECT COUNT(*) as count FROM wishlist WHERE user_id = ?", (user_id,))
-            count = cursor.fetchone()["count"]
-            
-            return jsonify({
-                "success": True, 
-                "message": f"{product['name']} favorilerinize eklendi!",
-                "wishlist_count": count
-            })
+            return repo.wishlist.count_for_user(user_id)
+        
+        count = db_write(add)
+        if count is None:
+            return jsonify({"success": False, "message": "Ürün zaten favorilerinizde"})
+        
+        return jsonify({
+            "success": True, 
+            "message": f"{product['name']} favorilerinize eklendi!",
+            "wishlist_count": count
+        })
             
     except Exception as e:
         print(f"Add to wishlist error: {e}")
@@ -1978,35 +2513,25 @@ def remove_from_wishlist(product_id):
     try:
         user_id = session["user_id"]
         
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
+        def remove(repo):
             # Get product name before deletion
-            cursor.execute("""
-                SELECT p.name FROM wishlist w
-                JOIN products p ON w.product_id = p.id
-                WHERE w.user_id = ? AND w.product_id = ?
-            """, (user_id, product_id))
-            
-            result = cursor.fetchone()
-            if not result:
-                return jsonify({"success": False, "message": "Ürün favorilerinizde değil"})
-            
-            product_name = result["name"]
-            
-            # Remove from wishlist
-            cursor.execute("DELETE FROM wishlist WHERE user_id = ? AND product_id = ?", (user_id, product_id))
-            conn.commit()
-            
+            product_name = repo.wishlist.get_product_name(user_id, product_id)
+            if not product_name:
+                return None
+            repo.wishlist.remove(user_id, product_id)
             # Get updated wishlist count
-            cursor.execute("SELECT COUNT(*) as count FROM wishlist WHERE user_id = ?", (user_id,))
-            count = cursor.fetchone()["count"]
-            
-            return jsonify({
-                "success": True, 
-                "message": f"{product_name} favorilerinizden çıkarıldı",
-                "wishlist_count": count
-            })
+            return product_name, repo.wishlist.count_for_user(user_id)
+        
+        removed = db_write(remove)
+        if not removed:
+            return jsonify({"success": False, "message": "Ürün favorilerinizde değil"})
+        product_name, count = removed
+        
+        return jsonify({
+            "success": True, 
+            "message": f"{product_name} favorilerinizden çıkarıldı",
+            "wishlist_count": count
+        })
             
     except Exception as e:
         print(f"Remove from wishlist error: {e}")
@@ -2018,12 +2543,8 @@ def check_wishlist_status(product_id):
     try:
         user_id = session["user_id"]
         
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id FROM wishlist WHERE user_id = ? AND product_id = ?", (user_id, product_id))
-            in_wishlist = cursor.fetchone() is not None
-            
-            return jsonify({"in_wishlist": in_wishlist})
+        in_wishlist = get_repo().wishlist.contains(user_id, product_id)
+        return jsonify({"in_wishlist": in_wishlist})
             
     except Exception as e:
         print(f"Check wishlist error: {e}")
@@ -2031,52 +2552,42 @@ def check_wishlist_status(product_id):
 
 # REVIEW & RATING SYSTEM
 
+def review_validators(product_id):
+    # Unknown ids stop here: no tag lookup, and clients can't probe arbitrary ids.
+    # In-stock products are checked in memory; only the rest cost a query.
+    if product_id not in catalog_engine.snapshot().by_id and not get_repo().products.get(product_id):
+        abort(app.make_response((jsonify({"error": "Ürün bulunamadı"}), 404)))
+    tag = f"reviews:{product_id}"
+    return tag_generations(tag), tags_last_modified(tag)
+
 @app.route("/api/reviews/<int:product_id>")
+@conditional(review_validators, "public, max-age=60")
 def get_product_reviews(product_id):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT r.*, u.first_name, u.last_name
-                FROM reviews r
-                JOIN users u ON r.user_id = u.id
-                WHERE r.product_id = ?
-                ORDER BY r.created_at DESC
-            """, (product_id,))
-            
-            reviews = []
-            total_rating = 0
-            rating_counts = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-            
-            for row in cursor.fetchall():
-                review = dict(row)
-                review['author_name'] = f"{review['first_name']} {review['last_name'][0]}."
-                
-                # Format date
-                if review['created_at']:
-                    try:
-                        review['created_at'] = datetime.strptime(review['created_at'], "%Y-%m-%d %H:%M:%S")
-                    except:
-                        review['created_at'] = datetime.now()
-                
-                reviews.append(review)
-                total_rating += review['rating']
-                rating_counts[review['rating']] += 1
-            
-            # Calculate average rating
-            avg_rating = round(total_rating / len(reviews), 1) if reviews else 0
-            
-            return jsonify({
-                "reviews": reviews,
-                "stats": {
-                    "total_reviews": len(reviews),
-                    "average_rating": avg_rating,
-                    "rating_distribution": rating_counts
-                }
-            })
+        repo = get_repo()
+        reviews = []
+        
+        for row in repo.reviews.list_for_product(product_id):
+            review = dict(row)
+            review['author_name'] = f"{review['first_name']} {review['last_name'][0]}."
+            
+            # Format date
+            if review['created_at']:
+                try:
+                    review['created_at'] = datetime.strptime(review['created_at'], "%Y-%m-%d %H:%M:%S")
+                except:
+                    review['created_at'] = datetime.now()
+            
+            reviews.append(review)
+        
+        return jsonify({
+            "reviews": reviews,
+            "stats": repo.reviews.stats(product_id)
+        })
             
     except Exception as e:
         print(f"Get reviews error: {e}")
+        g.uncacheable = True
         return jsonify({"reviews": [], "stats": {"total_reviews": 0, "average_rating": 0, "rating_distribution": {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}}})
 
 @app.route("/api/reviews/submit", methods=["POST"])
@@ -2101,32 +2612,29 @@ def submit_review():
         if len(comment) > 1000:
             return jsonify({"success": False, "message": "Yorum çok uzun (max 1000 karakter)"})
         
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
+        def create(repo):
             # Check if product exists
-            cursor.execute("SELECT id, name FROM products WHERE id = ?", (product_id,))
-            product = cursor.fetchone()
-            if not product:
-                return jsonify({"success": False, "message": "Ürün bulunamadı"})
+            if not repo.products.get(product_id):
+                return "Ürün bulunamadı"
             
             # Check if user already reviewed this product
-            cursor.execute("SELECT id FROM reviews WHERE user_id = ? AND product_id = ?", (user_id, product_id))
-            if cursor.fetchone():
-                return jsonify({"success": False, "message": "Bu ürün için zaten yorum yazmışsınız"})
+            if repo.reviews.has_reviewed(user_id, product_id):
+                return "Bu ürün için zaten yorum yazmışsınız"
             
             # Insert review
-            cursor.execute("""
-                INSERT INTO reviews (user_id, product_id, rating, title, comment)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, product_id, rating, title or None, comment or None))
-            
-            conn.commit()
-            
-            return jsonify({
-                "success": True, 
-                "message": "Yorumunuz başarıyla kaydedildi!"
-            })
+            repo.reviews.create(user_id, product_id, rating, title or None, comment or None)
+            repo.popularity.record(product_id, 'review')
+            return None
+        
+        error = db_write(create)
+        if error:
+            return jsonify({"success": False, "message": error})
+        invalidate_review_cache(product_id)
+        
+        return jsonify({
+            "success": True, 
+            "message": "Yorumunuz başarıyla kaydedildi!"
+        })
             
     except Exception as e:
         print(f"Submit review error: {e}")
@@ -2138,26 +2646,16 @@ def manage_user_reviews():
     try:
         user_id = session["user_id"]
         
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT r.*, p.name as product_name, p.image as product_image
-                FROM reviews r
-                JOIN products p ON r.product_id = p.id
-                WHERE r.user_id = ?
-                ORDER BY r.created_at DESC
-            """, (user_id,))
-            
-            user_reviews = []
-            for row in cursor.fetchall():
-                review = dict(row)
-                if review['created_at']:
-                    try:
-                        review['created_at'] = datetime.strptime(review['created_at'], "%Y-%m-%d %H:%M:%S")
-                    except:
-                        review['created_at'] = datetime.now()
-                user_reviews.append(review)
-                
+        user_reviews = []
+        for row in get_repo().reviews.list_for_user(user_id):
+            review = dict(row)
+            if review['created_at']:
+                try:
+                    review['created_at'] = datetime.strptime(review['created_at'], "%Y-%m-%d %H:%M:%S")
+                except:
+                    review['created_at'] = datetime.now()
+            user_reviews.append(review)
+            
     except Exception as e:
         print(f"Manage reviews error: {e}")
         user_reviews = []
@@ -2168,150 +2666,71 @@ def manage_user_reviews():
 @app.route("/product/<int:product_id>")
 def product_detail(product_id):
     try:
-        print(f"🔍 Product detail requested for ID: {product_id}")
-        print(f"🗄️ Database path: {db_path}")
-        print(f"📁 Database exists: {os.path.exists(db_path)}")
-        
-        # Direct database connection as fallback
-        conn = None
-        try:
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            print(f"📊 Direct database connection established")
-            
-            # Check if products table exists and has data
-            cursor.execute("SELECT COUNT(*) FROM products")
-            product_count = cursor.fetchone()[0]
-            print(f"📦 Total products in database: {product_count}")
-            
-            cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
-            product = cursor.fetchone()
-            print(f"🎯 Product query result: {product is not None}")
-            
-            if product:
-                print(f"✅ Product found: {dict(product)}")
-            
-            if not product:
-                print(f"❌ Product {product_id} not found in database")
-                
-                # Emergency: If database is empty, add sample products NOW!
-                if product_count == 0:
-                    print("🚨 EMERGENCY: Database empty, adding sample products NOW!")
-                    sample_products = [
-                        ("Royal Canin Kitten Mama", 450.0, "/static/uploads/1.webp", "Kedi", '["Mama"]', "2-12 aylık yavrular için özel formül kedi maması", "Royal Canin"),
-                        ("Lavital Kitten Somonlu Yavru Kedi Maması 1.5 KG", 340.0, "/static/uploads/2.webp", "Kedi", '["Mama"]', "6-52 hafta - 12 aylık dönemdeki yavru kediler için özel formüle edilen bir yavru kedi mamasıdır.", "Lavital"),
-                        ("Whiskas Yetişkin Kedi Maması", 280.0, "/static/uploads/3.webp", "Kedi", '["Mama"]', "Yetişkin kediler için dengeli beslenme", "Whiskas"),
-                        ("Pro Plan Köpek Maması", 520.0, "/static/uploads/4.webp", "Köpek", '["Mama"]', "Yetişkin köpekler için premium mama", "Pro Plan"),
-                        ("Pedigree Köpek Maması", 380.0, "/static/uploads/5.webp", "Köpek", '["Mama"]', "Köpeklerin sağlıklı yaşamı için", "Pedigree"),
-                        ("Kedi Oyuncağı Top", 45.0, "/static/uploads/6.webp", "Kedi", '["Oyuncak"]', "Renkli kedi oyun topu", "Generic"),
-                        ("Köpek Tasması", 120.0, "/static/uploads/7.webp", "Köpek", '["Aksesuar"]', "Ayarlanabilir köpek tasması", "Generic"),
-                        ("Kedi Kumu 10L", 85.0, "/static/uploads/8.webp", "Kedi", '["Bakım"]', "Kokusuz kedi kumu", "Generic"),
-                        ("Balık Yemi", 25.0, "/static/uploads/9.webp", "Balık", '["Yem"]', "Tropikal balıklar için yem", "Generic"),
-                        ("Kuş Yemi", 35.0, "/static/uploads/10.webp", "Kuş", '["Yem"]', "Muhabbet kuşları için karma yem", "Generic"),
-                    ]
-                    
-                    for product_data in sample_products:
-                        cursor.execute("""
-                            INSERT INTO products (name, price, image, category, subcategory, description, brand, in_stock)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, 1)
-                        """, product_data)
-                    
-                    conn.commit()
-                    print(f"🆘 EMERGENCY: {len(sample_products)} products added!")
-                    
-                    # Try again after adding products
-                    cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
-                    product = cursor.fetchone()
-                    
-                    if product:
-                        print(f"✅ RECOVERED: Product {product_id} now found after emergency insert!")
-                        # Continue normal flow
-                    else:
-                        print(f"💀 STILL NOT FOUND: Product {product_id} even after emergency insert")
+        repo = get_repo()
+        product = repo.products.get(product_id)
+        
+        if not product:
+            print(f"❌ Product {product_id} not found in database")
+            
+            # Emergency: If database is empty, add sample products NOW!
+            if repo.products.count() == 0:
+                print("🚨 EMERGENCY: Database empty, adding sample products NOW!")
+                def seed(write_repo):
+                    if write_repo.products.count() == 0:
+                        for name, price, image, category, subcategory, description, brand in SAMPLE_PRODUCTS:
+                            write_repo.products.create(name, price, image, category,
+                                                       parse_subcategories(subcategory),
+                                                       description, brand, in_stock=1)
+                db_write(seed)
+                print(f"🆘 EMERGENCY: {len(SAMPLE_PRODUCTS)} products added!")
                 
-                if not product:
-                    # Show available products
-                    cursor.execute("SELECT id, name FROM products LIMIT 10")
-                    available = cursor.fetchall()
-                    print(f"📋 Available products: {[dict(p) for p in available]}")
-                    return render_template("404.html"), 404
+                # Try again after adding products
+                product = repo.products.get(product_id)
+                if product:
+                    print(f"✅ RECOVERED: Product {product_id} now found after emergency insert!")
             
-            product = dict(product)
+            if not product:
+                # Show available products
+                available = repo.products.list_sample(10)
+                print(f"📋 Available products: {[dict(p) for p in available]}")
+                return render_template("404.html"), 404
+        
+        product = dict(product)
+        popularity_tracker.record_view(product_id)
+        
+        product['subcategory'] = parse_subcategories(product.get('subcategory'))
+        
+        # Son 5 yorum + product_rating_stats üzerinden doğru ortalama
+        reviews = []
+        for row in repo.reviews.list_for_product(product_id, limit=5):
+            review = dict(row)
+            review['author_name'] = f"{review['first_name']} {review['last_name'][0]}."
             
-            # Parse subcategory JSON
-            if product.get('subcategory'):
+            if review['created_at']:
                 try:
-                    product['subcategory'] = json.loads(product['subcategory'])
+                    review['created_at'] = datetime.strptime(review['created_at'], "%Y-%m-%d %H:%M:%S")
                 except:
-                    product['subcategory'] = []
-            
-            # Get reviews (only if tables exist)
-            reviews = []
-            avg_rating = 0
-            user_reviewed = False
+                    review['created_at'] = datetime.now()
             
-            try:
-                # Check if reviews and users tables exist
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='reviews'")
-                reviews_table_exists = cursor.fetchone()
-                
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-                users_table_exists = cursor.fetchone()
-                
-                if reviews_table_exists and users_table_exists:
-                    cursor.execute("""
-                        SELECT r.*, u.first_name, u.last_name
-                        FROM reviews r
-                        JOIN users u ON r.user_id = u.id
-                        WHERE r.product_id = ?
-                        ORDER BY r.created_at DESC
-                        LIMIT 5
-                    """, (product_id,))
-                    
-                    total_rating = 0
-                    
-                    for row in cursor.fetchall():
-                        review = dict(row)
-                        review['author_name'] = f"{review['first_name']} {review['last_name'][0]}."
-                        
-                        if review['created_at']:
-                            try:
-                                review['created_at'] = datetime.strptime(review['created_at'], "%Y-%m-%d %H:%M:%S")
-                            except:
-                                review['created_at'] = datetime.now()
-                        
-                        reviews.append(review)
-                        total_rating += review['rating']
-                    
-                    # Calculate average rating
-                    avg_rating = round(total_rating / len(reviews), 1) if reviews else 0
-                    
-                    # Check if user already reviewed (if logged in)
-                    if session.get("user_logged_in"):
-                        cursor.execute("SELECT id FROM reviews WHERE user_id = ? AND product_id = ?", 
-                                     (session["user_id"], product_id))
-                        user_reviewed = cursor.fetchone() is not None
-            except Exception as reviews_error:
-                print(f"Reviews check error (normal if tables don't exist): {reviews_error}")
-                reviews = []
-                avg_rating = 0
-                user_reviewed = False
-            
-            return render_template("product_detail.html", 
-                                 product=product, 
-                                 reviews=reviews,
-                                 avg_rating=avg_rating,
-                                 total_reviews=len(reviews),
-                                 user_reviewed=user_reviewed)
-        finally:
-            if conn:
-                conn.close()
+            reviews.append(review)
+        
+        rating_stats = repo.reviews.stats(product_id)
+        
+        # Check if user already reviewed (if logged in)
+        user_reviewed = False
+        if session.get("user_logged_in"):
+            user_reviewed = repo.reviews.has_reviewed(session["user_id"], product_id)
+        
+        return render_template("product_detail.html", 
+                             product=product, 
+                             reviews=reviews,
+                             avg_rating=rating_stats["average_rating"],
+                             total_reviews=rating_stats["total_reviews"],
+                             user_reviewed=user_reviewed)
             
     except Exception as e:
         print(f"💥 Product detail error: {e}")
         print(f"🔍 Error type: {type(e).__name__}")
-        import traceback
         print(f"📋 Full traceback: {traceback.format_exc()}")
         return render_template("404.html"), 404
 
@@ -2344,11 +2763,14 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "database_pool": db_pool.get_stats() if db_pool else None,
+        "database_writer": db_writer.get_stats() if db_writer else None
     })
 
 # Sitemap for SEO
 @app.route("/sitemap.xml")
+@conditional(lambda: (tag_generations("catalog"), tags_last_modified("catalog")), "public, max-age=3600")
 def sitemap():
     try:
         with get_db_connection() as conn:
@@ -2413,9 +2835,7 @@ def sitemap():
         return "Error generating sitemap", 500
 
 # Robots.txt for SEO
-@app.route("/robots.txt")
-def robots():
-    robots_txt = '''User-agent: *
+ROBOTS_TXT = '''User-agent: *
 Allow: /
 Disallow: /admin/
 Disallow: /api/
@@ -2425,9 +2845,12 @@ Disallow: /login
 Disallow: /register
 
 Sitemap: https://pethome.com/sitemap.xml'''
-    
+
+@app.route("/robots.txt")
+@conditional(lambda: ((ROBOTS_TXT,), None), "public, max-age=86400")
+def robots():
     response = app.response_class(
-        response=robots_txt,
+        response=ROBOTS_TXT,
         status=200,
         mimetype='text/plain'
     )
@@ -2446,38 +2869,28 @@ def newsletter_subscribe():
         if not user_manager.validate_email(email):
             return jsonify({"success": False, "message": "Geçersiz email formatı"})
         
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
+        def subscribe(repo):
             # Check if already subscribed
-            cursor.execute("SELECT id, is_active FROM newsletter_subscriptions WHERE email = ?", (email,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                if existing['is_active']:
-                    return jsonify({"success": False, "message": "Bu email adresi zaten newsletter'a kayıtlı"})
-                else:
-                    # Reactivate subscription
-                    cursor.execute("""
-                        UPDATE newsletter_subscriptions 
-                        SET is_active = 1, unsubscribed_at = NULL
-                        WHERE email = ?
-                    """, (email,))
-                    conn.commit()
-                    
-                    return jsonify({"success": True, "message": "Newsletter aboneliğiniz yeniden aktif edildi!"})
-            else:
-                # New subscription
-                cursor.execute("""
-                    INSERT INTO newsletter_subscriptions (email)
-                    VALUES (?)
-                """, (email,))
-                conn.commit()
-                
-                # Send welcome email
-                if notification_service.email_enabled:
-                    welcome_subject = "🐾 Pethome Newsletter'a Hoş Geldiniz!"
-                    welcome_body = f"""
+            existing = repo.newsletter.get(email)
+            if not existing:
+                repo.newsletter.subscribe(email)
+                return "new"
+            if existing['is_active']:
+                return "exists"
+            # Reactivate subscription
+            repo.newsletter.reactivate(email)
+            return "reactivated"
+        
+        outcome = db_write(subscribe)
+        if outcome == "exists":
+            return jsonify({"success": False, "message": "Bu email adresi zaten newsletter'a kayıtlı"})
+        if outcome == "reactivated":
+            return jsonify({"success": True, "message": "Newsletter aboneliğiniz yeniden aktif edildi!"})
+        
+        # Send welcome email
+        if notification_service.email_enabled:
+            welcome_subject = "🐾 Pethome Newsletter'a Hoş Geldiniz!"
+            welcome_body = f"""
 Merhaba,
 
 Pethome newsletter'ına abone olduğunuz için teşekkürler! 🎉
@@ -2491,10 +2904,10 @@ Artık:
 Newsletter'dan çıkmak için: https://pethome.com/newsletter/unsubscribe?email={email}
 
 Pethome Ekibi
-                    """
-                    notification_service.send_email(email, welcome_subject, welcome_body)
-                
-                return jsonify({"success": True, "message": "Newsletter'a başarıyla abone oldunuz!"})
+            """
+            notification_service.send_email(email, welcome_subject, welcome_body)
+        
+        return jsonify({"success": True, "message": "Newsletter'a başarıyla abone oldunuz!"})
                 
     except Exception as e:
         app.logger.error(f"Newsletter subscription error: {e}")
@@ -2508,21 +2921,10 @@ def newsletter_unsubscribe():
         return render_template("newsletter_unsubscribe.html", error="Email adresi gereklidir")
     
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id FROM newsletter_subscriptions WHERE email = ? AND is_active = 1", (email,))
-            
-            if cursor.fetchone():
-                cursor.execute("""
-                    UPDATE newsletter_subscriptions 
-                    SET is_active = 0, unsubscribed_at = CURRENT_TIMESTAMP
-                    WHERE email = ?
-                """, (email,))
-                conn.commit()
-                
-                return render_template("newsletter_unsubscribe.html", success=True, email=email)
-            else:
-                return render_template("newsletter_unsubscribe.html", error="Bu email adresi newsletter'da kayıtlı değil")
+        if db_write(lambda repo: repo.newsletter.unsubscribe(email)):
+            return render_template("newsletter_unsubscribe.html", success=True, email=email)
+        else:
+            return render_template("newsletter_unsubscribe.html", error="Bu email adresi newsletter'da kayıtlı değil")
                 
     except Exception as e:
         app.logger.error(f"Newsletter unsubscribe error: {e}")
@@ -2626,30 +3028,57 @@ Pethome Ekibi
         return jsonify({"success": False, "message": "Bir hata oluştu"}), 500
 
 
+@app.route("/admin/warm_cache", methods=["POST"])
+@login_required
+def admin_warm_cache():
+    """Önbelleği elle ısıt (deploy sonrası ya da toplu ürün yüklemesinden sonra)"""
+    report = warm_caches()
+    return jsonify(dict(report, success=not report['errors']))
+
+
+@app.route("/admin/cache_stats")
+@login_required
+def admin_cache_stats():
+    """Önbellek istatistikleri (bu worker'ın sayaçları; TTL ve boyut ayarı için)"""
+    backend = cache.cache
+    return jsonify({
+        "worker_pid": os.getpid(),
+        "backend": {
+            "type": app.config['CACHE_TYPE'],
+            "default_timeout": app.config['CACHE_DEFAULT_TIMEOUT'],
+            "threshold": app.config['CACHE_THRESHOLD'],
+            **(backend.get_stats() if hasattr(backend, 'get_stats') else {}),
+        },
+        "memoized": memo_stats(),
+        "page_cache": dict(page_cache_stats, ttl=PAGE_CACHE_TTL),
+        "product_cards": dict(product_card_stats, cached=len(product_card_fragments)),
+        "search_cache": search_cache.get_stats(),
+        "catalog_engine": catalog_engine.get_stats(),
+        "catalog_version": catalog_version['seen'],
+        "suggest_index": suggest_index.get_stats(),
+        "fuzzy_index": fuzzy_index.get_stats(),
+        "popularity_tracker": popularity_tracker.get_stats(),
+        "conditional_requests": dict(conditional_stats),
+    })
+
+
 @app.route("/admin")
 @app.route("/admin/")
 @login_required
 def admin_panel():
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    # Ürünleri al
-    cursor.execute("SELECT * FROM products ORDER BY id DESC")
-    products = cursor.fetchall()
+    repo = get_repo()
     
-    # Siparişleri al
-    cursor.execute("SELECT * FROM orders ORDER BY id DESC")
-    orders = cursor.fetchall()
+    # Ürünleri sayfa sayfa al (keyset)
+    cursor = request.args.get("cursor") or None
+    try:
+        products, next_cursor = repo.products.page(cursor, ADMIN_PAGE_SIZE)
+    except InvalidCursor:
+        return redirect(url_for("admin_panel"))
     
-    # Her siparişi dict'e çevirip ürünlerini ekle
-    orders_with_items = []
-    for order in orders:
+    # Son siparişleri al (kalemler panelde gösterilmiyor)
+    order_list = []
+    for order in repo.orders.list_recent(5):
         order_dict = dict(order)
-        try:
-            order_dict["items"] = json.loads(order["items"])
-        except:
-            order_dict["items"] = []
         
         # created_at'i datetime object'e çevir
         try:
@@ -2659,26 +3088,21 @@ def admin_panel():
             # Eğer datetime dönüşümü başarısız olursa şu anki zamanı kullan
             order_dict["created_at"] = datetime.now()
         
-        orders_with_items.append(order_dict)
+        order_list.append(order_dict)
     
     # İstatistikler için sayıları hesapla
-    cursor.execute("SELECT COUNT(*) as count FROM products")
-    product_count = cursor.fetchone()["count"]
-    
-    cursor.execute("SELECT COUNT(*) as count FROM orders")
-    order_count = cursor.fetchone()["count"]
+    product_count = repo.products.count()
+    order_count = repo.orders.count()
     
     # Mesaj tablosu varsa mesaj sayısını al
     try:
-        cursor.execute("SELECT COUNT(*) as count FROM messages")
-        message_count = cursor.fetchone()["count"]
+        message_count = repo.messages.count()
     except:
         message_count = 0
     
     # Kampanya tablosu varsa kampanya sayısını al
     try:
-        cursor.execute("SELECT COUNT(*) as count FROM campaigns")
-        campaign_count = cursor.fetchone()["count"]
+        campaign_count = repo.campaigns.count()
     except:
         campaign_count = 0
     
@@ -2690,18 +3114,21 @@ def admin_panel():
         stock_stats = {'low_stock_count': 0, 'total_stock_value': 0}
         low_stock_products = []
     
-    # Son 5 siparişi al
-    recent_orders = orders_with_items[:5]
+    recent_orders = order_list
+    
+    # Çok satanlar (order_items üzerinden SQL aggregate)
+    best_sellers = repo.orders.best_sellers(limit=5)
     
-    conn.close()
     return render_template("admin_panel.html", 
                          products=products, 
-                         orders=orders_with_items,
+                         next_cursor=next_cursor,
+                         cursor=cursor,
                          product_count=product_count,
                          order_count=order_count,
                          message_count=message_count,
                          campaign_count=campaign_count,
                          recent_orders=recent_orders,
+                         best_sellers=best_sellers,
                          stock_stats=stock_stats,
                          low_stock_products=low_stock_products)
 
@@ -2768,39 +3195,35 @@ def admin_update_balance():
         if not user_id or not operation:
             return jsonify({"success": False, "message": "Eksik parametreler"}), 400
             
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
+        if operation not in ("add", "subtract"):
+            return jsonify({"success": False, "message": "Geçersiz işlem"}), 400
+        
+        def update(repo):
             # Get current balance
-            cursor.execute("SELECT balance, first_name, last_name FROM users WHERE id = ?", (user_id,))
-            user = cursor.fetchone()
-            
+            user = repo.users.get_balance(user_id)
             if not user:
-                return jsonify({"success": False, "message": "Kullanıcı bulunamadı"}), 404
-                
+                return None
             current_balance = user[0] or 0
-            user_name = f"{user[1]} {user[2]}"
-            
             if operation == "add":
                 new_balance = current_balance + amount
-            elif operation == "subtract":
-                new_balance = max(0, current_balance - amount)  # Don't allow negative balance
             else:
-                return jsonify({"success": False, "message": "Geçersiz işlem"}), 400
-            
-            # Update balance
-            cursor.execute("UPDATE users SET balance = ? WHERE id = ?", (new_balance, user_id))
-            
-            # Log the transaction (you might want to create a balance_transactions table)
-            print(f"💰 Balance update: User {user_name} (ID:{user_id}) - {operation} {amount} TL - New balance: {new_balance} TL - Note: {note}")
-            
-            conn.commit()
-            
-            return jsonify({
-                "success": True, 
-                "message": f"Bakiye güncellendi: {current_balance:.2f} → {new_balance:.2f} TL",
-                "new_balance": new_balance
-            })
+                new_balance = max(0, current_balance - amount)  # Don't allow negative balance
+            repo.users.set_balance(user_id, new_balance)
+            return f"{user[1]} {user[2]}", current_balance, new_balance
+        
+        updated = db_write(update)
+        if not updated:
+            return jsonify({"success": False, "message": "Kullanıcı bulunamadı"}), 404
+        user_name, current_balance, new_balance = updated
+        
+        # Log the transaction (you might want to create a balance_transactions table)
+        print(f"💰 Balance update: User {user_name} (ID:{user_id}) - {operation} {amount} TL - New balance: {new_balance} TL - Note: {note}")
+        
+        return jsonify({
+            "success": True, 
+            "message": f"Bakiye güncellendi: {current_balance:.2f} → {new_balance:.2f} TL",
+            "new_balance": new_balance
+        })
             
     except Exception as e:
         print(f"Balance update error: {e}")
@@ -2809,9 +3232,7 @@ def admin_update_balance():
 @app.route("/admin/campaigns", methods=["GET", "POST"])
 @login_required
 def admin_campaigns():
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    repo = get_repo()
     message = None
     
     # Kampanya ekleme
@@ -2828,16 +3249,7 @@ def admin_campaigns():
             image_path = f"/static/uploads/{filename}"
             created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             
-            # description kolonu yoksa ekle
-            try:
-                cursor.execute("ALTER TABLE campaigns ADD COLUMN description TEXT")
-                conn.commit()
-            except:
-                pass
-            
-            cursor.execute("INSERT INTO campaigns (image, link, title, description, active, created_at) VALUES (?, ?, ?, ?, ?, ?)", 
-                         (image_path, link, title, description, active, created_at))
-            conn.commit()
+            db_write(lambda repo: repo.campaigns.create(image_path, link, title, description, active, created_at))
             
             # Invalidate campaign cache
             invalidate_campaign_cache()
@@ -2850,8 +3262,8 @@ def admin_campaigns():
     if request.args.get("delete"):
         cid = request.args.get("delete")
         try:
-            cursor.execute("DELETE FROM campaigns WHERE id = ?", (cid,))
-            conn.commit()
+            db_write(lambda repo: repo.campaigns.delete(cid))
+            invalidate_campaign_cache()
             message = "Kampanya başarıyla silindi!"
         except Exception as e:
             message = f"Kampanya silinirken hata oluştu: {str(e)}"
@@ -2860,21 +3272,16 @@ def admin_campaigns():
     if request.args.get("toggle"):
         cid = request.args.get("toggle")
         try:
-            cursor.execute("SELECT active FROM campaigns WHERE id = ?", (cid,))
-            row = cursor.fetchone()
-            if row:
-                new_status = 0 if row[0] else 1
-                cursor.execute("UPDATE campaigns SET active = ? WHERE id = ?", (new_status, cid))
-                conn.commit()
+            new_status = db_write(lambda repo: repo.campaigns.toggle(cid))
+            if new_status is not None:
+                invalidate_campaign_cache()
                 status_text = "aktif" if new_status else "pasif"
                 message = f"Kampanya durumu {status_text} yapıldı!"
         except Exception as e:
             message = f"Kampanya durumu güncellenirken hata oluştu: {str(e)}"
     
     # Kampanyaları getir
-    cursor.execute("SELECT * FROM campaigns ORDER BY id DESC")
-    campaigns_raw = cursor.fetchall()
-    conn.close()
+    campaigns_raw = repo.campaigns.list_all()
     
     # Campaigns'ı formatla
     campaigns = []
@@ -2901,12 +3308,11 @@ def admin_campaigns():
 @app.route("/admin/messages")
 @login_required
 def admin_messages():
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM messages ORDER BY created_at DESC")
-    messages_raw = cursor.fetchall()
-    conn.close()
+    cursor = request.args.get("cursor") or None
+    try:
+        messages_raw, next_cursor = get_repo().messages.page(cursor, ADMIN_PAGE_SIZE)
+    except InvalidCursor:
+        return redirect(url_for("admin_messages"))
     
     # Messages'ı formatla
     messages = []
@@ -2920,12 +3326,13 @@ def admin_messages():
             message_dict["created_at"] = datetime.now()
         messages.append(message_dict)
     
-    return render_template("admin_messages.html", messages=messages)
+    return render_template("admin_messages.html", messages=messages, next_cursor=next_cursor, cursor=cursor)
 
 @app.route("/admin/stock", methods=["GET", "POST"])
 @login_required
 def admin_stock():
     message = None
+    cursor = request.args.get("cursor") or None
     
     # Handle stock updates
     if request.method == "POST":
@@ -2941,34 +3348,24 @@ def admin_stock():
                 new_quantity = int(new_quantity) if new_quantity else 0
                 threshold = int(threshold) if threshold else 5
                 
-                with get_db_connection() as conn:
-                    cursor = conn.cursor()
-                    
+                def update(repo):
                     # Get current stock
-                    cursor.execute("SELECT stock_quantity, name FROM products WHERE id = ?", (product_id,))
-                    product = cursor.fetchone()
-                    
+                    product = repo.products.get_stock(product_id)
                     if product:
-                        old_quantity = product['stock_quantity'] or 0
-                        
-                        cursor.execute("""
-                            UPDATE products 
-                            SET stock_quantity = ?, 
-                                low_stock_threshold = ?,
-                                last_restocked = CURRENT_TIMESTAMP
-                            WHERE id = ?
-                        """, (new_quantity, threshold, product_id))
-                        
-                        conn.commit()
-                        
-                        # Invalidate caches
-                        invalidate_product_cache()
-                        cache.delete_memoized(get_low_stock_products)
-                        cache.delete_memoized(get_stock_statistics)
-                        
-                        message = f"✅ {product['name']} stoku güncellendi: {old_quantity} → {new_quantity}"
-                    else:
-                        message = "❌ Ürün bulunamadı"
+                        repo.products.set_stock(product_id, new_quantity, threshold)
+                    return product
+                
+                product = db_write(update)
+                
+                if product:
+                    old_quantity = product['stock_quantity'] or 0
+                    
+                    # Invalidate caches
+                    invalidate_stock_cache()
+                    
+                    message = f"✅ {product['name']} stoku güncellendi: {old_quantity} → {new_quantity}"
+                else:
+                    message = "❌ Ürün bulunamadı"
                         
             except ValueError:
                 message = "❌ Geçersiz sayı formatı"
@@ -2980,38 +3377,34 @@ def admin_stock():
         stock_stats = get_stock_statistics()
         low_stock_products = get_low_stock_products()
         
-        # Get all products with stock info
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, name, category, brand, price, stock_quantity, 
-                       low_stock_threshold, last_restocked, in_stock
-                FROM products 
-                ORDER BY 
-                    CASE WHEN stock_quantity <= COALESCE(low_stock_threshold, 5) THEN 0 ELSE 1 END,
-                    stock_quantity ASC, name ASC
-            """)
-            all_products = []
-            for row in cursor.fetchall():
-                product = dict(row)
-                # Format last_restocked
-                if product['last_restocked']:
-                    try:
-                        product['last_restocked'] = datetime.strptime(product['last_restocked'], "%Y-%m-%d %H:%M:%S")
-                    except:
-                        product['last_restocked'] = None
-                all_products.append(product)
-                
+        # Get one page of products with stock info
+        all_products = []
+        rows, next_cursor = get_repo().products.stock_page(cursor, ADMIN_PAGE_SIZE)
+        for row in rows:
+            product = dict(row)
+            # Format last_restocked
+            if product['last_restocked']:
+                try:
+                    product['last_restocked'] = datetime.strptime(product['last_restocked'], "%Y-%m-%d %H:%M:%S")
+                except:
+                    product['last_restocked'] = None
+            all_products.append(product)
+            
+    except InvalidCursor:
+        return redirect(url_for("admin_stock"))
     except Exception as e:
         print(f"Stock data error: {e}")
         stock_stats = {'low_stock_count': 0, 'total_stock_value': 0, 'total_stock_units': 0}
         low_stock_products = []
         all_products = []
+        next_cursor = None
     
     return render_template("admin_stock.html", 
                          stock_stats=stock_stats,
                          low_stock_products=low_stock_products,
                          all_products=all_products,
+                         next_cursor=next_cursor,
+                         cursor=cursor,
                          message=message)
 
 
@@ -3022,18 +3415,13 @@ def update_order_status_form(order_id):
     shipping_company = request.form.get("shipping_company", "")
     tracking_number = request.form.get("tracking_number", "")
     
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    # Get order data for notification before update
-    cursor.execute("SELECT * FROM orders WHERE id = ?", (order_id,))
-    order_row = cursor.fetchone()
-    order_data = dict(order_row) if order_row else None
+    def update(repo):
+        # Get order data for notification before update
+        order_row = repo.orders.get(order_id)
+        repo.orders.update_status_and_shipping(order_id, new_status, shipping_company, tracking_number)
+        return dict(order_row) if order_row else None
     
-    cursor.execute("UPDATE orders SET status = ?, shipping_company = ?, tracking_number = ? WHERE id = ?", (new_status, shipping_company, tracking_number, order_id))
-    conn.commit()
-    conn.close()
+    order_data = db_write(update)
     
     # Send notification to customer
     if order_data:
@@ -3049,55 +3437,62 @@ def order_track():
     items = []
     if request.method == "POST":
         code = request.form["code"].strip().upper()
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM orders WHERE order_code = ?", (code,))
-        result = cursor.fetchone()
-        conn.close()
+        repo = get_repo()
+        result = repo.orders.get_by_code(code)
         if result:
-            try:
-                items = json.loads(result["items"])
-            except:
-                items = []
+            items = repo.orders.list_items(result["id"])
         else:
             not_found = True
     return render_template("order_track.html", result=result, items=items, not_found=not_found)
 
 
+def brand_validators():
+    category = request.args.get("category") or session.get("selected_category")
+    tags = ("products", category_tag(category))
+    return ((turkish_fold(category or ""), response_catalog_version(), tag_generations(*tags)),
+            tags_last_modified(*tags))
+
 @app.route("/api/brands")
-@cache.memoize(timeout=3600)
 @monitor_performance
+@conditional(brand_validators, "private, max-age=60")
 def get_brands():
     """Get all available brands for filtering"""
     try:
-        category = session.get("selected_category")
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Get distinct brands for the selected category
-            if category:
-                cursor.execute("""
-                    SELECT DISTINCT brand FROM products 
-                    WHERE brand IS NOT NULL AND brand != '' 
-                    AND in_stock = 1 AND LOWER(category) = LOWER(?)
-                    ORDER BY brand
-                """, (category,))
-            else:
-                cursor.execute("""
-                    SELECT DISTINCT brand FROM products 
-                    WHERE brand IS NOT NULL AND brand != '' 
-                    AND in_stock = 1
-                    ORDER BY brand
-                """)
-            
-            brands = [row[0] for row in cursor.fetchall()]
-            return jsonify({"brands": brands})
+        category = request.args.get("category") or session.get("selected_category")
+        # Per-category brand index in the catalog snapshot; no SQL on this path
+        try:
+            snapshot = catalog_engine.snapshot_at(g.get('cache_catalog_version'))
+        except StaleSnapshot:
+            snapshot = None
+            g.uncacheable = True  # catalog moved since the ETag was computed
+        brands = catalog_engine.brands(category, snapshot)
+        return jsonify({"brands": list(brands), "counts": brands})
             
     except Exception as e:
         print(f"Brands API error: {e}")
+        g.uncacheable = True
         return jsonify({"brands": []})
 
+def autocomplete_suggestions(query, category=None, limit=8):
+    return suggest_index.suggest(query, turkish_fold(category) if category else None, limit)
+
+def add_fuzzy_matches(response, query, category=None):
+    """Top up a thin first search page with typo-tolerant matches ("wiskas" -> Whiskas)"""
+    room = api_page_size(SEARCH_PAGE_SIZE) - len(response["products"])
+    if room <= 0:
+        return
+    seen = {product["id"] for product in response["products"]}
+    matches = fuzzy_index.search(query, turkish_fold(category) if category else None, room, seen)
+    similarity = dict(matches)
+    rows = get_repo().products.get_available_many([product_id for product_id, _ in matches])
+    for row in rows:
+        product = dict(row)
+        product["fuzzy"] = True
+        product["similarity"] = similarity[product["id"]]
+        response["products"].append(product)
+    response["count"] += len(rows)
+    response["fuzzy_count"] = len(rows)
+
 @app.route("/api/search")
 @rate_limit(30, 60)  # Max 30 search requests per minute
 @monitor_performance
@@ -3111,44 +3506,41 @@ def search_products():
         return jsonify({"products": [], "suggestions": []})
     
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Search in product names, brands, and descriptions
-            search_query = """
-                SELECT * FROM products 
-                WHERE in_stock = 1 
-                AND (LOWER(name) LIKE ? OR LOWER(brand) LIKE ? OR LOWER(description) LIKE ?)
-            """
-            
-            if category:
-                search_query += " AND LOWER(category) = LOWER(?)"
-                params = [f"%{query.lower()}%", f"%{query.lower()}%", f"%{query.lower()}%", category]
-            else:
-                params = [f"%{query.lower()}%", f"%{query.lower()}%", f"%{query.lower()}%"]
-            
-            cursor.execute(search_query, params)
-            products = [dict(row) for row in cursor.fetchall()]
-            
-            # For autocomplete, return suggestions only
-            if autocomplete:
-                suggestions = set()
-                for p in products[:10]:
-                    if p['name'] and query.lower() in p['name'].lower():
-                        suggestions.add(p['name'])
-                    if p['brand'] and query.lower() in p['brand'].lower():
-                        suggestions.add(p['brand'])
-                
-                return jsonify({
-                    "suggestions": list(suggestions)[:8],
-                    "count": len(products)
-                })
-            
-            # For full search, return products
-            return jsonify({
-                "products": products[:20],
-                "count": len(products)
-            })
+        # Popular queries ("mama", "kum") are answered from the result cache
+        cursor = request.args.get("cursor") or None
+        limit = api_page_size(SEARCH_PAGE_SIZE)
+        mode = "autocomplete" if autocomplete else "full"
+        cache_key = search_cache.key(query, turkish_fold(category) if category else None,
+                                     mode, cursor, limit)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return jsonify(cached)
+        version = catalog_engine.generation
+        # Search in product names, brands, and descriptions
+        products_repo = get_repo().products
+        
+        # For autocomplete, answer from the in-memory prefix index
+        if autocomplete:
+            response = {"suggestions": autocomplete_suggestions(query, category)}
+            search_cache.put(cache_key, response, version)
+            return jsonify(response)
+        
+        # For full search, return one page of products; the total only on the first page
+        try:
+            rows, next_cursor = products_repo.search_page(query, category, cursor, limit)
+        except InvalidCursor as e:
+            return jsonify({"error": str(e)}), 400
+        
+        response = {
+            "products": [dict(row) for row in rows],
+            "next_cursor": next_cursor
+        }
+        if not cursor:
+            response["count"] = products_repo.search_count(query, category)
+            if response["count"] < SEARCH_FUZZY_MIN_RESULTS:
+                add_fuzzy_matches(response, query, category)
+        search_cache.put(cache_key, response, version)
+        return jsonify(response)
             
     except Exception as e:
         print(f"Search error: {e}")
@@ -3157,8 +3549,11 @@ def search_products():
 @app.route("/api/suggestions")
 @monitor_performance 
 def get_suggestions():
-    """Get search suggestions for autocomplete - redirects to search API"""
-    return search_products()
+    """Autocomplete suggestions from the in-memory prefix index (no SQLite round trip)"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"suggestions": []})
+    return jsonify({"suggestions": autocomplete_suggestions(query, session.get("selected_category"))})
 
 
 # Removed duplicate error handlers - using enhanced versions above
@@ -0,0 +1,329 @@
+"""Flask-Caching backend shared by every worker on the host.
+
+SimpleCache lives inside one process, so with several gunicorn workers each
+has its own cold cache and an admin edit only clears the worker that served
+it. SQLiteCache keeps entries in one SQLite file (WAL, so readers never block
+each other), which makes memoized results and delete_memoized/clear() visible
+to all workers.
+
+    CACHE_TYPE=cache_backends.SQLiteCache   (default)
+    CACHE_SQLITE_PATH=/path/to/cache.db
+
+Any other Flask-Caching backend (e.g. CACHE_TYPE=RedisCache with
+CACHE_REDIS_URL) can be configured instead; the app only relies on the
+standard get/set/add/delete/clear/inc API.
+
+memoize_swr() is a drop-in for cache.memoize with single-flight misses and
+stale-while-revalidate on top of any of these backends.
+"""
+import functools
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_caching.backends.base import BaseCache
+
+
+def _miss_on_error(default):
+    """sqlite errors (locked, disk full, corrupt file) read as a cache miss when
+    ignore_errors is set, like an unreachable Redis; otherwise they propagate"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return method(self, *args, **kwargs)
+            except sqlite3.Error as e:
+                if not self.ignore_errors:
+                    raise
+                print(f"SQLiteCache.{method.__name__} error: {e}")
+                return default
+        return wrapper
+    return decorator
+
+
+class SQLiteCache(BaseCache):
+    # Entries over the threshold are pruned once every PRUNE_EVERY writes
+    PRUNE_EVERY = 50
+
+    def __init__(self, path, default_timeout=300, threshold=500, ignore_errors=False):
+        super().__init__(default_timeout)
+        self.path = path
+        self.threshold = threshold
+        self.ignore_errors = ignore_errors
+        self._local = threading.local()
+        self._writes = 0
+        self._evictions = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires_at ON cache(expires_at)")
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        path = config.get("CACHE_SQLITE_PATH") or os.path.join(app.instance_path, "cache.db")
+        kwargs.update(threshold=config["CACHE_THRESHOLD"], ignore_errors=config["CACHE_IGNORE_ERRORS"])
+        return cls(path, *args, **kwargs)
+
+    def _conn(self):
+        """One connection per thread; sqlite3 connections are not shared across threads"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _expires_at(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout > 0 else None
+
+    @_miss_on_error(None)
+    def get(self, key):
+        row = self._conn().execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        try:
+            return pickle.loads(row[0])
+        except (pickle.PickleError, EOFError, AttributeError, ImportError):
+            return None
+
+    @_miss_on_error(False)
+    def set(self, key, value, timeout=None):
+        self._conn().execute("INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                             (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._expires_at(timeout)))
+        self._after_write()
+        return True
+
+    @_miss_on_error(False)
+    def add(self, key, value, timeout=None):
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE key = ? AND expires_at <= ?", (key, time.time()))
+        cursor = conn.execute("INSERT OR IGNORE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                              (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._expires_at(timeout)))
+        self._after_write()
+        return cursor.rowcount == 1
+
+    @_miss_on_error(False)
+    def delete(self, key):
+        return self._conn().execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount == 1
+
+    @_miss_on_error(False)
+    def has(self, key):
+        row = self._conn().execute("SELECT expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        return row is not None and (row[0] is None or row[0] > time.time())
+
+    @_miss_on_error(False)
+    def clear(self):
+        self._conn().execute("DELETE FROM cache")
+        return True
+
+    def inc(self, key, delta=1):
+        """Atomic across workers: the read and write share one IMMEDIATE transaction.
+        A counter keeps its row's expiry; a new one never expires (like Redis INCR).
+        Errors always propagate: a caller bumping a version must know it failed."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            expires_at = None
+            value = delta
+            if row is not None and (row[1] is None or row[1] > time.time()):
+                value, expires_at = pickle.loads(row[0]) + delta, row[1]
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                         (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires_at))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def dec(self, key, delta=1):
+        return self.inc(key, -delta)
+
+    def _after_write(self):
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self._prune()
+
+    @_miss_on_error(None)
+    def _prune(self):
+        """Drop expired entries, then the soonest-expiring ones beyond the threshold.
+        Rows without expiry (tag generations, catalog version) are few and don't count."""
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        excess = conn.execute("SELECT COUNT(*) FROM cache WHERE expires_at IS NOT NULL").fetchone()[0] - self.threshold
+        if excess > 0:
+            self._evictions += conn.execute("""
+                DELETE FROM cache WHERE key IN (
+                    SELECT key FROM cache WHERE expires_at IS NOT NULL
+                    ORDER BY expires_at LIMIT ?
+                )
+            """, (excess,)).rowcount
+
+    def get_stats(self):
+        conn = self._conn()
+        return {
+            "path": self.path,
+            "entries": conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0],
+            "bytes": conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM cache").fetchone()[0],
+            "threshold": self.threshold,
+            "evictions": self._evictions,  # pruned over the threshold by this worker
+        }
+
+
+# Background refreshes for memoize_swr; a couple of threads is plenty
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+_memo_stats = {}
+# Request threads and the refresh executor update the counters concurrently
+_stats_lock = threading.Lock()
+# Keys each memoized function stored recently, to tell evictions from expiry on a miss
+TRACKED_KEYS = 1024
+
+
+def memoize_swr(cache, soft_timeout, hard_timeout=None, wait_timeout=5.0, lock_timeout=30):
+    """Memoize with single-flight misses and stale-while-revalidate.
+
+    An entry is fresh for `soft_timeout` seconds and kept until `hard_timeout`
+    (default 2x soft). A stale hit returns the old value at once and queues one
+    background refresh. On a miss only the caller holding the cache lock
+    (cache.add, so it works across workers) runs the function; the others
+    poll for its result for up to `wait_timeout` seconds before giving up and
+    computing it themselves. Exceptions propagate and are never cached.
+
+    Values are pickled here and stored as bytes, so the entry size in the
+    counters (see memo_stats) is what the backend actually stores. The counters
+    also track recompute time and whether a miss was an expiry or an eviction
+    (the entry vanished before its hard timeout: threshold pruning, clear() or
+    a backend LRU).
+    """
+    hard_timeout = hard_timeout or soft_timeout * 2
+
+    def decorator(fn):
+        name = f"{fn.__module__}.{fn.__qualname__}"
+        stats = _memo_stats.setdefault(name, {"hits": 0, "stale_hits": 0, "misses": 0,
+                                              "waits": 0, "refreshes": 0, "refresh_errors": 0,
+                                              "expired": 0, "evictions": 0, "computes": 0,
+                                              "compute_seconds": 0.0, "max_compute_seconds": 0.0,
+                                              "entry_bytes": 0, "max_entry_bytes": 0,
+                                              "soft_timeout": soft_timeout, "hard_timeout": hard_timeout})
+        stored = OrderedDict()  # key -> hard expiry of the entry this worker wrote
+
+        def count(field):
+            with _stats_lock:
+                stats[field] += 1
+
+        def make_key(args, kwargs):
+            digest = hashlib.md5(repr((args, sorted(kwargs.items()))).encode()).hexdigest()
+            return f"swr:{name}:{digest}"
+
+        def read(key):
+            """(value, fresh_until) or None; an entry that no longer unpickles is a miss"""
+            entry = cache.get(key)
+            if entry is None:
+                return None
+            try:
+                return pickle.loads(entry[0]), entry[1]
+            except (pickle.PickleError, EOFError, AttributeError, ImportError, TypeError):
+                return None
+
+        def compute(key, args, kwargs):
+            start = time.perf_counter()
+            value = fn(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            cache.set(key, (payload, time.time() + soft_timeout), timeout=hard_timeout)
+            with _stats_lock:
+                stats["computes"] += 1
+                stats["compute_seconds"] += elapsed
+                stats["max_compute_seconds"] = max(stats["max_compute_seconds"], elapsed)
+                stats["entry_bytes"] = len(payload)  # latest
+                stats["max_entry_bytes"] = max(stats["max_entry_bytes"], len(payload))
+                stored[key] = time.time() + hard_timeout
+                stored.move_to_end(key)
+                while len(stored) > TRACKED_KEYS:
+                    stored.popitem(last=False)
+            return value
+
+        def record_miss(key):
+            with _stats_lock:
+                stats["misses"] += 1
+                expires_at = stored.pop(key, None)
+                if expires_at is not None:
+                    stats["evictions" if time.time() < expires_at else "expired"] += 1
+
+        def refresh(key, lock_key, args, kwargs):
+            try:
+                compute(key, args, kwargs)
+                count("refreshes")
+            except Exception as e:
+                count("refresh_errors")
+                print(f"Background refresh of {name} failed: {e}")
+            finally:
+                cache.delete(lock_key)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            lock_key = key + ":lock"
+            entry = read(key)
+            if entry is not None:
+                value, fresh_until = entry
+                if time.time() < fresh_until:
+                    count("hits")
+                    return value
+                count("stale_hits")
+                if cache.add(lock_key, os.getpid(), timeout=lock_timeout):
+                    _refresh_executor.submit(refresh, key, lock_key, args, kwargs)
+                return value
+
+            record_miss(key)
+            if not cache.add(lock_key, os.getpid(), timeout=lock_timeout):
+                # Someone else is computing it: wait for their result
+                count("waits")
+                deadline = time.time() + wait_timeout
+                while time.time() < deadline and cache.has(lock_key):
+                    time.sleep(0.02)
+                    entry = read(key)
+                    if entry is not None:
+                        return entry[0]
+                entry = read(key)
+                return entry[0] if entry is not None else compute(key, args, kwargs)
+            try:
+                return compute(key, args, kwargs)
+            finally:
+                cache.delete(lock_key)
+
+        wrapper.uncached = fn
+        return wrapper
+
+    return decorator
+
+
+def memo_stats():
+    """Counters of every memoize_swr function in this worker, with derived rates"""
+    with _stats_lock:
+        snapshot = {name: dict(stats) for name, stats in _memo_stats.items()}
+    report = {}
+    for name, stats in snapshot.items():
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["stale_hits"]) / lookups, 3) if lookups else None
+        stats["avg_compute_ms"] = (round(stats["compute_seconds"] / stats["computes"] * 1000, 2)
+                                   if stats["computes"] else None)
+        stats["compute_seconds"] = round(stats["compute_seconds"], 4)
+        stats["max_compute_seconds"] = round(stats["max_compute_seconds"], 4)
+        report[name] = stats
+    return report
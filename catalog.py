@@ -0,0 +1,446 @@
+"""In-process catalog engine: category pages and facet counts without SQL.
+
+A snapshot holds the in-stock catalog as columns (`array` for ids, prices,
+stock and category/brand codes, one int bitmask of subcategories per product)
+plus inverted bitmaps -- one Python int per category, brand and subcategory
+with a bit per product. Filtering is a handful of big-int ANDs, which run in
+C over the whole catalog at once; facet counts are popcounts of those masks.
+
+Positions are assigned in (price, id) order, so a price range is a contiguous
+run of bits and both price sorts read set bits straight off the mask. Name and
+newest order use precomputed permutations (an argsort done once per snapshot).
+Pages use the keyset cursors of repository.PRODUCT_KEYSETS, so cursors stay
+valid across snapshot rebuilds.
+
+Each product exists once per snapshot as a read-only ProductRecord (slots,
+interned repeated strings). Pages are plain id tuples resolved against that
+store, so caching many filter combinations costs a few ints per product each
+rather than a copy of every row.
+
+The snapshot is rebuilt from SQLite on the first request after a product
+change (invalidate()), when the shared catalog version moves (another worker
+changed products) or after `max_age` seconds. Each snapshot carries the
+version it was read under; results cached across workers are keyed on it
+(snapshot_at()), so a lagging worker can never store an old page under a
+new version.
+"""
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from repository import PRODUCT_KEYSETS, InvalidCursor, decode_cursor, encode_cursor, turkish_fold
+
+# Upper edges of the price histogram buckets (TL); the last bucket is open-ended
+PRICE_BUCKETS = (100, 250, 500, 1000, 2500)
+
+# COLLATE NOCASE only folds ASCII letters; sort names the same way SQLite does
+_NOCASE = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+# Columns kept on ProductRecord: products.* plus the rating stats of catalog_rows()
+PRODUCT_FIELDS = (
+    "id", "name", "price", "image", "category", "subcategory", "description", "in_stock",
+    "brand", "stock_quantity", "low_stock_threshold", "last_restocked", "category_key",
+    "brand_key", "review_count", "avg_rating",
+)
+# Short values repeated across many products; one shared str object each
+INTERNED_FIELDS = frozenset(("image", "category", "brand", "category_key", "brand_key"))
+
+
+def intern_value(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class StaleSnapshot(Exception):
+    """The snapshot was not built under the catalog version a cached result is keyed on"""
+
+
+class ProductRecord:
+    """Immutable product row shared by every cached page; reads like a dict or an object"""
+    __slots__ = PRODUCT_FIELDS
+
+    def __init__(self, row):
+        for field in PRODUCT_FIELDS:
+            value = row.get(field)
+            if field in INTERNED_FIELDS:
+                value = intern_value(value)
+            elif field == "subcategory":
+                value = tuple(intern_value(item) for item in value or ())
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ProductRecord is read-only")
+
+    def __reduce__(self):
+        return ProductRecord, (self.as_dict(),)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return PRODUCT_FIELDS
+
+    def as_dict(self):
+        product = {field: getattr(self, field) for field in PRODUCT_FIELDS}
+        product["subcategory"] = list(self.subcategory)
+        return product
+
+    def __repr__(self):
+        return f"<ProductRecord {self.id} {self.name!r}>"
+
+
+def bit_range(start, stop):
+    """Bitmap with bits start..stop-1 set"""
+    return ((1 << stop) - 1) ^ ((1 << start) - 1) if stop > start else 0
+
+
+def set_bits(mask, descending=False):
+    """Yield the set bit positions of mask, lowest (or highest) first"""
+    if descending:
+        while mask:
+            position = mask.bit_length() - 1
+            yield position
+            mask ^= 1 << position
+    else:
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+
+class SortOrder:
+    """Products sorted by one keyset: `keys` ascending, `positions` aligned with them"""
+    __slots__ = ("keys", "positions", "rank", "identity")
+
+    def __init__(self, keys, identity=False):
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = [keys[position] for position in order]
+        self.positions = array("l", order)
+        self.rank = array("l", [0]) * len(order)
+        for index, position in enumerate(order):
+            self.rank[position] = index
+        self.identity = identity
+
+
+class CatalogSnapshot:
+    # Below this many matches, sort the matches instead of walking the permutation
+    SPARSE_MATCHES = 1024
+
+    def __init__(self, rows, version=None):
+        self.version = version  # shared catalog version the rows were read under
+        rows = sorted(rows, key=lambda row: (row["price"] or 0.0, row["id"]))
+        count = len(rows)
+        self.records = [ProductRecord(row) for row in rows]
+        self.by_id = {record.id: record for record in self.records}
+        self.ids = array("q", (row["id"] for row in rows))
+        self.prices = array("d", (row["price"] or 0.0 for row in rows))
+        self.stock = array("q", (row.get("stock_quantity") or 0 for row in rows))
+        self.all = bit_range(0, count)
+
+        self.category_codes, self.brand_codes, self.subcategory_bits = {}, {}, {}
+        self.brand_names = {}
+        category_column, brand_column, self.subcategory_masks = array("l"), array("l"), []
+        for row in rows:
+            category_column.append(self.category_codes.setdefault(row["category_key"] or "",
+                                                                  len(self.category_codes)))
+            brand_key = row["brand_key"] or ""
+            brand_column.append(self.brand_codes.setdefault(brand_key, len(self.brand_codes)))
+            self.brand_names.setdefault(brand_key, row["brand"])
+            mask = 0
+            for value in row["subcategory_values"]:
+                mask |= 1 << self.subcategory_bits.setdefault(sys.intern(value), len(self.subcategory_bits))
+            self.subcategory_masks.append(mask)
+        self.category_column, self.brand_column = category_column, brand_column
+
+        # Brand list per category (and "" for all), with in-stock product counts
+        counts = {}
+        for category_code, brand_code in zip(category_column, brand_column):
+            counts[category_code, brand_code] = counts.get((category_code, brand_code), 0) + 1
+        brand_keys = list(self.brand_codes)
+        self.category_brands = {"": {}}
+        for category_key, category_code in self.category_codes.items():
+            brands = self.category_brands.setdefault(category_key, {})
+            for (code, brand_code), product_count in counts.items():
+                brand_key = brand_keys[brand_code]
+                if code == category_code and brand_key:
+                    name = self.brand_names[brand_key]
+                    brands[name] = product_count
+                    self.category_brands[""][name] = self.category_brands[""].get(name, 0) + product_count
+        self.category_brands = {key: dict(sorted(brands.items()))
+                                for key, brands in self.category_brands.items()}
+
+        # Inverted bitmaps over positions
+        self.by_category = [0] * len(self.category_codes)
+        self.by_brand = [0] * len(self.brand_codes)
+        self.by_subcategory = [0] * len(self.subcategory_bits)
+        for position in range(count):
+            bit = 1 << position
+            self.by_category[category_column[position]] |= bit
+            self.by_brand[brand_column[position]] |= bit
+            for code in set_bits(self.subcategory_masks[position]):
+                self.by_subcategory[code] |= bit
+
+        self.orders = {
+            "name": SortOrder([((row["name"] or "").translate(_NOCASE), row["id"]) for row in rows]),
+            "price-asc": SortOrder([(price, row["id"]) for price, row in zip(self.prices, rows)], True),
+            "newest": SortOrder([(row["id"],) for row in rows]),
+        }
+        self.orders["price-desc"] = self.orders["price-asc"]
+
+    def __len__(self):
+        return len(self.ids)
+
+    # -- masks ----------------------------------------------------------
+
+    def category_mask(self, category):
+        code = self.category_codes.get(turkish_fold(category))
+        return self.by_category[code] if code is not None else 0
+
+    def brand_mask(self, brand):
+        if not brand:
+            return self.all
+        code = self.brand_codes.get(turkish_fold(brand))
+        return self.by_brand[code] if code is not None else 0
+
+    def subcategory_mask(self, value):
+        if not value:
+            return self.all
+        code = self.subcategory_bits.get(value)
+        return self.by_subcategory[code] if code is not None else 0
+
+    def price_mask(self, min_price=None, max_price=None):
+        start = bisect_left(self.prices, float(min_price)) if min_price else 0
+        stop = bisect_right(self.prices, float(max_price)) if max_price else len(self.prices)
+        return bit_range(start, stop)
+
+    # -- paging ---------------------------------------------------------
+
+    @staticmethod
+    def cursor_key(keyset, values):
+        try:
+            if keyset.name == "name":
+                return (str(values[0]).translate(_NOCASE), int(values[1]))
+            if keyset.name == "newest":
+                return (int(values[0]),)
+            return (float(values[0]), int(values[1]))
+        except (TypeError, ValueError):
+            raise InvalidCursor("Malformed cursor")
+
+    def take(self, mask, keyset, cursor, count):
+        """Up to `count` positions from mask in keyset order, starting after cursor"""
+        order = self.orders[keyset.name]
+        low, high = 0, len(order.keys)
+        if cursor:
+            key = self.cursor_key(keyset, decode_cursor(keyset, cursor))
+            if keyset.descending:
+                high = bisect_left(order.keys, key)
+            else:
+                low = bisect_right(order.keys, key)
+
+        if order.identity:
+            # Positions are already in this order: read bits straight off the mask
+            bits = set_bits(mask & bit_range(low, high), keyset.descending)
+            return [position for _, position in zip(range(count), bits)]
+
+        if mask.bit_count() <= self.SPARSE_MATCHES:
+            ranked = sorted(order.rank[position] for position in set_bits(mask)
+                            if low <= order.rank[position] < high)
+            if keyset.descending:
+                ranked.reverse()
+            return [order.positions[index] for index in ranked[:count]]
+
+        indexes = range(high - 1, low - 1, -1) if keyset.descending else range(low, high)
+        result = []
+        for index in indexes:
+            position = order.positions[index]
+            if mask >> position & 1:
+                result.append(position)
+                if len(result) == count:
+                    break
+        return result
+
+
+class CatalogEngine:
+    def __init__(self, loader, max_age=300.0, price_buckets=PRICE_BUCKETS, version=None):
+        self.loader = loader  # () -> product rows with category_key, brand_key, rating stats, subcategory_values
+        # () -> shared catalog version this worker has seen; a snapshot built
+        # under another version is stale
+        self.version = version or (lambda: None)
+        self.max_age = max_age
+        self.price_buckets = price_buckets
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._generation = 0        # bumped by invalidate()
+        self._built_generation = -1
+        self._built_version = None
+        self._built_at = 0.0
+        self._stats = {"pages": 0, "facet_queries": 0, "rebuilds": 0, "invalidations": 0,
+                       "rating_updates": 0}
+
+    @property
+    def generation(self):
+        """Catalog version for this worker; moves on every invalidate()"""
+        return self._generation
+
+    @property
+    def stale(self):
+        return self._built_generation != self._generation or self._built_version != self.version()
+
+    def rebuild(self):
+        # Read the versions first: a change during the load leaves us stale
+        generation, version = self._generation, self.version()
+        snapshot = CatalogSnapshot(self.loader(), version)
+        self._snapshot = snapshot
+        self._built_generation = generation
+        self._built_version = version
+        self._built_at = time.time()
+        self._stats["rebuilds"] += 1
+        return snapshot
+
+    def invalidate(self):
+        """Rebuild before the next read; called from invalidate_product_cache"""
+        self._generation += 1
+        self._stats["invalidations"] += 1
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        stale = self.stale
+        if snapshot is not None and not stale and time.time() - self._built_at <= self.max_age:
+            return snapshot
+        # After a product change everyone waits for the new snapshot, so no page
+        # built from the old one gets memoized; on plain expiry one thread reloads
+        # while the rest keep reading the old snapshot.
+        if not self._lock.acquire(blocking=snapshot is None or stale):
+            return snapshot
+        try:
+            if self._snapshot is snapshot or self.stale:
+                return self.rebuild()
+            return self._snapshot
+        finally:
+            self._lock.release()
+
+    def update_ratings(self, ratings):
+        """Patch review_count/avg_rating of the current snapshot from
+        {product_id: (review_count, avg_rating)}; products missing from it have
+        none. Ratings don't affect filters or sort order, so no rebuild is needed:
+        changed products just get a new record. Returns how many changed."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return 0
+        changed = 0
+        for position, record in enumerate(snapshot.records):
+            review_count, avg_rating = ratings.get(record.id, (0, 0))
+            if record.review_count != review_count or record.avg_rating != avg_rating:
+                updated = ProductRecord(dict(record.as_dict(), review_count=review_count, avg_rating=avg_rating))
+                snapshot.records[position] = updated
+                snapshot.by_id[record.id] = updated
+                changed += 1
+        self._stats["rating_updates"] += 1
+        return changed
+
+    def snapshot_at(self, version):
+        """Current snapshot, which must be built under `version`; a result computed
+        from it can then be cached under that version"""
+        snapshot = self.snapshot()
+        if snapshot.version != version:
+            raise StaleSnapshot(f"snapshot is at catalog version {snapshot.version}, not {version}")
+        return snapshot
+
+    def brands(self, category=None, snapshot=None):
+        """{brand: in-stock product count} of a category (all categories when None), by name"""
+        return (snapshot or self.snapshot()).category_brands.get(turkish_fold(category) if category else "", {})
+
+    def filter_mask(self, snapshot, category, brand=None, min_price=None, max_price=None,
+                    main_category=None, subcategory=None):
+        if subcategory == "Hepsi":
+            subcategory = None
+        return (snapshot.category_mask(category) & snapshot.brand_mask(brand)
+                & snapshot.price_mask(min_price, max_price)
+                & snapshot.subcategory_mask(main_category) & snapshot.subcategory_mask(subcategory))
+
+    def page_ids(self, category, brand=None, min_price=None, max_price=None,
+                 main_category=None, subcategory=None, sort="name", cursor=None, limit=48, snapshot=None):
+        """(product ids, next_cursor) for one catalog page; cheap to cache"""
+        snapshot = snapshot or self.snapshot()
+        self._stats["pages"] += 1
+        keyset = PRODUCT_KEYSETS.get(sort, PRODUCT_KEYSETS["name"])
+        mask = self.filter_mask(snapshot, category, brand, min_price, max_price, main_category, subcategory)
+        positions = snapshot.take(mask, keyset, cursor, limit + 1)
+        ids = tuple(snapshot.ids[position] for position in positions[:limit])
+        next_cursor = None
+        if len(positions) > limit:
+            next_cursor = encode_cursor(keyset, snapshot.records[positions[limit - 1]])
+        return ids, next_cursor
+
+    def records(self, product_ids):
+        """Shared ProductRecords for ids, skipping products no longer in the catalog"""
+        by_id = self.snapshot().by_id
+        return [by_id[product_id] for product_id in product_ids if product_id in by_id]
+
+    def page(self, category, brand=None, min_price=None, max_price=None,
+             main_category=None, subcategory=None, sort="name", cursor=None, limit=48):
+        """In-stock products of a category, one keyset page at a time: (products, next_cursor)"""
+        ids, next_cursor = self.page_ids(category, brand, min_price, max_price,
+                                         main_category, subcategory, sort, cursor, limit)
+        return self.records(ids), next_cursor
+
+    def facet_counts(self, category, brand=None, min_price=None, max_price=None,
+                     main_category=None, subcategory=None):
+        """Brand, subcategory and price-bucket counts for the current filters.
+
+        Each facet ignores its own filter (brand counts are computed without
+        the selected brand, ...) so the UI can show what switching to another
+        value would return.
+        """
+        snapshot = self.snapshot()
+        self._stats["facet_queries"] += 1
+        if subcategory == "Hepsi":
+            subcategory = None
+        category_mask = snapshot.category_mask(category)
+        price = snapshot.price_mask(min_price, max_price)
+        brand_mask = snapshot.brand_mask(brand)
+        main_mask = snapshot.subcategory_mask(main_category)
+        sub_mask = snapshot.subcategory_mask(subcategory)
+
+        base = category_mask & price & main_mask & sub_mask
+        brands = [{"value": snapshot.brand_names[key], "count": (base & snapshot.by_brand[code]).bit_count()}
+                  for key, code in snapshot.brand_codes.items()
+                  if key and category_mask & snapshot.by_brand[code]]
+        brands.sort(key=lambda item: item["value"])
+
+        base = category_mask & price & brand_mask & main_mask
+        subcategories = [{"value": value, "count": (base & snapshot.by_subcategory[code]).bit_count()}
+                         for value, code in sorted(snapshot.subcategory_bits.items())
+                         if category_mask & snapshot.by_subcategory[code]]
+
+        base = category_mask & brand_mask & main_mask & sub_mask
+        buckets = []
+        lower = 0
+        for upper in self.price_buckets + (None,):
+            start = bisect_left(snapshot.prices, lower)
+            stop = bisect_left(snapshot.prices, upper) if upper is not None else len(snapshot)
+            buckets.append({"min": lower, "max": upper,
+                            "count": (base & bit_range(start, stop)).bit_count()})
+            lower = upper
+
+        return {
+            "total": (category_mask & price & brand_mask & main_mask & sub_mask).bit_count(),
+            "brands": brands,
+            "subcategories": subcategories,
+            "price": buckets,
+        }
+
+    def get_stats(self):
+        snapshot = self._snapshot
+        return dict(self._stats, products=len(snapshot) if snapshot else 0,
+                    categories=len(snapshot.category_codes) if snapshot else 0,
+                    version=snapshot.version if snapshot else None,
+                    stale=self.stale, age_seconds=round(time.time() - self._built_at, 1))
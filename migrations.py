@@ -0,0 +1,614 @@
+"""Versioned schema migrations keyed on PRAGMA user_version.
+
+Each migration runs once, in order, inside its own transaction together with
+the user_version bump. When the schema is current, migrate() is a single
+PRAGMA read, so workers can call it at boot without paying for ALTER TABLE
+probing. Run it ahead of a deploy with either of:
+
+    python migrations.py [db_path]
+    flask --app app migrate
+"""
+import json
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from repository import PopularityRepository, fold_sql, parse_subcategories
+
+try:
+    import fcntl  # Cross-process migration lock (not available on Windows)
+except ImportError:
+    fcntl = None
+
+MIGRATIONS = []  # (version, description, fn) in ascending version order
+# ALTER TABLE ... DROP COLUMN arrived in SQLite 3.35.0
+DROP_COLUMN_SQLITE = (3, 35, 0)
+
+
+def migration(version, description):
+    """Register fn(conn) as schema step `version`"""
+    def decorator(fn):
+        if MIGRATIONS and MIGRATIONS[-1][0] >= version:
+            raise ValueError(f"Migration {version} registered out of order")
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return decorator
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def column_names(conn, table):
+    # table_xinfo also lists generated columns, which table_info hides
+    return {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+
+
+def add_column(conn, table, column, definition):
+    """ALTER TABLE ADD COLUMN only when the column is missing"""
+    if column not in column_names(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+# Boş veritabanı için örnek ürünler
+SAMPLE_PRODUCTS = [
+    ("Royal Canin Kitten Mama", 450.0, "/static/uploads/1.webp", "Kedi", '["Mama"]', "2-12 aylık yavrular için özel formül kedi maması", "Royal Canin"),
+    ("Lavital Kitten Somonlu Yavru Kedi Maması 1.5 KG", 340.0, "/static/uploads/2.webp", "Kedi", '["Mama"]', "6-52 hafta - 12 aylık dönemdeki yavru kediler için özel formüle edilen bir yavru kedi mamasıdır.", "Lavital"),
+    ("Whiskas Yetişkin Kedi Maması", 280.0, "/static/uploads/3.webp", "Kedi", '["Mama"]', "Yetişkin kediler için dengeli beslenme", "Whiskas"),
+    ("Pro Plan Köpek Maması", 520.0, "/static/uploads/4.webp", "Köpek", '["Mama"]', "Yetişkin köpekler için premium mama", "Pro Plan"),
+    ("Pedigree Köpek Maması", 380.0, "/static/uploads/5.webp", "Köpek", '["Mama"]', "Köpeklerin sağlıklı yaşamı için", "Pedigree"),
+    ("Kedi Oyuncağı Top", 45.0, "/static/uploads/6.webp", "Kedi", '["Oyuncak"]', "Renkli kedi oyun topu", "Generic"),
+    ("Köpek Tasması", 120.0, "/static/uploads/7.webp", "Köpek", '["Aksesuar"]', "Ayarlanabilir köpek tasması", "Generic"),
+    ("Kedi Kumu 10L", 85.0, "/static/uploads/8.webp", "Kedi", '["Bakım"]', "Kokusuz kedi kumu", "Generic"),
+    ("Balık Yemi", 25.0, "/static/uploads/9.webp", "Balık", '["Yem"]', "Tropikal balıklar için yem", "Generic"),
+    ("Kuş Yemi", 35.0, "/static/uploads/10.webp", "Kuş", '["Yem"]', "Muhabbet kuşları için karma yem", "Generic"),
+]
+
+
+@migration(1, "baseline schema")
+def baseline_schema(conn):
+    """Tables, late-added columns and indexes that init_database/migrate_orders_table used to probe for"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        price REAL NOT NULL,
+        image TEXT,
+        category TEXT,
+        subcategory TEXT,
+        description TEXT,
+        in_stock INTEGER DEFAULT 1,
+        brand TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_code TEXT NOT NULL,
+        items TEXT NOT NULL,
+        total_price REAL NOT NULL,
+        customer_name TEXT,
+        address TEXT,
+        note TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        status TEXT DEFAULT 'Hazırlanıyor'
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        email TEXT NOT NULL,
+        phone TEXT,
+        message TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        first_name TEXT NOT NULL,
+        last_name TEXT NOT NULL,
+        phone TEXT,
+        address TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        last_login DATETIME,
+        email_verified INTEGER DEFAULT 0,
+        is_active INTEGER DEFAULT 1
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS wishlist (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (product_id) REFERENCES products (id),
+        UNIQUE(user_id, product_id)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS reviews (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        rating INTEGER NOT NULL CHECK (rating >= 1 AND rating <= 5),
+        title TEXT,
+        comment TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        is_verified INTEGER DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS newsletter_subscriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT UNIQUE NOT NULL,
+        is_active INTEGER DEFAULT 1,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        unsubscribed_at DATETIME
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS campaigns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT,
+        description TEXT,
+        image TEXT,
+        link TEXT,
+        active INTEGER DEFAULT 1,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # Columns older databases were created without
+    add_column(conn, "users", "balance", "REAL DEFAULT 0.0")
+    add_column(conn, "orders", "customer_name", "TEXT")
+    add_column(conn, "orders", "address", "TEXT")
+    add_column(conn, "orders", "note", "TEXT")
+    add_column(conn, "orders", "status", "TEXT DEFAULT 'Hazırlanıyor'")
+    add_column(conn, "orders", "shipping_company", "TEXT")
+    add_column(conn, "orders", "tracking_number", "TEXT")
+    add_column(conn, "orders", "customer_phone", "TEXT")
+    add_column(conn, "orders", "customer_email", "TEXT")
+    add_column(conn, "orders", "customer_address", "TEXT")
+    add_column(conn, "products", "brand", "TEXT")
+    add_column(conn, "products", "stock_quantity", "INTEGER DEFAULT 10")
+    add_column(conn, "products", "low_stock_threshold", "INTEGER DEFAULT 5")
+    add_column(conn, "products", "last_restocked", "DATETIME")
+    add_column(conn, "campaigns", "description", "TEXT")
+
+    # Products table indexes
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products(category)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_brand ON products(brand)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_price ON products(price)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_in_stock ON products(in_stock)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_category_brand ON products(category, brand)")
+
+    # Orders table indexes
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_code ON orders(order_code)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_customer_email ON orders(customer_email)")
+
+    # Messages table indexes
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_email ON messages(email)")
+
+    # Campaigns table indexes
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_campaigns_active ON campaigns(active)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_campaigns_created_at ON campaigns(created_at)")
+
+
+@migration(2, "seed sample products into an empty catalog")
+def seed_sample_products(conn):
+    if conn.execute("SELECT COUNT(*) FROM products").fetchone()[0] == 0:
+        conn.executemany("""
+            INSERT INTO products (name, price, image, category, subcategory, description, brand, in_stock)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+        """, SAMPLE_PRODUCTS)
+        print(f"✅ {len(SAMPLE_PRODUCTS)} sample products added!")
+
+
+# Admin formundaki ana kategoriler; yeni ürünlerde alt kategori listesine ekleniyor
+MAIN_CATEGORIES = ("Mama", "Yem", "Ödül & Eğitim", "Bakım & Sağlık", "Aksesuar", "Marka")
+
+
+@migration(3, "product_subcategories join table")
+def product_subcategories(conn):
+    """Move subcategory filtering out of the JSON column into an indexed join table.
+
+    Older products don't list their main category explicitly; the old filter
+    matched it as a substring of a subcategory ("Mama" in "Yavru Köpek Maması"),
+    so the backfill adds those main categories as rows to keep filters stable.
+    The JSON column is normalised to a list and kept for display only.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS product_subcategories (
+        product_id INTEGER NOT NULL,
+        subcategory TEXT NOT NULL,
+        PRIMARY KEY (product_id, subcategory),
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_product_subcategories_subcategory
+    ON product_subcategories(subcategory, product_id)
+    """)
+
+    rows = conn.execute("SELECT id, subcategory FROM products").fetchall()
+    for product_id, raw in rows:
+        subs = parse_subcategories(raw)
+        normalized = json.dumps(subs, ensure_ascii=False)
+        if raw != normalized:
+            conn.execute("UPDATE products SET subcategory = ? WHERE id = ?", (normalized, product_id))
+
+        keys = set(subs)
+        for main in MAIN_CATEGORIES:
+            if any(main.lower() in sub.lower() for sub in subs):
+                keys.add(main)
+        conn.executemany(
+            "INSERT OR IGNORE INTO product_subcategories (product_id, subcategory) VALUES (?, ?)",
+            [(product_id, key) for key in keys])
+
+
+@migration(4, "order_items table")
+def order_items(conn):
+    """Move order lines out of the orders.items JSON blob into order_items.
+
+    product_name is a snapshot so order history survives product renames and
+    deletes. Before the JSON column is dropped (ALTER TABLE DROP COLUMN, SQLite
+    3.35+) every raw value is kept in orders_items_legacy and the copy is
+    checked row by row, so nothing is lost even for unreadable JSON.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        product_id INTEGER,
+        product_name TEXT NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 1,
+        unit_price REAL NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES orders (id),
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_order_items_product ON order_items(product_id, quantity, unit_price)")
+
+    if "items" not in column_names(conn, "orders"):
+        return
+    if sqlite3.sqlite_version_info < DROP_COLUMN_SQLITE:
+        raise RuntimeError(
+            f"Migration 4 needs SQLite {'.'.join(map(str, DROP_COLUMN_SQLITE))}+ to drop orders.items "
+            f"(this Python uses SQLite {sqlite3.sqlite_version}); upgrade SQLite/Python and rerun. "
+            "Nothing was changed.")
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS orders_items_legacy (
+        order_id INTEGER PRIMARY KEY,
+        items TEXT
+    )
+    """)
+    conn.execute("INSERT OR REPLACE INTO orders_items_legacy (order_id, items) SELECT id, items FROM orders")
+    orders = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    kept = conn.execute("""
+        SELECT COUNT(*) FROM orders o JOIN orders_items_legacy l
+        ON l.order_id = o.id AND l.items IS o.items
+    """).fetchone()[0]
+    if kept != orders:
+        raise RuntimeError(f"Migration 4: backed up {kept} of {orders} orders.items values; not dropping the column")
+
+    copied = 0
+    for order_id, raw in conn.execute("SELECT id, items FROM orders").fetchall():
+        try:
+            items = json.loads(raw) if raw else []
+        except ValueError:
+            print(f"⚠️ Order {order_id}: unreadable items JSON kept in orders_items_legacy only")
+            continue
+        rows = []
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            product_id = item.get("id")
+            rows.append((
+                order_id,
+                int(product_id) if str(product_id).isdigit() else None,
+                item.get("name") or "",
+                int(item.get("quantity") or 1),
+                float(item.get("price") or 0),
+            ))
+        conn.executemany("""
+            INSERT INTO order_items (order_id, product_id, product_name, quantity, unit_price)
+            VALUES (?, ?, ?, ?, ?)
+        """, rows)
+        copied += len(rows)
+    if conn.execute("SELECT COUNT(*) FROM order_items").fetchone()[0] < copied:
+        raise RuntimeError("Migration 4: order_items is missing copied lines; not dropping the column")
+    conn.execute("ALTER TABLE orders DROP COLUMN items")
+    print(f"✅ {copied} order lines moved to order_items (raw JSON kept in orders_items_legacy)")
+
+
+@migration(5, "product_popularity scores")
+def product_popularity(conn):
+    """Decayed popularity per product, seeded from past orders, wishlists and reviews"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS product_popularity (
+        product_id INTEGER PRIMARY KEY,
+        category TEXT,
+        score REAL NOT NULL DEFAULT 0,
+        views INTEGER NOT NULL DEFAULT 0,
+        wishlist_adds INTEGER NOT NULL DEFAULT 0,
+        reviews INTEGER NOT NULL DEFAULT 0,
+        units_sold INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    )
+    """)
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_product_popularity_category_score
+    ON product_popularity(category, score DESC)
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_product_popularity_score ON product_popularity(score DESC)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS product_popularity_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        landmark REAL NOT NULL
+    )
+    """)
+    landmark = time.time()
+    conn.execute("INSERT OR IGNORE INTO product_popularity_meta (id, landmark) VALUES (1, ?)", (landmark,))
+
+    events = conn.execute("""
+        SELECT oi.product_id, 'order', oi.quantity, o.created_at
+        FROM order_items oi JOIN orders o ON o.id = oi.order_id
+        WHERE oi.product_id IS NOT NULL
+        UNION ALL
+        SELECT product_id, 'wishlist', 1, created_at FROM wishlist
+        UNION ALL
+        SELECT product_id, 'review', 1, created_at FROM reviews
+    """).fetchall()
+    # Written out here rather than via PopularityRepository so this step keeps
+    # working against the schema as it was at version 5
+    for product_id, event, count, created_at in events:
+        try:
+            happened = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+        except (TypeError, ValueError):
+            happened = landmark
+        factor = 2.0 ** ((happened - landmark) / PopularityRepository.HALF_LIFE)
+        counter = PopularityRepository.COUNTERS[event]
+        conn.execute(f"""
+            INSERT INTO product_popularity (product_id, category, score, {counter})
+            SELECT id, category, ?, ? FROM products WHERE id = ?
+            ON CONFLICT(product_id) DO UPDATE SET
+                score = score + excluded.score,
+                {counter} = {counter} + excluded.{counter}
+        """, (PopularityRepository.WEIGHTS[event] * count * factor, count, product_id))
+
+
+@migration(6, "product_rating_stats maintained by triggers")
+def product_rating_stats(conn):
+    """Per-product review count, rating sum and 1-5 histogram.
+
+    Triggers on reviews keep the row current for every write path, so product
+    pages and grids read ratings with one primary-key lookup.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS product_rating_stats (
+        product_id INTEGER PRIMARY KEY,
+        review_count INTEGER NOT NULL DEFAULT 0,
+        rating_sum INTEGER NOT NULL DEFAULT 0,
+        rating_1 INTEGER NOT NULL DEFAULT 0,
+        rating_2 INTEGER NOT NULL DEFAULT 0,
+        rating_3 INTEGER NOT NULL DEFAULT 0,
+        rating_4 INTEGER NOT NULL DEFAULT 0,
+        rating_5 INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reviews_product_created ON reviews(product_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reviews_user_product ON reviews(user_id, product_id)")
+
+    def apply(sign, ref):
+        """Statements adding (sign=+1) or removing (sign=-1) review `ref` from the stats"""
+        return f"""
+            INSERT OR IGNORE INTO product_rating_stats (product_id) VALUES ({ref}.product_id);
+            UPDATE product_rating_stats SET
+                review_count = review_count + ({sign}),
+                rating_sum = rating_sum + ({sign}) * {ref}.rating,
+                rating_1 = rating_1 + ({sign}) * ({ref}.rating = 1),
+                rating_2 = rating_2 + ({sign}) * ({ref}.rating = 2),
+                rating_3 = rating_3 + ({sign}) * ({ref}.rating = 3),
+                rating_4 = rating_4 + ({sign}) * ({ref}.rating = 4),
+                rating_5 = rating_5 + ({sign}) * ({ref}.rating = 5)
+            WHERE product_id = {ref}.product_id;
+        """
+
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS reviews_stats_insert AFTER INSERT ON reviews BEGIN
+        {apply(1, "NEW")}
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS reviews_stats_delete AFTER DELETE ON reviews BEGIN
+        {apply(-1, "OLD")}
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS reviews_stats_update AFTER UPDATE OF rating, product_id ON reviews BEGIN
+        {apply(-1, "OLD")}
+        {apply(1, "NEW")}
+    END
+    """)
+
+    conn.execute("DELETE FROM product_rating_stats")
+    conn.execute("""
+        INSERT INTO product_rating_stats
+            (product_id, review_count, rating_sum, rating_1, rating_2, rating_3, rating_4, rating_5)
+        SELECT product_id, COUNT(*), SUM(rating),
+               SUM(rating = 1), SUM(rating = 2), SUM(rating = 3), SUM(rating = 4), SUM(rating = 5)
+        FROM reviews
+        GROUP BY product_id
+    """)
+
+
+@migration(7, "Turkish-folded category/brand key columns")
+def folded_key_columns(conn):
+    """category_key/brand_key as virtual generated columns built from fold_sql().
+
+    Lookups compare against turkish_fold(value) so they hit plain indexes
+    instead of LOWER(category) = LOWER(?), which SQLite can't index and which
+    doesn't fold Ö/Ş/İ/I the Turkish way. Being generated, the keys stay
+    correct for writes from any tool, not just this app.
+    """
+    add_column(conn, "products", "category_key", f"TEXT GENERATED ALWAYS AS ({fold_sql('category')}) VIRTUAL")
+    add_column(conn, "products", "brand_key", f"TEXT GENERATED ALWAYS AS ({fold_sql('brand')}) VIRTUAL")
+
+    # Superseded by the key-column indexes below
+    conn.execute("DROP INDEX IF EXISTS idx_products_category")
+    conn.execute("DROP INDEX IF EXISTS idx_products_brand")
+    conn.execute("DROP INDEX IF EXISTS idx_products_category_brand")
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_category_key_brand ON products(category_key, brand)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_category_brand_key ON products(category_key, brand_key)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_category_price ON products(category_key, price)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_category_name ON products(category_key, name COLLATE NOCASE)")
+
+    # Popularity rows are looked up by the same folded key
+    conn.execute("""
+        UPDATE product_popularity
+        SET category = (SELECT category_key FROM products WHERE products.id = product_popularity.product_id)
+    """)
+
+
+@migration(8, "product_search FTS5 index")
+def product_search_index(conn):
+    """FTS5 index over name, brand and description, kept in sync by triggers.
+
+    unicode61 with remove_diacritics 2 already folds case, ç/ğ/ö/ş/ü and İ;
+    dotless ı has no decomposition, so it is mapped to i before indexing
+    (search_fold() does the same to the query).
+    """
+    conn.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS product_search USING fts5(
+        name, brand, description,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """)
+
+    def columns(ref):
+        return ", ".join(f"replace(COALESCE({ref}.{column}, ''), 'ı', 'i')"
+                         for column in ("name", "brand", "description"))
+
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS products_search_insert AFTER INSERT ON products BEGIN
+        INSERT INTO product_search (rowid, name, brand, description) VALUES (NEW.id, {columns("NEW")});
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS products_search_update AFTER UPDATE OF name, brand, description ON products BEGIN
+        DELETE FROM product_search WHERE rowid = OLD.id;
+        INSERT INTO product_search (rowid, name, brand, description) VALUES (NEW.id, {columns("NEW")});
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_search_delete AFTER DELETE ON products BEGIN
+        DELETE FROM product_search WHERE rowid = OLD.id;
+    END
+    """)
+
+    conn.execute("DELETE FROM product_search")
+    conn.execute(f"""
+        INSERT INTO product_search (rowid, name, brand, description)
+        SELECT id, {columns("products")} FROM products
+    """)
+
+
+@migration(9, "stock page index")
+def stock_page_index(conn):
+    """Expression index on the admin stock page keyset (low stock first).
+
+    Category pages and brand lists are served by the in-memory catalog engine,
+    so the stock page was the last listing that sorted every product row (and
+    ran its units-sold subquery for each) before applying LIMIT.
+    """
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_products_stock_page ON products(
+        (CASE WHEN COALESCE(stock_quantity, 0) <= COALESCE(low_stock_threshold, 5) THEN 0 ELSE 1 END),
+        (COALESCE(stock_quantity, 0)),
+        name,
+        id
+    )
+    """)
+
+
+@contextmanager
+def migration_lock(db_path):
+    """Only one process migrates; the others block here and then see the new version"""
+    if fcntl is None:
+        yield
+        return
+    with open(db_path + ".migrate-lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def migrate(db_path, verbose=True):
+    """Apply pending migrations and return the versions that ran"""
+    conn = connect(db_path)
+    try:
+        if current_version(conn) >= latest_version():
+            return []
+
+        applied = []
+        with migration_lock(db_path):
+            # Another worker may have finished while we waited for the lock
+            version = current_version(conn)
+            for step, description, fn in MIGRATIONS:
+                if step <= version:
+                    continue
+                started = time.time()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    fn(conn)
+                    conn.execute(f"PRAGMA user_version = {step}")
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                applied.append(step)
+                if verbose:
+                    print(f"🗄️ Migration {step} ({description}) applied in {time.time() - started:.2f}s")
+        return applied
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    elif os.environ.get("RENDER"):
+        path = os.path.join(os.getcwd(), "petshop.db")
+    else:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "petshop.db")
+    ran = migrate(path)
+    print(f"Schema at version {latest_version()} ({len(ran)} migration(s) applied)")
@@ -0,0 +1,699 @@
+"""Data access layer used by the Flask routes.
+
+Reads run on the request-scoped, query_only pooled connection handed out by
+app.get_db(), so a request does a single pool checkout and every query runs
+with the pool's PRAGMAs. Write methods are called from jobs passed to
+app.db_write(), which hands them a Repository bound to the writer connection.
+"""
+import base64
+import json
+import re
+import time
+from collections import namedtuple
+
+
+# Turkish-aware case folding that SQLite can reproduce with built-ins only:
+# the Turkish capitals are mapped first (I -> ı, İ -> i), then lower() handles
+# ASCII. turkish_fold() and fold_sql() must stay in step, since generated key
+# columns and their indexes are built from fold_sql().
+TURKISH_CAPITALS = (("Ç", "ç"), ("Ğ", "ğ"), ("İ", "i"), ("I", "ı"), ("Ö", "ö"), ("Ş", "ş"), ("Ü", "ü"))
+_FOLD_TABLE = str.maketrans(
+    dict(TURKISH_CAPITALS, **{chr(c): chr(c + 32) for c in range(ord("A"), ord("Z") + 1) if chr(c) != "I"}))
+
+
+def turkish_fold(value):
+    """Python side of fold_sql(): 'KÖPEK' -> 'köpek', 'KUŞ' -> 'kuş', 'IŞIK' -> 'ışık'"""
+    return value.translate(_FOLD_TABLE) if value is not None else None
+
+
+def fold_sql(expression):
+    """SQL expression folding `expression` exactly like turkish_fold()"""
+    for upper, lower in TURKISH_CAPITALS:
+        expression = f"replace({expression}, '{upper}', '{lower}')"
+    return f"lower({expression})"
+
+
+def search_fold(text):
+    """Query-side counterpart of the product_search triggers (dotless ı -> i)"""
+    return text.replace("ı", "i")
+
+
+def fts_query(term):
+    """FTS5 MATCH expression: every word must match, each as a prefix"""
+    words = re.findall(r"\w+", search_fold(term))
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def parse_subcategories(raw):
+    """Decode the products.subcategory display column into a list.
+
+    Older rows hold a plain string instead of a JSON list.
+    """
+    if not raw:
+        return []
+    if isinstance(raw, list):
+        return raw
+    if raw.strip().startswith('['):
+        try:
+            return [sub for sub in json.loads(raw) if sub]
+        except ValueError:
+            pass
+    return [raw]
+
+
+class InvalidCursor(ValueError):
+    """Pagination cursor that can't be decoded or belongs to another sort order"""
+
+
+# columns: ((sql_expression, row_key), ...) compared as one row value, all in
+# the same direction; the last column must be unique (normally the id).
+Keyset = namedtuple("Keyset", "name columns descending")
+
+PRODUCT_KEYSETS = {
+    "name": Keyset("name", (("products.name COLLATE NOCASE", "name"), ("products.id", "id")), False),
+    "price-asc": Keyset("price-asc", (("products.price", "price"), ("products.id", "id")), False),
+    "price-desc": Keyset("price-desc", (("products.price", "price"), ("products.id", "id")), True),
+    "newest": Keyset("newest", (("products.id", "id"),), True),
+}
+
+
+def encode_cursor(keyset, row):
+    """Opaque token pointing just past `row` in `keyset` order"""
+    payload = [keyset.name, [row[key] for _, key in keyset.columns]]
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(keyset, token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        name, values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Malformed cursor")
+    if name != keyset.name or not isinstance(values, list) or len(values) != len(keyset.columns):
+        raise InvalidCursor("Cursor does not match the requested sort")
+    return values
+
+
+class BaseRepository:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _page(self, select, conditions, params, keyset, cursor=None, limit=20):
+        """Keyset pagination: returns (rows, next_cursor) with next_cursor None on the last page.
+
+        `select` is the SELECT ... FROM part; `conditions` are ANDed into WHERE.
+        Seeking past the cursor with a row-value comparison keeps every page an
+        index range scan instead of OFFSET skipping.
+        """
+        conditions = list(conditions)
+        params = list(params)
+        expressions = ", ".join(expr for expr, _ in keyset.columns)
+        if cursor:
+            values = decode_cursor(keyset, cursor)
+            operator = "<" if keyset.descending else ">"
+            conditions.append(f"({expressions}) {operator} ({', '.join('?' * len(values))})")
+            params.extend(values)
+        query = select
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        direction = " DESC" if keyset.descending else ""
+        query += " ORDER BY " + ", ".join(expr + direction for expr, _ in keyset.columns)
+        query += " LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self._all(query, params)
+        if len(rows) > limit:
+            return rows[:limit], encode_cursor(keyset, rows[limit - 1])
+        return rows, None
+
+    def _one(self, query, params=()):
+        return self.conn.execute(query, params).fetchone()
+
+    def _all(self, query, params=()):
+        return self.conn.execute(query, params).fetchall()
+
+    def _scalar(self, query, params=()):
+        row = self._one(query, params)
+        return row[0] if row else None
+
+    def _write(self, query, params=()):
+        cursor = self.conn.execute(query, params)
+        return cursor
+
+
+class ProductRepository(BaseRepository):
+    def get(self, product_id):
+        return self._one("SELECT * FROM products WHERE id = ?", (product_id,))
+
+    def get_available(self, product_id):
+        """Product row only if it is listed as in stock"""
+        return self._one("SELECT * FROM products WHERE id = ? AND in_stock = 1", (product_id,))
+
+    def get_available_many(self, product_ids):
+        """In-stock product rows for a batch of ids, in the order the ids were given"""
+        if not product_ids:
+            return []
+        rows = self._all("""
+            SELECT * FROM products
+            WHERE id IN (SELECT value FROM json_each(?)) AND in_stock = 1
+        """, (json.dumps(list(product_ids)),))
+        by_id = {row["id"]: row for row in rows}
+        return [by_id[product_id] for product_id in product_ids if product_id in by_id]
+
+    def get_image(self, product_id):
+        return self._scalar("SELECT image FROM products WHERE id = ?", (product_id,))
+
+    def get_category(self, product_id):
+        return self._scalar("SELECT category FROM products WHERE id = ?", (product_id,))
+
+    def list_all(self):
+        return self._all("SELECT * FROM products ORDER BY id DESC")
+
+    def page(self, cursor=None, limit=50):
+        """All products, newest first (admin listing)"""
+        return self._page("SELECT * FROM products", [], [], PRODUCT_KEYSETS["newest"], cursor, limit)
+
+    # bm25 column weights for product_search(name, brand, description).
+    # CROSS JOIN pins the FTS index as the outer loop; otherwise the planner may
+    # walk products by in_stock and probe the FTS table once per row.
+    SEARCH_RANK = "bm25(product_search, 10.0, 4.0, 1.0)"
+    SEARCH_KEYSET = Keyset("relevance", ((SEARCH_RANK, "rank"), ("products.id", "id")), False)
+
+    def search_conditions(self, term, category=None):
+        """WHERE parts for an FTS5 match of `term` against name, brand and description"""
+        conditions = ["product_search MATCH ?", "products.in_stock = 1"]
+        params = [fts_query(term)]
+        if category:
+            conditions.append("products.category_key = ?")
+            params.append(turkish_fold(category))
+        return conditions, params
+
+    def search_page(self, term, category=None, cursor=None, limit=20):
+        """Matches ranked by BM25 (name hits weigh most), one keyset page at a time"""
+        if not fts_query(term):
+            return [], None
+        conditions, params = self.search_conditions(term, category)
+        return self._page(f"""
+            SELECT products.*, {self.SEARCH_RANK} AS rank
+            FROM product_search
+            CROSS JOIN products ON products.id = product_search.rowid
+        """, conditions, params, self.SEARCH_KEYSET, cursor, limit)
+
+    def search_count(self, term, category=None):
+        if not fts_query(term):
+            return 0
+        conditions, params = self.search_conditions(term, category)
+        return self._scalar("""
+            SELECT COUNT(*) FROM product_search
+            CROSS JOIN products ON products.id = product_search.rowid
+            WHERE """ + " AND ".join(conditions), params)
+
+    def suggest_terms(self, product_id=None):
+        """(id, name, brand, category_key, score) rows for the autocomplete index"""
+        query = """
+            SELECT products.id, products.name, products.brand, products.category_key,
+                   COALESCE(pp.score, 0) AS score
+            FROM products
+            LEFT JOIN product_popularity pp ON pp.product_id = products.id
+            WHERE products.in_stock = 1
+        """
+        if product_id is None:
+            return self._all(query)
+        return self._all(query + " AND products.id = ?", (product_id,))
+
+    def catalog_rows(self):
+        """Every in-stock product with rating stats and its subcategory_values (JSON array),
+        for the in-process catalog engine"""
+        return self._all("""
+            SELECT products.*, COALESCE(rs.review_count, 0) AS review_count,
+                   COALESCE(ROUND(1.0 * rs.rating_sum / rs.review_count, 1), 0) AS avg_rating,
+                   (SELECT json_group_array(subcategory) FROM product_subcategories ps
+                    WHERE ps.product_id = products.id) AS subcategory_values
+            FROM products
+            LEFT JOIN product_rating_stats rs ON rs.product_id = products.id
+            WHERE products.in_stock = 1
+        """)
+
+    def list_sample(self, limit=10):
+        return self._all("SELECT id, name FROM products LIMIT ?", (limit,))
+
+    def count(self):
+        return self._scalar("SELECT COUNT(*) FROM products")
+
+    def create(self, name, price, image, category, subcategories, description, brand, in_stock=None):
+        subcategory_json = json.dumps(subcategories, ensure_ascii=False)
+        if in_stock is None:
+            cursor = self._write("""
+                INSERT INTO products (name, price, image, category, subcategory, description, brand)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (name, price, image, category, subcategory_json, description, brand))
+        else:
+            cursor = self._write("""
+                INSERT INTO products (name, price, image, category, subcategory, description, brand, in_stock)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (name, price, image, category, subcategory_json, description, brand, in_stock))
+        self.set_subcategories(cursor.lastrowid, subcategories)
+        return cursor.lastrowid
+
+    def update(self, product_id, name, price, image, category, subcategories, description, brand):
+        self._write("""
+            UPDATE products
+            SET name = ?, price = ?, image = ?, category = ?, subcategory = ?, description = ?, brand = ?
+            WHERE id = ?
+        """, (name, price, image, category, json.dumps(subcategories, ensure_ascii=False),
+              description, brand, product_id))
+        self.set_subcategories(product_id, subcategories)
+        self._write("UPDATE product_popularity SET category = ? WHERE product_id = ?",
+                    (turkish_fold(category), product_id))
+
+    def set_subcategories(self, product_id, subcategories):
+        """Replace the product_subcategories rows used for filtering"""
+        self._write("DELETE FROM product_subcategories WHERE product_id = ?", (product_id,))
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO product_subcategories (product_id, subcategory) VALUES (?, ?)",
+            [(product_id, sub) for sub in subcategories if sub])
+
+    def delete(self, product_id):
+        self._write("DELETE FROM product_subcategories WHERE product_id = ?", (product_id,))
+        self._write("DELETE FROM product_popularity WHERE product_id = ?", (product_id,))
+        self._write("DELETE FROM products WHERE id = ?", (product_id,))
+
+    def get_stock(self, product_id):
+        return self._one("SELECT stock_quantity, name FROM products WHERE id = ?", (product_id,))
+
+    def set_stock(self, product_id, quantity, threshold):
+        self._write("""
+            UPDATE products
+            SET stock_quantity = ?,
+                low_stock_threshold = ?,
+                last_restocked = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (quantity, threshold, product_id))
+
+    def adjust_stock(self, product_id, quantity_change):
+        """Apply a stock delta (negative for sales), never going below zero"""
+        self._write("""
+            UPDATE products
+            SET stock_quantity = MAX(0, COALESCE(stock_quantity, 0) + ?),
+                last_restocked = CASE WHEN ? > 0 THEN CURRENT_TIMESTAMP ELSE last_restocked END
+            WHERE id = ?
+        """, (quantity_change, quantity_change, product_id))
+
+    def get_stock_levels(self, product_id):
+        return self._one("SELECT name, stock_quantity, low_stock_threshold FROM products WHERE id = ?", (product_id,))
+
+    # Matches idx_products_stock_page column for column, so pages are read in index order
+    STOCK_KEYSET = Keyset("stock", (
+        ("CASE WHEN COALESCE(p.stock_quantity, 0) <= COALESCE(p.low_stock_threshold, 5) THEN 0 ELSE 1 END", "stock_rank"),
+        ("COALESCE(p.stock_quantity, 0)", "stock_qty"),
+        ("p.name", "name"),
+        ("p.id", "id"),
+    ), False)
+
+    def stock_page(self, cursor=None, limit=50, sales_days=30):
+        """Low stock first, plus units sold over the last `sales_days` days for reorder planning"""
+        return self._page("""
+            SELECT p.id, p.name, p.category, p.brand, p.price, p.stock_quantity,
+                   p.low_stock_threshold, p.last_restocked, p.in_stock,
+                   CASE WHEN COALESCE(p.stock_quantity, 0) <= COALESCE(p.low_stock_threshold, 5) THEN 0 ELSE 1 END AS stock_rank,
+                   COALESCE(p.stock_quantity, 0) AS stock_qty,
+                   COALESCE((
+                       SELECT SUM(oi.quantity)
+                       FROM order_items oi
+                       JOIN orders o ON o.id = oi.order_id
+                       WHERE oi.product_id = p.id AND o.created_at >= datetime('now', ?)
+                   ), 0) AS units_sold
+            FROM products p
+        """, [], [f"-{int(sales_days)} days"], self.STOCK_KEYSET, cursor, limit)
+
+
+class OrderRepository(BaseRepository):
+    def get(self, order_id):
+        return self._one("SELECT * FROM orders WHERE id = ?", (order_id,))
+
+    def get_by_code(self, order_code):
+        return self._one("SELECT * FROM orders WHERE order_code = ?", (order_code,))
+
+    def list_all(self):
+        return self._all("SELECT * FROM orders ORDER BY id DESC")
+
+    KEYSET = Keyset("created", (("created_at", "created_at"), ("id", "id")), True)
+
+    def page(self, cursor=None, limit=50):
+        """Orders newest first, one keyset page at a time"""
+        return self._page("SELECT * FROM orders", [], [], self.KEYSET, cursor, limit)
+
+    def list_recent(self, limit=5):
+        return self._all("SELECT * FROM orders ORDER BY created_at DESC, id DESC LIMIT ?", (limit,))
+
+    def list_for_email(self, email, limit=10):
+        return self._all("""
+            SELECT * FROM orders
+            WHERE customer_email = ?
+            ORDER BY created_at DESC
+            LIMIT ?
+        """, (email, limit))
+
+    def count(self):
+        return self._scalar("SELECT COUNT(*) FROM orders")
+
+    def create(self, order_code, items, total_price, customer_name, phone, email, address, note, status):
+        """Insert the order and one order_items row per cart line"""
+        cursor = self._write("""
+            INSERT INTO orders (order_code, total_price, customer_name, customer_phone, customer_email, customer_address, address, note, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (order_code, total_price, customer_name, phone, email, address, address, note, status))
+        order_id = cursor.lastrowid
+        self.conn.executemany("""
+            INSERT INTO order_items (order_id, product_id, product_name, quantity, unit_price)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(order_id, item["id"], item["name"], item.get("quantity", 1), item["price"]) for item in items])
+        return order_id
+
+    # Order lines use the keys the cart/session dicts had (id, name, price, quantity)
+    ITEM_COLUMNS = "product_id AS id, product_name AS name, unit_price AS price, quantity"
+
+    def list_items(self, order_id):
+        return [dict(row) for row in self._all(f"""
+            SELECT {self.ITEM_COLUMNS} FROM order_items WHERE order_id = ? ORDER BY id
+        """, (order_id,))]
+
+    def items_by_order(self, order_ids):
+        """{order_id: [item, ...]} for a batch of orders in a single query"""
+        grouped = {order_id: [] for order_id in order_ids}
+        if not grouped:
+            return grouped
+        rows = self._all(f"""
+            SELECT order_id, {self.ITEM_COLUMNS} FROM order_items
+            WHERE order_id IN (SELECT value FROM json_each(?))
+            ORDER BY order_id, id
+        """, (json.dumps(list(grouped)),))
+        for row in rows:
+            item = dict(row)
+            grouped[item.pop("order_id")].append(item)
+        return grouped
+
+    def best_sellers(self, limit=10, days=None):
+        """Products by units sold, optionally only over the last `days` days"""
+        query = """
+            SELECT oi.product_id AS id, MAX(oi.product_name) AS name,
+                   SUM(oi.quantity) AS units_sold,
+                   SUM(oi.quantity * oi.unit_price) AS revenue
+            FROM order_items oi
+        """
+        params = []
+        if days:
+            query += " JOIN orders o ON o.id = oi.order_id WHERE o.created_at >= datetime('now', ?)"
+            params.append(f"-{int(days)} days")
+        query += " GROUP BY oi.product_id ORDER BY units_sold DESC, revenue DESC LIMIT ?"
+        params.append(limit)
+        return self._all(query, params)
+
+    def update_status(self, order_id, status):
+        self._write("UPDATE orders SET status = ? WHERE id = ?", (status, order_id))
+
+    def update_status_and_shipping(self, order_id, status, shipping_company, tracking_number):
+        self._write("""
+            UPDATE orders SET status = ?, shipping_company = ?, tracking_number = ? WHERE id = ?
+        """, (status, shipping_company, tracking_number, order_id))
+
+    SHIPPING_FIELDS = ("shipping_company", "tracking_number")
+
+    def update_shipping_field(self, order_id, field, value):
+        if field not in self.SHIPPING_FIELDS:
+            raise ValueError(f"Invalid shipping field: {field}")
+        self._write(f"UPDATE orders SET {field} = ? WHERE id = ?", (value, order_id))
+
+
+class UserRepository(BaseRepository):
+    def get(self, user_id):
+        return self._one("""
+            SELECT id, email, first_name, last_name, phone, address, created_at, last_login, balance
+            FROM users WHERE id = ? AND is_active = 1
+        """, (user_id,))
+
+    def get_credentials(self, email):
+        return self._one("""
+            SELECT id, password_hash, first_name, last_name, is_active
+            FROM users WHERE email = ?
+        """, (email,))
+
+    def exists(self, email):
+        return self._one("SELECT id FROM users WHERE email = ?", (email,)) is not None
+
+    def create(self, email, password_hash, first_name, last_name, phone=None, address=None):
+        cursor = self._write("""
+            INSERT INTO users (email, password_hash, first_name, last_name, phone, address)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (email, password_hash, first_name, last_name, phone, address))
+        return cursor.lastrowid
+
+    def touch_last_login(self, user_id):
+        self._write("UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?", (user_id,))
+
+    def update_profile(self, user_id, first_name, last_name, phone=None, address=None):
+        self._write("""
+            UPDATE users
+            SET first_name = ?, last_name = ?, phone = ?, address = ?
+            WHERE id = ?
+        """, (first_name, last_name, phone, address, user_id))
+
+    def get_balance(self, user_id):
+        return self._one("SELECT balance, first_name, last_name FROM users WHERE id = ?", (user_id,))
+
+    def set_balance(self, user_id, balance):
+        self._write("UPDATE users SET balance = ? WHERE id = ?", (balance, user_id))
+
+    def deduct_balance(self, user_id, amount):
+        self._write("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id))
+
+
+class ReviewRepository(BaseRepository):
+    def list_for_product(self, product_id, limit=None):
+        query = """
+            SELECT r.*, u.first_name, u.last_name
+            FROM reviews r
+            JOIN users u ON r.user_id = u.id
+            WHERE r.product_id = ?
+            ORDER BY r.created_at DESC
+        """
+        params = [product_id]
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        return self._all(query, params)
+
+    def list_for_user(self, user_id):
+        return self._all("""
+            SELECT r.*, p.name as product_name, p.image as product_image
+            FROM reviews r
+            JOIN products p ON r.product_id = p.id
+            WHERE r.user_id = ?
+            ORDER BY r.created_at DESC
+        """, (user_id,))
+
+    def has_reviewed(self, user_id, product_id):
+        return self._one("SELECT id FROM reviews WHERE user_id = ? AND product_id = ?",
+                         (user_id, product_id)) is not None
+
+    def stats(self, product_id):
+        """Review count, average and 1-5 distribution from product_rating_stats"""
+        row = self._one("SELECT * FROM product_rating_stats WHERE product_id = ?", (product_id,))
+        count = row["review_count"] if row else 0
+        return {
+            "total_reviews": count,
+            "average_rating": round(row["rating_sum"] / count, 1) if count else 0,
+            "rating_distribution": {star: (row[f"rating_{star}"] if row else 0) for star in range(1, 6)},
+        }
+
+    def catalog_ratings(self):
+        """(product_id, review_count, avg_rating) of every reviewed product, rounded like catalog_rows()"""
+        return self._all("""
+            SELECT product_id, review_count, ROUND(1.0 * rating_sum / review_count, 1) AS avg_rating
+            FROM product_rating_stats WHERE review_count > 0
+        """)
+
+    def create(self, user_id, product_id, rating, title=None, comment=None):
+        cursor = self._write("""
+            INSERT INTO reviews (user_id, product_id, rating, title, comment)
+            VALUES (?, ?, ?, ?, ?)
+        """, (user_id, product_id, rating, title, comment))
+        return cursor.lastrowid
+
+
+class WishlistRepository(BaseRepository):
+    def list_for_user(self, user_id):
+        return self._all("""
+            SELECT p.*, w.created_at as added_date
+            FROM wishlist w
+            JOIN products p ON w.product_id = p.id
+            WHERE w.user_id = ? AND p.in_stock = 1
+            ORDER BY w.created_at DESC
+        """, (user_id,))
+
+    def count_for_user(self, user_id):
+        return self._scalar("SELECT COUNT(*) FROM wishlist WHERE user_id = ?", (user_id,))
+
+    def contains(self, user_id, product_id):
+        return self._one("SELECT id FROM wishlist WHERE user_id = ? AND product_id = ?",
+                         (user_id, product_id)) is not None
+
+    def get_product_name(self, user_id, product_id):
+        return self._scalar("""
+            SELECT p.name FROM wishlist w
+            JOIN products p ON w.product_id = p.id
+            WHERE w.user_id = ? AND w.product_id = ?
+        """, (user_id, product_id))
+
+    def add(self, user_id, product_id):
+        self._write("INSERT INTO wishlist (user_id, product_id) VALUES (?, ?)", (user_id, product_id))
+
+    def remove(self, user_id, product_id):
+        self._write("DELETE FROM wishlist WHERE user_id = ? AND product_id = ?", (user_id, product_id))
+
+
+class MessageRepository(BaseRepository):
+    def list_all(self):
+        return self._all("SELECT * FROM messages ORDER BY created_at DESC")
+
+    KEYSET = Keyset("created", (("created_at", "created_at"), ("id", "id")), True)
+
+    def page(self, cursor=None, limit=50):
+        return self._page("SELECT * FROM messages", [], [], self.KEYSET, cursor, limit)
+
+    def count(self):
+        return self._scalar("SELECT COUNT(*) FROM messages")
+
+    def create(self, name, email, phone, message):
+        self._write("INSERT INTO messages (name, email, phone, message) VALUES (?, ?, ?, ?)",
+                    (name, email, phone, message))
+
+
+class CampaignRepository(BaseRepository):
+    def list_all(self):
+        return self._all("SELECT * FROM campaigns ORDER BY id DESC")
+
+    def list_active(self):
+        return self._all("SELECT * FROM campaigns WHERE active = 1")
+
+    def count(self):
+        return self._scalar("SELECT COUNT(*) FROM campaigns")
+
+    def create(self, image, link, title, description, active, created_at):
+        self._write("""
+            INSERT INTO campaigns (image, link, title, description, active, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (image, link, title, description, active, created_at))
+
+    def delete(self, campaign_id):
+        self._write("DELETE FROM campaigns WHERE id = ?", (campaign_id,))
+
+    def toggle(self, campaign_id):
+        """Flip the active flag; returns the new state or None if not found"""
+        active = self._scalar("SELECT active FROM campaigns WHERE id = ?", (campaign_id,))
+        if active is None:
+            return None
+        new_status = 0 if active else 1
+        self._write("UPDATE campaigns SET active = ? WHERE id = ?", (new_status, campaign_id))
+        return new_status
+
+
+class NewsletterRepository(BaseRepository):
+    def get(self, email):
+        return self._one("SELECT id, is_active FROM newsletter_subscriptions WHERE email = ?", (email,))
+
+    def subscribe(self, email):
+        self._write("INSERT INTO newsletter_subscriptions (email) VALUES (?)", (email,))
+
+    def reactivate(self, email):
+        self._write("""
+            UPDATE newsletter_subscriptions
+            SET is_active = 1, unsubscribed_at = NULL
+            WHERE email = ?
+        """, (email,))
+
+    def unsubscribe(self, email):
+        """Deactivate an active subscription; returns False if there was none"""
+        cursor = self._write("""
+            UPDATE newsletter_subscriptions
+            SET is_active = 0, unsubscribed_at = CURRENT_TIMESTAMP
+            WHERE email = ? AND is_active = 1
+        """, (email,))
+        return cursor.rowcount > 0
+
+
+class PopularityRepository(BaseRepository):
+    """Forward-decayed popularity scores.
+
+    Every event adds weight * 2 ** ((t - landmark) / half_life) to the
+    product's score, so older events weigh exponentially less relative to new
+    ones without ever rewriting existing rows, and ORDER BY score stays an
+    index scan. When the multiplier grows too large, scores are rescaled and
+    the landmark moves forward.
+    """
+    HALF_LIFE = 7 * 24 * 3600  # seconds
+    MAX_EXPONENT = 256
+    WEIGHTS = {"view": 1.0, "wishlist": 3.0, "review": 4.0, "order": 10.0}
+    COUNTERS = {"view": "views", "wishlist": "wishlist_adds", "review": "reviews", "order": "units_sold"}
+
+    def landmark(self):
+        return self._scalar("SELECT landmark FROM product_popularity_meta WHERE id = 1")
+
+    def top(self, category=None, limit=10):
+        """In-stock products by decayed score, via idx_product_popularity_category_score"""
+        query = """
+            SELECT p.* FROM product_popularity pp
+            JOIN products p ON p.id = pp.product_id
+            WHERE p.in_stock = 1
+        """
+        params = []
+        if category:
+            query += " AND pp.category = ?"
+            params.append(turkish_fold(category))
+        query += " ORDER BY pp.score DESC LIMIT ?"
+        params.append(limit)
+        return self._all(query, params)
+
+    def decay_factor(self, timestamp=None):
+        """Multiplier for an event at `timestamp`, rebasing the landmark first if needed"""
+        timestamp = timestamp or time.time()
+        landmark = self.landmark()
+        exponent = (timestamp - landmark) / self.HALF_LIFE
+        if exponent > self.MAX_EXPONENT:
+            self._write("UPDATE product_popularity SET score = score / ?", (2.0 ** exponent,))
+            self._write("UPDATE product_popularity_meta SET landmark = ? WHERE id = 1", (timestamp,))
+            exponent = 0.0
+        return 2.0 ** exponent
+
+    def record(self, product_id, event, count=1, timestamp=None):
+        self.record_many([(product_id, event, count)], timestamp)
+
+    def record_many(self, events, timestamp=None):
+        """Apply (product_id, event, count) tuples in one pass"""
+        factor = self.decay_factor(timestamp)
+        for product_id, event, count in events:
+            counter = self.COUNTERS[event]
+            self._write(f"""
+                INSERT INTO product_popularity (product_id, category, score, {counter})
+                SELECT id, category_key, ?, ? FROM products WHERE id = ?
+                ON CONFLICT(product_id) DO UPDATE SET
+                    score = score + excluded.score,
+                    {counter} = {counter} + excluded.{counter}
+            """, (self.WEIGHTS[event] * count * factor, count, product_id))
+
+
+class Repository:
+    """All repositories bound to one connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.products = ProductRepository(conn)
+        self.orders = OrderRepository(conn)
+        self.users = UserRepository(conn)
+        self.reviews = ReviewRepository(conn)
+        self.wishlist = WishlistRepository(conn)
+        self.messages = MessageRepository(conn)
+        self.campaigns = CampaignRepository(conn)
+        self.newsletter = NewsletterRepository(conn)
+        self.popularity = PopularityRepository(conn)
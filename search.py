@@ -0,0 +1,383 @@
+"""In-memory search indexes: prefix autocomplete and trigram typo fallback.
+
+Product names and brands are folded the same way as the product_search FTS
+index and stored in one sorted array of keys. Every word start of a term gets
+its own key ("royal canin kitten", "canin kitten", "kitten"), so typing any
+word of a name finds it. A prefix query is a bisect into the array plus a
+short forward scan, without touching SQLite.
+
+TrigramIndex catches what FTS cannot: "wiskas", "pedigri" or "royl canin".
+Every word of a name/brand is split into padded trigrams; a misspelled query
+word is matched to catalog words by shared trigrams and the products holding
+those words are ranked by similarity.
+
+SearchResultCache memoizes whole /api/search responses for repeated queries.
+
+Both indexes are built once per worker and patched per product when the admin
+adds, edits or deletes one; a full rebuild happens at most every `max_age`
+seconds to pick up changes made by other workers.
+"""
+import heapq
+import re
+import math
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+
+from repository import search_fold, turkish_fold
+
+
+def suggest_fold(text):
+    """Lowercase, ı -> i and no diacritics: 'Köpek Maması' -> 'kopek mamasi'"""
+    text = search_fold(turkish_fold(text))
+    decomposed = unicodedata.normalize("NFKD", text)
+    return " ".join("".join(ch for ch in decomposed if not unicodedata.combining(ch)).split())
+
+
+def word_suffixes(key):
+    """'royal canin kitten' -> ['royal canin kitten', 'canin kitten', 'kitten']"""
+    words = key.split(" ")
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+def popularity_weight(score):
+    """Dampened popularity so one best seller does not bury every other match"""
+    return 1.0 + math.log1p(max(score or 0.0, 0.0))
+
+
+class CatalogIndex:
+    """Shared build/refresh logic; subclasses implement _load, _add and _remove"""
+
+    def __init__(self, loader, max_age=300.0):
+        self.loader = loader  # () -> iterable of (id, name, brand, category_key, score)
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._built_at = 0.0
+        self._stats = {"queries": 0, "rebuilds": 0, "patches": 0}
+
+    def rebuild(self):
+        rows = list(self.loader())
+        with self._lock:
+            self._load(rows)
+            self._built_at = time.time()
+            self._stats["rebuilds"] += 1
+
+    def _ensure_fresh(self):
+        if time.time() - self._built_at <= self.max_age:
+            return
+        # Only one thread reloads; the others keep answering from the old data
+        if self._build_lock.acquire(blocking=not self._built_at):
+            try:
+                if time.time() - self._built_at > self.max_age:
+                    self.rebuild()
+            finally:
+                self._build_lock.release()
+
+    def expire(self):
+        """Reload on next use, e.g. after another worker changed the catalog"""
+        self._built_at = 0.0
+
+    def remove_product(self, product_id):
+        with self._lock:
+            if self._remove(product_id):
+                self._patched()
+
+    def upsert_product(self, product_id, name, brand, category_key, score=0.0, in_stock=True):
+        with self._lock:
+            self._remove(product_id)
+            if in_stock:
+                self._add(product_id, name, brand, category_key or "", score)
+            self._patched()
+
+    def _patched(self):
+        self._stats["patches"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats, age_seconds=round(time.time() - self._built_at, 1))
+
+
+class PrefixIndex(CatalogIndex):
+    # Short prefixes match a large part of the catalog; cache their answers
+    MEMO_PREFIX_LENGTH = 2
+    # Upper bound on entries scanned per query, so a one-letter query stays cheap
+    MAX_SCAN = 5000
+
+    def __init__(self, loader, max_age=300.0):
+        super().__init__(loader, max_age)
+        self._keys = []      # sorted folded keys
+        self._entries = []   # (key, entry_id) parallel to _keys
+        self._terms = {}     # entry_id -> [display, category_key, weight]
+        self._products = {}  # product_id -> (name entry id, brand entry id or None, weight)
+        self._brand_counts = {}  # brand entry id -> number of products
+        self._memo = {}
+        self._stats["memo_hits"] = 0
+
+    def _load(self, rows):
+        self._terms, self._products, self._brand_counts = {}, {}, {}
+        pairs = []
+        for product_id, name, brand, category_key, score in rows:
+            pairs.extend(self._register(product_id, name, brand, category_key or "", score))
+        pairs.sort()
+        self._keys = [key for key, _ in pairs]
+        self._entries = pairs
+        self._memo.clear()
+
+    def _register(self, product_id, name, brand, category_key, score):
+        """Record the product's terms and return the (key, entry_id) pairs to insert"""
+        weight = popularity_weight(score)
+        pairs = []
+        name_entry = ("name", product_id)
+        self._terms[name_entry] = [name, category_key, weight]
+        pairs.extend((key, name_entry) for key in word_suffixes(suggest_fold(name)))
+
+        brand_entry = None
+        if brand:
+            brand_entry = ("brand", category_key, suggest_fold(brand))
+            if brand_entry in self._terms:
+                self._terms[brand_entry][2] += weight
+            else:
+                self._terms[brand_entry] = [brand, category_key, weight]
+                pairs.extend((key, brand_entry) for key in word_suffixes(brand_entry[2]))
+            self._brand_counts[brand_entry] = self._brand_counts.get(brand_entry, 0) + 1
+        self._products[product_id] = (name_entry, brand_entry, weight)
+        return pairs
+
+    def _add(self, product_id, name, brand, category_key, score):
+        for pair in self._register(product_id, name, brand, category_key, score):
+            index = bisect_left(self._entries, pair)
+            self._entries.insert(index, pair)
+            self._keys.insert(index, pair[0])
+
+    def _remove(self, product_id):
+        registered = self._products.pop(product_id, None)
+        if not registered:
+            return False
+        name_entry, brand_entry, weight = registered
+        name = self._terms.pop(name_entry)[0]
+        self._discard(name_entry, word_suffixes(suggest_fold(name)))
+        if brand_entry:
+            self._brand_counts[brand_entry] -= 1
+            self._terms[brand_entry][2] -= weight
+            if self._brand_counts[brand_entry] <= 0:
+                del self._brand_counts[brand_entry]
+                del self._terms[brand_entry]
+                self._discard(brand_entry, word_suffixes(brand_entry[2]))
+        return True
+
+    def _discard(self, entry, keys):
+        """Drop the entry's (key, entry) pairs, located by bisect like _add inserts them"""
+        for key in keys:
+            index = bisect_left(self._entries, (key, entry))
+            if index < len(self._entries) and self._entries[index] == (key, entry):
+                del self._entries[index]
+                del self._keys[index]
+
+    def _patched(self):
+        self._memo.clear()
+        super()._patched()
+
+    # -- queries ----------------------------------------------------------
+
+    def suggest(self, prefix, category_key=None, limit=8):
+        """Top `limit` names/brands with a word starting with `prefix`, best weight first"""
+        folded = suggest_fold(prefix)
+        if not folded:
+            return []
+        self._ensure_fresh()
+        memo_key = (folded, category_key, limit) if len(folded) <= self.MEMO_PREFIX_LENGTH else None
+        with self._lock:
+            self._stats["queries"] += 1
+            if memo_key in self._memo:
+                self._stats["memo_hits"] += 1
+                return self._memo[memo_key]
+
+            seen = set()
+            candidates = []
+            start = bisect_left(self._keys, folded)
+            for key, entry in self._entries[start:start + self.MAX_SCAN]:
+                if not key.startswith(folded):
+                    break
+                if entry in seen:
+                    continue
+                seen.add(entry)
+                display, entry_category, weight = self._terms[entry]
+                if category_key and entry_category != category_key:
+                    continue
+                candidates.append((weight, -len(display), display))
+
+            result = []
+            for _, _, display in heapq.nlargest(limit * 2, candidates):
+                if display not in result:
+                    result.append(display)
+            result = result[:limit]
+            if memo_key:
+                self._memo[memo_key] = result
+            return result
+
+    def get_stats(self):
+        with self._lock:
+            return dict(super().get_stats(), keys=len(self._keys), products=len(self._products))
+
+
+class TrigramIndex(CatalogIndex):
+    # Word similarity (shared / union trigrams) needed to count as a match
+    WORD_THRESHOLD = 0.3
+    # Minimum average similarity over the query words for a product
+    PRODUCT_THRESHOLD = 0.3
+    # Catalog words compared per query word, best trigram overlap first
+    MAX_CANDIDATES = 50
+    # Query words shorter than this carry too few trigrams to correct
+    MIN_WORD_LENGTH = 3
+
+    def __init__(self, loader, max_age=300.0):
+        super().__init__(loader, max_age)
+        self._grams = {}     # trigram -> set of words
+        self._words = {}     # word -> set of product ids
+        self._products = {}  # product_id -> (words, category_key, weight)
+
+    @staticmethod
+    def trigrams(word):
+        padded = f"  {word} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    @staticmethod
+    def words(text):
+        return set(re.findall(r"\w+", suggest_fold(text or "")))
+
+    def _load(self, rows):
+        self._grams, self._words, self._products = {}, {}, {}
+        for product_id, name, brand, category_key, score in rows:
+            self._add(product_id, name, brand, category_key or "", score)
+
+    def _add(self, product_id, name, brand, category_key, score):
+        words = self.words(name) | self.words(brand)
+        for word in words:
+            if word not in self._words:
+                self._words[word] = set()
+                for gram in self.trigrams(word):
+                    self._grams.setdefault(gram, set()).add(word)
+            self._words[word].add(product_id)
+        self._products[product_id] = (words, category_key, popularity_weight(score))
+
+    def _remove(self, product_id):
+        registered = self._products.pop(product_id, None)
+        if not registered:
+            return False
+        for word in registered[0]:
+            holders = self._words[word]
+            holders.discard(product_id)
+            if not holders:
+                del self._words[word]
+                for gram in self.trigrams(word):
+                    self._grams[gram].discard(word)
+                    if not self._grams[gram]:
+                        del self._grams[gram]
+        return True
+
+    def _similar_words(self, word):
+        """{catalog word: similarity} for the words sharing enough trigrams with `word`"""
+        grams = self.trigrams(word)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._grams.get(gram, ()))
+        similar = {}
+        for candidate, overlap in shared.most_common(self.MAX_CANDIDATES):
+            similarity = overlap / (len(grams) + len(self.trigrams(candidate)) - overlap)
+            if similarity >= self.WORD_THRESHOLD:
+                similar[candidate] = similarity
+        return similar
+
+    def search(self, term, category_key=None, limit=20, exclude=()):
+        """[(product_id, similarity)] for near matches of `term`, best first"""
+        query_words = [w for w in re.findall(r"\w+", suggest_fold(term)) if len(w) >= self.MIN_WORD_LENGTH]
+        if not query_words:
+            return []
+        self._ensure_fresh()
+        with self._lock:
+            self._stats["queries"] += 1
+            scores = Counter()
+            for word in query_words:
+                best = {}
+                for candidate, similarity in self._similar_words(word).items():
+                    for product_id in self._words[candidate]:
+                        if similarity > best.get(product_id, 0.0):
+                            best[product_id] = similarity
+                scores.update(best)
+
+            ranked = []
+            for product_id, total in scores.items():
+                similarity = total / len(query_words)
+                words, product_category, weight = self._products[product_id]
+                if similarity < self.PRODUCT_THRESHOLD or product_id in exclude:
+                    continue
+                if category_key and product_category != category_key:
+                    continue
+                ranked.append((similarity, weight, product_id))
+            return [(product_id, round(similarity, 3))
+                    for similarity, weight, product_id in heapq.nlargest(limit, ranked)]
+
+    def get_stats(self):
+        with self._lock:
+            return dict(super().get_stats(), words=len(self._words), trigrams=len(self._grams))
+
+
+class SearchResultCache:
+    """LRU of search responses keyed by normalized query, category and mode.
+
+    Entries expire after `ttl` seconds and are dropped when `version()` --
+    the catalog version, bumped on every product change -- moves on.
+    """
+
+    def __init__(self, version, max_size=1000, ttl=300.0):
+        self.version = version
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (version, expires_at, value)
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    @staticmethod
+    def key(query, category_key=None, mode="full", *extra):
+        """'  Köpek MAMASI ' and 'kopek mamasi' share one entry"""
+        return (suggest_fold(query), category_key or "", mode) + extra
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            version, expires_at, value = entry
+            if version != self.version() or time.time() > expires_at:
+                del self._entries[key]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key, value, version=None):
+        """Store value; pass the version read before computing it so a product
+        change during the search leaves the entry already stale"""
+        with self._lock:
+            self._entries[key] = (self.version() if version is None else version,
+                                  time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(self._stats, size=len(self._entries),
+                        hit_rate=round(self._stats["hits"] / lookups, 3) if lookups else None)
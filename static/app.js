@@ -322,6 +322,31 @@ const PetShopApp = {
       this.hideSuggestions();
     },
     
+    showResult(query, result) {
+      const products = PetShopApp.products;
+      products.displayProducts(result.products);
+      if (result.products.length) {
+        products.showLoadMore(result.nextCursor, (cursor) => this.loadMore(query, result, cursor));
+      }
+      
+      // Update product count
+      const productCount = document.getElementById('productCount');
+      if (productCount) {
+        productCount.textContent = `${result.total} ürün bulundu`;
+      }
+    },
+    
+    async loadMore(query, result, cursor) {
+      const response = await fetch(`/api/search?q=${encodeURIComponent(query)}&cursor=${encodeURIComponent(cursor)}`);
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      const data = await response.json();
+      result.products = result.products.concat(data.products);
+      result.nextCursor = data.next_cursor;
+      return data;
+    },
+    
     async performSearch(query) {
       if (!query || query.length < 2) return;
       
@@ -336,7 +361,7 @@ const PetShopApp = {
       
       // Check cache first
       if (this.cache.has(cacheKey)) {
-        PetShopApp.products.displayProducts(this.cache.get(cacheKey));
+        this.showResult(query, this.cache.get(cacheKey));
         PetShopApp.performance.mark('search-end');
         PetShopApp.performance.measure('search-cached', 'search-start', 'search-end');
         return;
@@ -360,14 +385,10 @@ const PetShopApp = {
         const data = await response.json();
         
         if (data.products) {
-          this.cache.set(cacheKey, data.products);
-          PetShopApp.products.displayProducts(data.products);
-          
-          // Update product count
-          const productCount = document.getElementById('productCount');
-          if (productCount) {
-            productCount.textContent = `${data.count} ürün bulundu`;
-          }
+          // count (with fuzzy matches) is the total over all pages, sent with the first one
+          const result = { products: data.products, nextCursor: data.next_cursor, total: data.count };
+          this.cache.set(cacheKey, result);
+          this.showResult(query, result);
         } else {
           PetShopApp.products.showNoResults();
         }
@@ -419,8 +440,7 @@ const PetShopApp = {
       
       // Check cache first
       if (this.cache.has(cacheKey)) {
-        this.displayProducts(this.cache.get(cacheKey));
-        this.updateProductCount(this.cache.get(cacheKey).length);
+        this.showResult(this.cache.get(cacheKey), (cursor) => this.loadMoreFiltered(params, cacheKey, cursor));
         PetShopApp.performance.mark('filter-end');
         PetShopApp.performance.measure('filter-cached', 'filter-start', 'filter-end');
         return;
@@ -444,10 +464,14 @@ const PetShopApp = {
         const data = await response.json();
         
         if (data.products) {
-          // Cache the result
-          this.cache.set(cacheKey, data.products);
-          this.displayProducts(data.products);
-          this.updateProductCount(data.count || data.products.length);
+          // Cache the result; later pages are appended to it by loadMoreFiltered
+          const result = {
+            products: data.products,
+            nextCursor: data.next_cursor,
+            total: data.facets ? data.facets.total : data.products.length
+          };
+          this.cache.set(cacheKey, result);
+          this.showResult(result, (cursor) => this.loadMoreFiltered(params, cacheKey, cursor));
         } else {
           this.showNoResults();
           this.updateProductCount(0);
@@ -465,6 +489,69 @@ const PetShopApp = {
       }
     },
     
+    // The APIs return one keyset page plus next_cursor; the rest comes in via "Daha fazla göster"
+    showResult(result, loadMore) {
+      this.displayProducts(result.products);
+      this.updateProductCount(result.total);
+      if (result.products.length) {
+        this.showLoadMore(result.nextCursor, loadMore);
+      }
+    },
+    
+    async loadMoreFiltered(params, cacheKey, cursor) {
+      const pageParams = new URLSearchParams(params);
+      pageParams.set('cursor', cursor);
+      const response = await fetch(`${PetShopApp.config.apiEndpoints.filterProducts}?${pageParams.toString()}`);
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      const data = await response.json();
+      const result = this.cache.get(cacheKey);
+      if (result) {
+        result.products = result.products.concat(data.products);
+        result.nextCursor = data.next_cursor;
+      }
+      return data;
+    },
+    
+    showLoadMore(nextCursor, loadMore) {
+      const productList = document.getElementById('productList');
+      const existing = document.getElementById('loadMoreProducts');
+      if (existing) existing.remove();
+      if (!productList || !nextCursor) return;
+      
+      const row = document.createElement('div');
+      row.id = 'loadMoreProducts';
+      row.className = 'col-12 text-center py-3';
+      row.innerHTML = '<button type="button" class="btn btn-outline-primary">Daha fazla göster</button>';
+      const button = row.querySelector('button');
+      button.addEventListener('click', async () => {
+        button.disabled = true;
+        button.textContent = 'Yükleniyor...';
+        try {
+          const data = await loadMore(nextCursor);
+          this.appendProducts(data.products || []);
+          this.showLoadMore(data.next_cursor, loadMore);
+        } catch (error) {
+          console.error('Load more error:', error);
+          button.disabled = false;
+          button.textContent = 'Daha fazla göster';
+        }
+      });
+      productList.appendChild(row);
+    },
+    
+    appendProducts(products) {
+      const productList = document.getElementById('productList');
+      if (!productList || !products.length) return;
+      
+      const fragment = document.createDocumentFragment();
+      products.forEach(product => fragment.appendChild(this.createProductElement(product)));
+      const loadMoreRow = document.getElementById('loadMoreProducts');
+      productList.insertBefore(fragment, loadMoreRow);
+      this.initLazyLoading();
+    },
+    
     updateProductCount(count) {
       const productCount = document.getElementById('productCount');
       if (productCount) {
@@ -645,6 +732,9 @@ const PetShopApp = {
       const brandBadge = product.brand 
         ? `<span class="badge bg-secondary ms-2">${product.brand}</span>` 
         : '';
+      const ratingText = product.review_count 
+        ? `<small class="text-warning mb-2">⭐ ${product.avg_rating} (${product.review_count})</small>` 
+        : '';
       
       div.innerHTML = `
         <div class="card product-card h-100">
@@ -659,6 +749,7 @@ const PetShopApp = {
             <h5 class="card-title">${product.name}${brandBadge}</h5>
             <p class="text-muted">${product.category} / ${subcategoryText}</p>
             <h6 class="text-success">${product.price} TL</h6>
+            ${ratingText}
             <div class="d-flex gap-2 mt-auto">
               <a href="/add_to_cart/${product.id}" 
                  class="btn add-to-cart-btn flex-grow-1"